@@ -0,0 +1,206 @@
+"""
+Regression benchmarks of the non-science code every job runs.
+
+* ``render <process>``: rendering the recipe template of every process,
+* ``get_output <process>``: finding every output of a process with the
+  filters of its handler in a synthetic output tree,
+* ``compress_output``: building the archive of the whole output tree,
+* ``lookup hit`` and ``lookup miss``: result store lookups of the
+  materialised processes.
+
+The output tree is written once per ``--size`` below ``--root`` and reused
+(small: 1000 files, 50 MB; medium: 10000 files, 500 MB; large: 50000 files,
+4 GB). Every benchmark is repeated ``--repeat`` times and the median time
+per call is compared with the baseline of the size in ``baselines.json``.
+The script exits with 1 if a benchmark is more than ``--threshold`` slower
+than its baseline. ``--save`` stores the results as the new baselines.
+
+    $ python benchmarks/hot_paths.py --size small
+    $ python benchmarks/hot_paths.py --size large --root /scratch/bench --save
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+
+import yaml
+from pywps import configuration
+
+from copernicus import fake
+from copernicus import runner
+from copernicus import testdata
+from copernicus import materialize
+from copernicus.cache import Cache
+from copernicus.wsgi import config_files
+from copernicus.processes import processes
+
+MB = 1024 * 1024
+# files and bytes of the output tree
+SIZES = dict(small=(1000, 50 * MB), medium=(10000, 500 * MB), large=(50000, 4096 * MB))
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+# stored results per materialised process
+CACHE_ENTRIES = 200
+
+
+def configure(root):
+    configuration.load_configuration(config_files())
+    configuration.CONFIG.set('cache', 'cache_root', os.path.join(root, 'cache'))
+    configuration.CONFIG.set('cache', 'result_max_age', '')
+    configuration.CONFIG.set('logging', 'level', 'WARNING')
+    logging.getLogger('PYWPS').setLevel(logging.ERROR)
+
+
+def lookups(process):
+    """The (plots or work, path filter, name filter, format, file) of the outputs of a process."""
+    recipe = yaml.safe_load(testdata.render_recipe(process))
+    found = []
+    for _, diag_name, script_name in fake.tasks(recipe):
+        if script_name is None:
+            continue
+        patterns, token = fake.patterns(recipe, diag_name, script_name)
+        for kind, pattern in patterns:
+            name, ext = os.path.splitext(os.path.basename(pattern))
+            path_filter = os.path.join(diag_name, script_name, os.path.dirname(pattern))
+            output = os.path.join(diag_name, script_name, fake.output_name(pattern, token))
+            found.append((kind, path_filter, name, ext[1:], output))
+    return found
+
+
+def build_tree(root, files, size):
+    """Write the outputs of all processes and filler files up to files and size below root."""
+    marker = os.path.join(root, '.complete')
+    outputs = []
+    for process in processes:
+        if not testdata.has_recipe(process):
+            continue
+        for kind, _, _, _, output in lookups(process):
+            outputs.append(os.path.join(root, process.identifier, kind, output))
+    if os.path.exists(marker):
+        return
+    # the filler files are spread over the directories of the outputs
+    dirs = sorted(set(os.path.dirname(path) for path in outputs))
+    filler = max(0, files - len(outputs))
+    file_size = size // max(1, files)
+    for path in outputs:
+        fake.write_file(path, file_size)
+    for index in range(filler):
+        fake.write_file(os.path.join(dirs[index % len(dirs)], 'extra_{:06d}.dat'.format(index)), file_size)
+    with open(marker, 'w') as fp:
+        json.dump(dict(files=files, size=size), fp)
+
+
+def fill_cache(root):
+    """Store results of the materialised processes, return (hits, misses) as (process, inputs)."""
+    hits, misses = [], []
+    dummy = os.path.join(root, 'result.zip')
+    fake.write_file(dummy, 1024)
+    for identifier in materialize.MATERIALIZED_PROCESSES:
+        process = [p for p in processes if p.identifier == identifier][0].load()
+        fingerprint = materialize.fingerprint(process)
+        cache = Cache(materialize.CACHE_NAMESPACE)
+        for inputs in materialize.combinations(process, limit=CACHE_ENTRIES):
+            key = materialize.result_key(process, inputs)
+            if cache.meta(key) is None:
+                cache.put(key, dict(archive=dummy), meta=dict(
+                    fingerprint=fingerprint, inputs=inputs, formats=dict(archive='application/zip'),
+                    literals={}, created=time.time()))
+            hits.append((process, inputs))
+            misses.append((process, dict(inputs, missing='missing')))
+    return hits, misses
+
+
+def benchmarks(root, tree):
+    found = []
+    for process in processes:
+        if not testdata.has_recipe(process):
+            continue
+        found.append(('render ' + process.identifier, lambda process=process: testdata.render_recipe(process)))
+        filters = [(os.path.join(tree, process.identifier, kind), path_filter, name, ext)
+                   for kind, path_filter, name, ext, _ in lookups(process)]
+
+        def get_outputs(filters=filters):
+            for output_dir, path_filter, name, ext in filters:
+                runner.get_output(output_dir, path_filter=path_filter, name_filter=name, output_format=ext)
+        found.append(('get_output ' + process.identifier, get_outputs))
+    archive = os.path.join(root, 'archive.zip')
+    found.append(('compress_output', lambda: runner.compress_output(tree, archive)))
+    hits, misses = fill_cache(root)
+    found.append(('lookup hit', lambda: [materialize.lookup(process, inputs) for process, inputs in hits]))
+    found.append(('lookup miss', lambda: [materialize.lookup(process, inputs) for process, inputs in misses]))
+    return found
+
+
+def measure(function, repeat):
+    """Median and minimum seconds per call."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    times = [value / number for value in timer.repeat(repeat, number)]
+    return dict(median=statistics.median(times), min=min(times), number=number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--root', default=os.path.join(tempfile.gettempdir(), 'copernicus-bench'))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='tolerated slow-down relative to the baseline')
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--save', action='store_true', help='store the results as baselines')
+    parser.add_argument('-k', dest='select', help='run only benchmarks containing this text')
+    args = parser.parse_args()
+
+    root = os.path.join(args.root, args.size)
+    configure(root)
+    files, size = SIZES[args.size]
+    tree = os.path.join(root, 'tree')
+    started = time.time()
+    build_tree(tree, files, size)
+    print("output tree {} ({} files, {} MB) ready after {:.1f}s".format(tree, files, size // MB, time.time() - started))
+
+    try:
+        with open(args.baselines) as fp:
+            baselines = json.load(fp)
+    except (IOError, OSError, ValueError):
+        baselines = {}
+    baseline = baselines.get(args.size, {}).get('results', {})
+
+    results, regressions = {}, []
+    print("{:<36} {:>11} {:>11} {:>8}".format('benchmark', 'median ms', 'baseline', 'change'))
+    for name, function in benchmarks(root, tree):
+        if args.select and args.select not in name:
+            continue
+        results[name] = result = measure(function, args.repeat)
+        line = "{:<36} {:>11.3f}".format(name, result['median'] * 1000)
+        if name in baseline:
+            change = result['median'] / baseline[name]['median'] - 1
+            line += " {:>11.3f} {:>+7.1%}".format(baseline[name]['median'] * 1000, change)
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    if args.save:
+        saved = baselines.setdefault(args.size, dict(results={}))
+        saved['results'].update(results)
+        saved.update(host=platform.node(), python=platform.python_version(),
+                     saved=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        with open(args.baselines, 'w') as fp:
+            json.dump(baselines, fp, indent=2, sort_keys=True)
+        print("baselines saved to {}".format(args.baselines))
+        return 0
+    if regressions:
+        print("{} benchmarks more than {:.0%} slower than the baseline: {}".format(
+            len(regressions), args.threshold, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
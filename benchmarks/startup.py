@@ -0,0 +1,93 @@
+"""
+Cold start time of ``create_app()`` and ``copernicus start``.
+
+Every measurement runs in a fresh interpreter:
+
+* ``import``: importing :mod:`copernicus.wsgi`,
+* ``create_app``: importing and creating the WSGI application,
+* ``start``: running ``copernicus start`` until it accepts connections and
+  until it answered its first DescribeProcess request.
+
+    $ python benchmarks/startup.py --repeat 5
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from six.moves.urllib.request import urlopen
+
+IMPORT = "import time; t = time.time(); import copernicus.wsgi; print(time.time() - t)"
+CREATE_APP = ("import time; t = time.time(); from copernicus import wsgi; wsgi.create_app(); "
+              "print(time.time() - t)")
+
+
+def run_python(code, env):
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, stderr=subprocess.DEVNULL)
+    return float(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_service(env, timeout=120):
+    """Seconds until ``copernicus start`` accepts connections and serves a DescribeProcess."""
+    port = free_port()
+    workdir = tempfile.mkdtemp()
+    config = os.path.join(workdir, 'bench.cfg')
+    with open(config, 'w') as fp:
+        fp.write("[events]\nenabled = false\n[logging]\nlevel = WARNING\n")
+    started = time.time()
+    server = subprocess.Popen(
+        [sys.executable, '-c', 'from copernicus.cli import cli; cli()', 'start', '--port', str(port),
+         '--hostname', '127.0.0.1', '-c', config],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        listening = None
+        while time.time() - started < timeout:
+            try:
+                socket.create_connection(('127.0.0.1', port), 0.1).close()
+                listening = time.time() - started
+                break
+            except socket.error:
+                time.sleep(0.01)
+        urlopen('http://127.0.0.1:{}/wps?service=WPS&version=1.0.0&request=DescribeProcess&identifier=sleep'
+                .format(port), timeout=timeout).read()
+        return listening, time.time() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + sys.path)
+
+    results = dict(import_=[], create_app=[], listening=[], first_request=[])
+    for _ in range(args.repeat):
+        results['import_'].append(run_python(IMPORT, env))
+        results['create_app'].append(run_python(CREATE_APP, env))
+        listening, first_request = start_service(env)
+        results['listening'].append(listening)
+        results['first_request'].append(first_request)
+    for name in ('import_', 'create_app', 'listening', 'first_request'):
+        values = results[name]
+        print("{:<14} median={:.3f}s min={:.3f}s".format(name.rstrip('_'), statistics.median(values), min(values)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
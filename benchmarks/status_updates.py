@@ -0,0 +1,114 @@
+"""
+Status writes of concurrent jobs with and without the status coalescer.
+
+Every job reports its progress ``--updates`` times with ``--delay`` seconds
+in between, like the progress reports of :mod:`copernicus.progress`.
+Prints the number of status writes, the jobs which failed because the
+request database was locked and the latency of ``update_status``.
+
+    $ python benchmarks/status_updates.py --jobs 50
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+
+from pywps import configuration, dblog
+from pywps.app.WPSRequest import WPSRequest
+from pywps.response.execute import ExecuteResponse
+from pywps.response.status import WPS_STATUS
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from copernicus import status
+from copernicus.processes.wps_sleep import Sleep
+
+QUERY = ('service=WPS&request=Execute&version=1.0.0&identifier=sleep'
+         '&storeExecuteResponse=true&status=true&DataInputs=delay=0')
+
+
+def create_job():
+    request = WPSRequest(Request(EnvironBuilder(query_string=QUERY).get_environ()))
+    job_id = uuid.uuid4()
+    dblog.log_request(job_id, request)
+    process = Sleep()
+    process._set_uuid(job_id)
+    process.set_workdir(tempfile.mkdtemp())
+    response = ExecuteResponse(request, job_id, process=process)
+    response.store_status_file = True
+    return response
+
+
+def run_job(response, latencies, failures, updates, delay, start):
+    # jobs are accepted one after another
+    time.sleep(start)
+    try:
+        response._update_status(WPS_STATUS.STARTED, 'started', 0)
+        for step in range(updates):
+            started = time.time()
+            response.update_status('step {}'.format(step), int(100. * step / updates))
+            latencies.append(time.time() - started)
+            time.sleep(delay)
+        response._update_status(WPS_STATUS.SUCCEEDED, 'done', 100)
+    except Exception:
+        failures.append(response.uuid)
+
+
+def measure(jobs, updates, delay, interval=0.):
+    writes = [0]
+    original = ExecuteResponse._update_status
+
+    def counting(self, *args):
+        writes[0] += 1
+        return original(self, *args)
+
+    if interval:
+        # as set up by status.install()
+        status.set_busy_timeout()
+        coalescer = status.StatusCoalescer(counting, interval)
+        ExecuteResponse._update_status = lambda self, *args: coalescer.update(self, *args)
+    else:
+        ExecuteResponse._update_status = counting
+    latencies, failures = [], []
+    threads = [threading.Thread(target=run_job, args=(create_job(), latencies, failures, updates, delay, 0.05 * index))
+               for index in range(jobs)]
+    started = time.time()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        ExecuteResponse._update_status = original
+    duration = time.time() - started
+    latencies.sort()
+    return dict(writes=writes[0], failed=len(failures), duration=duration,
+                mean_latency=sum(latencies) / len(latencies),
+                p95_latency=latencies[int(0.95 * len(latencies))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=50)
+    parser.add_argument('--updates', type=int, default=20)
+    parser.add_argument('--delay', type=float, default=0.1)
+    parser.add_argument('--interval', type=float, default=1.)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    configuration.load_configuration([])
+    configuration.CONFIG.set('logging', 'database', 'sqlite:///' + os.path.join(workdir, 'db.sqlite'))
+    configuration.CONFIG.set('logging', 'level', 'WARNING')
+    configuration.CONFIG.set('server', 'outputpath', workdir)
+
+    report = "{:<12} writes={writes:<6} failed jobs={failed:<3} mean={mean_latency:.4f}s p95={p95_latency:.4f}s total={duration:.1f}s"
+    print(report.format('direct', **measure(args.jobs, args.updates, args.delay)))
+    print(report.format('coalesced', **measure(args.jobs, args.updates, args.delay, args.interval)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Memory-aware admission of ESMValTool runs.
+
+pywps limits the number of parallel jobs but not their memory. Before a
+run is started, its peak memory is predicted from the metrics history of
+the process (see :mod:`copernicus.resources`) and the run waits until it
+fits into the free memory of the node (or of the cgroup the service runs
+in) minus what already admitted runs are still expected to allocate.
+
+Each run gets a memory cap of ``memory_cap_factor`` times the prediction
+in a child cgroup if ``[runner] cgroup`` is a writable cgroup v2 directory,
+so a runaway diagnostic only kills itself. Without a cgroup runs are not
+capped unless ``[runner] rlimit_fallback`` is set: ``RLIMIT_DATA`` limits the
+virtual data segment of every single process of the run, not the resident
+memory of the whole process tree the prediction is about, so it neither
+bounds the run nor avoids ``MemoryError`` in runs within their prediction.
+"""
+import os
+import time
+import fcntl
+
+from pywps import configuration
+
+from copernicus import jobs
+from copernicus import resources
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# prediction margin on top of the largest recorded peak
+MARGIN = 1.2
+# minimum number of runs with an input size for a linear prediction
+MIN_SAMPLES = 3
+# cgroups of runs are named <prefix><job id>
+CGROUP_PREFIX = 'copernicus-'
+
+
+def _size(option, default):
+    value = configuration.get_config_value("runner", option)
+    if value in (None, ''):
+        value = default
+    return int(configuration.get_size_mb(str(value)) * 1024 * 1024)
+
+
+def _float(option, default):
+    value = configuration.get_config_value("runner", option)
+    return float(value) if value not in (None, '') else default
+
+
+def enabled():
+    return str(configuration.get_config_value("runner", "admission")).lower() != 'false'
+
+
+def predict_memory(process, input_size=None):
+    """Predict the peak memory of a run in bytes.
+
+    Uses a least-squares fit of peak RSS over input size if enough runs of
+    the process have been recorded, else the largest recorded peak, else
+    ``[runner] default_memory``.
+    """
+    entries = [entry for entry in resources.history(process)
+               if entry.get('peak_rss') and entry.get('status') == jobs.FINISHED]
+    if not entries:
+        return _size('default_memory', '2gb')
+    largest = max(entry['peak_rss'] for entry in entries)
+    sized = [(entry['input_size'], entry['peak_rss']) for entry in entries if entry.get('input_size')]
+    if input_size and len(sized) >= MIN_SAMPLES and len(set(size for size, _ in sized)) > 1:
+        count = float(len(sized))
+        mean_x = sum(size for size, _ in sized) / count
+        mean_y = sum(rss for _, rss in sized) / count
+        slope = sum((size - mean_x) * (rss - mean_y) for size, rss in sized) / \
+            sum((size - mean_x) ** 2 for size, _ in sized)
+        slope = max(slope, 0.)
+        # never predict less than runs with a smaller input needed
+        floor = max([rss for size, rss in sized if size <= input_size] or [0])
+        return int(MARGIN * max(mean_y + slope * (input_size - mean_x), floor))
+    return int(MARGIN * largest)
+
+
+def cgroup_memory():
+    """Return (limit, usage) of the memory cgroup of this process or ``None``."""
+    for limit_file, usage_file in (
+            ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+            ('/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes')):
+        try:
+            with open(limit_file) as fp:
+                limit = fp.read().strip()
+            with open(usage_file) as fp:
+                usage = int(fp.read().strip())
+        except (IOError, OSError, ValueError):
+            continue
+        if limit == 'max' or int(limit) >= 2 ** 60:
+            return None
+        return int(limit), usage
+    return None
+
+
+def available_memory():
+    """Free memory of the node, limited by the cgroup of the service."""
+    import psutil
+
+    available = psutil.virtual_memory().available
+    cgroup = cgroup_memory()
+    if cgroup is not None:
+        available = min(available, cgroup[0] - cgroup[1])
+    return available
+
+
+def running_jobs(exclude=None):
+    """Admitted jobs which are still alive."""
+    import psutil
+
+    running = []
+    for job in jobs.list_jobs(status=jobs.RUNNING):
+        if job['job_id'] == exclude:
+            continue
+        if job.get('pgid'):
+            if not psutil.pid_exists(job['pgid']):
+                # left over by a crashed server
+                continue
+        elif time.time() - (job.get('admitted') or 0) > 60:
+            continue
+        running.append(job)
+    return running
+
+
+def reserved_memory(running):
+    """Memory admitted runs are expected to allocate on top of their current RSS."""
+    return sum(max(0, job.get('predicted_memory', 0) - (job.get('rss') or 0)) for job in running)
+
+
+def admit(job_id, predicted, timeout=None, poll=2., report=None):
+    """Wait until a run of predicted bytes fits into memory.
+
+    Returns ``True`` when admitted, ``False`` when cancelled or when
+    waiting took longer than timeout seconds.
+    """
+    started = time.time()
+    reserve = _size('reserve_memory', '512mb')
+    lock_file = os.path.join(jobs.jobs_dir(), '.admission.lock')
+    waiting = False
+    while True:
+        with open(lock_file, 'w') as lock:
+            # admission decisions of concurrent jobs must not interleave
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            running = running_jobs(exclude=job_id)
+            free = available_memory() - reserved_memory(running) - reserve
+            if predicted <= free or not running:
+                # a run which does not fit an idle node runs anyway, capped
+                jobs.update(job_id, status=jobs.RUNNING, predicted_memory=predicted,
+                            admitted=time.time(), admission_wait=time.time() - started)
+                return True
+            if not waiting:
+                jobs.update(job_id, status=jobs.WAITING, predicted_memory=predicted)
+        if not waiting:
+            LOGGER.info("job %s waits for %d MB of memory (%d MB free)", job_id, predicted >> 20, free >> 20)
+            if report:
+                report("waiting for {} MB of free memory ...".format(predicted >> 20))
+            waiting = True
+        if jobs.cancel_requested(job_id) or (timeout and time.time() - started > timeout):
+            return False
+        time.sleep(poll)
+
+
+def rlimit_fallback():
+    return str(configuration.get_config_value("runner", "rlimit_fallback")).lower() == 'true'
+
+
+def memory_cap(predicted):
+    """Memory limit of a run in bytes or ``None``."""
+    factor = _float('memory_cap_factor', 2.)
+    if not factor:
+        return None
+    return max(int(predicted * factor), _size('min_memory_cap', '1gb'))
+
+
+def limit_memory(cap, cgroup=None):
+    """Return a ``preexec_fn`` moving a child into cgroup or applying ``RLIMIT_DATA``.
+
+    Returns ``None`` if there is no cgroup and the ``RLIMIT_DATA`` fallback is
+    not enabled.
+    """
+    import resource
+
+    if not cgroup and not rlimit_fallback():
+        return None
+
+    def preexec():
+        if cgroup:
+            with open(os.path.join(cgroup, 'cgroup.procs'), 'w') as fp:
+                fp.write(str(os.getpid()))
+        else:
+            resource.setrlimit(resource.RLIMIT_DATA, (cap, cap))
+    return preexec
+
+
+def create_cgroup(job_id, cap):
+    """Create a child cgroup with memory.max, returns its path or ``None``."""
+    parent = configuration.get_config_value("runner", "cgroup")
+    if not parent:
+        return None
+    remove_stale_cgroups(parent)
+    path = os.path.join(parent, CGROUP_PREFIX + job_id)
+    try:
+        os.mkdir(path)
+        with open(os.path.join(path, 'memory.max'), 'w') as fp:
+            fp.write(str(cap))
+    except (IOError, OSError):
+        LOGGER.warning("could not create cgroup %s, %s", path,
+                       "using RLIMIT_DATA" if rlimit_fallback() else "the run is not capped", exc_info=True)
+        remove_cgroup(path)
+        return None
+    return path
+
+
+def remove_stale_cgroups(parent):
+    """Remove the cgroups left behind by runs which are no longer running."""
+    try:
+        names = os.listdir(parent)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(CGROUP_PREFIX):
+            continue
+        record = jobs.get(name[len(CGROUP_PREFIX):])
+        if record is None or record.get('status') not in (jobs.WAITING, jobs.RUNNING):
+            LOGGER.info("removing cgroup %s of an ended run", name)
+            remove_cgroup(os.path.join(parent, name))
+
+
+def remove_cgroup(path):
+    """Remove a cgroup, returns whether it is gone.
+
+    A cgroup that can not be removed yet, e.g. because processes of the run
+    are still exiting, is removed when the next run with a cgroup is admitted.
+    """
+    if not path:
+        return True
+    try:
+        os.rmdir(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        LOGGER.warning("could not remove cgroup %s, retrying when the next run is admitted", path, exc_info=True)
+        return False
+    return True
\ No newline at end of file
@@ -0,0 +1,298 @@
+"""
+Load generator for a running WPS service.
+
+``copernicus bench`` keeps a number of clients busy with a weighted mix of
+requests: ``caps`` (GetCapabilities), ``describe`` (DescribeProcess),
+``sync`` (Execute) and ``async`` (Execute with ``storeExecuteResponse`` and
+``status``, followed by polling the status document until the job finished).
+Latency percentiles, throughput and error rates are reported per request
+kind, and the turnaround of async jobs from submission to the final status.
+The results can be saved as JSON and compared with an earlier run.
+"""
+import time
+import json
+import random
+import socket
+import platform
+import threading
+import xml.etree.ElementTree as ElementTree
+
+from six.moves.urllib.error import URLError
+from six.moves.urllib.parse import urlencode
+from six.moves.urllib.request import urlopen
+
+import copernicus
+
+KINDS = ('caps', 'describe', 'sync', 'async')
+PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_mix(text):
+    """Parse ``kind=weight,...`` into a dict of weights."""
+    mix = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError("unknown request kind {!r}, use one of {}".format(kind, ', '.join(KINDS)))
+        mix[kind] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("empty request mix")
+    return mix
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = (len(values) - 1) * pct / 100.
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def summary(latencies, errors, elapsed):
+    result = dict(
+        count=len(latencies) + errors,
+        errors=errors,
+        error_rate=float(errors) / (len(latencies) + errors) if latencies or errors else 0.,
+        throughput=len(latencies) / elapsed if elapsed else 0.,
+        mean=sum(latencies) / len(latencies) if latencies else None,
+        max=max(latencies) if latencies else None)
+    for pct in PERCENTILES:
+        result['p{}'.format(pct)] = percentile(latencies, pct)
+    return result
+
+
+class Response(object):
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+        self.root = None
+        try:
+            self.root = ElementTree.fromstring(body)
+        except ElementTree.ParseError:
+            pass
+
+    def tag(self, name):
+        if self.root is None:
+            return False
+        return any(element.tag.endswith('}' + name) or element.tag == name for element in self.root.iter())
+
+    @property
+    def ok(self):
+        return self.status == 200 and self.root is not None and not self.tag('ExceptionReport') \
+            and not self.tag('ProcessFailed')
+
+    @property
+    def finished(self):
+        return self.tag('ProcessSucceeded') or self.tag('ProcessFailed') or self.tag('ExceptionReport')
+
+    def exception(self):
+        """Code and text of an exception report."""
+        for element in self.root.iter() if self.root is not None else ():
+            if element.tag.endswith('}Exception'):
+                text = ' '.join(''.join(element.itertext()).split())
+                return '{} {}'.format(element.get('exceptionCode', ''), text[:80]).strip()
+        return None
+
+    @property
+    def status_location(self):
+        return self.root.get('statusLocation') if self.root is not None else None
+
+
+class Bench(object):
+    """Closed-loop load of ``concurrency`` clients against the WPS at url."""
+
+    def __init__(self, url, mix, concurrency=10, duration=30., requests=None, identifier='sleep',
+                 inputs='delay=1', describe='all', poll_interval=1., timeout=60., seed=None):
+        self.url = url
+        self.mix = mix
+        self.concurrency = concurrency
+        self.duration = duration
+        self.requests = requests
+        self.identifier = identifier
+        self.inputs = inputs
+        self.describe = describe
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.issued = 0
+        self.latencies = dict((kind, []) for kind in KINDS + ('poll',))
+        self.errors = dict((kind, 0) for kind in KINDS + ('poll',))
+        self.messages = {}
+        self.turnaround = []
+        self.jobs = dict(succeeded=0, failed=0, timeout=0)
+
+    def query(self, kind):
+        params = [('service', 'WPS'), ('version', '1.0.0')]
+        if kind == 'caps':
+            params.append(('request', 'GetCapabilities'))
+        elif kind == 'describe':
+            params.extend([('request', 'DescribeProcess'), ('identifier', self.describe)])
+        else:
+            params.extend([('request', 'Execute'), ('identifier', self.identifier)])
+            if self.inputs:
+                params.append(('DataInputs', self.inputs))
+            if kind == 'async':
+                params.extend([('storeExecuteResponse', 'true'), ('status', 'true')])
+        return '{}?{}'.format(self.url, urlencode(params))
+
+    def fetch(self, url):
+        try:
+            reply = urlopen(url, timeout=self.timeout)
+            try:
+                return Response(reply.getcode(), reply.read())
+            finally:
+                reply.close()
+        except URLError as err:
+            if hasattr(err, 'code'):
+                return Response(err.code, err.read())
+            raise
+
+    def _record(self, kind, started, response=None, error=None):
+        latency = time.time() - started
+        with self.lock:
+            if error is None and response is not None and response.ok:
+                self.latencies[kind].append(latency)
+                return True
+            self.errors[kind] += 1
+            if error is not None:
+                message = error
+            elif response.root is None:
+                message = 'HTTP {}, no XML response'.format(response.status)
+            elif response.exception():
+                message = 'HTTP {}, {}'.format(response.status, response.exception())
+            elif response.status != 200:
+                message = 'HTTP {}'.format(response.status)
+            else:
+                message = 'process failed'
+            message = '{}: {}'.format(kind, message)
+            self.messages[message] = self.messages.get(message, 0) + 1
+            return False
+
+    def request(self, kind):
+        started = time.time()
+        try:
+            response = self.fetch(self.query(kind))
+        except (URLError, socket.error, socket.timeout) as err:
+            return self._record(kind, started, error=str(getattr(err, 'reason', err)))
+        if not self._record(kind, started, response) or kind != 'async':
+            return
+        self.follow(started, response)
+
+    def follow(self, submitted, response):
+        """Poll the status document of an async job until it finished."""
+        location = response.status_location
+        while not response.finished:
+            if time.time() - submitted > self.timeout or not location:
+                with self.lock:
+                    self.jobs['timeout'] += 1
+                return
+            time.sleep(self.poll_interval)
+            started = time.time()
+            try:
+                response = self.fetch(location)
+            except (URLError, socket.error, socket.timeout) as err:
+                self._record('poll', started, error=str(getattr(err, 'reason', err)))
+                continue
+            if response.status != 200 or response.root is None:
+                self._record('poll', started, response)
+                continue
+            with self.lock:
+                self.latencies['poll'].append(time.time() - started)
+        with self.lock:
+            self.turnaround.append(time.time() - submitted)
+            self.jobs['succeeded' if response.tag('ProcessSucceeded') else 'failed'] += 1
+
+    def _next(self):
+        with self.lock:
+            if self.requests is not None and self.issued >= self.requests:
+                return None
+            if self.requests is None and time.time() >= self.deadline:
+                return None
+            self.issued += 1
+            kinds = sorted(self.mix)
+            return self.random.choices(kinds, weights=[self.mix[kind] for kind in kinds])[0]
+
+    def _client(self):
+        while True:
+            kind = self._next()
+            if kind is None:
+                return
+            self.request(kind)
+
+    def run(self):
+        self.started = time.time()
+        self.deadline = self.started + self.duration
+        clients = [threading.Thread(target=self._client) for _ in range(self.concurrency)]
+        for client in clients:
+            client.daemon = True
+            client.start()
+        for client in clients:
+            client.join()
+        return self.results(time.time() - self.started)
+
+    def results(self, elapsed):
+        requests = dict((kind, summary(self.latencies[kind], self.errors[kind], elapsed))
+                        for kind in KINDS + ('poll',) if self.latencies[kind] or self.errors[kind])
+        total = sum(len(self.latencies[kind]) + self.errors[kind] for kind in KINDS)
+        errors = sum(self.errors[kind] for kind in KINDS)
+        return dict(
+            meta=dict(url=self.url, mix=self.mix, concurrency=self.concurrency, duration=self.duration,
+                      requests=self.requests, identifier=self.identifier, inputs=self.inputs,
+                      started=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                      elapsed=elapsed, version=copernicus.__version__, host=platform.node()),
+            total=dict(count=total, errors=errors, error_rate=float(errors) / total if total else 0.,
+                       throughput=(total - errors) / elapsed if elapsed else 0.),
+            requests=requests,
+            jobs=dict(self.jobs, turnaround=summary(self.turnaround, 0, elapsed)),
+            errors=self.messages)
+
+
+def _ms(value):
+    return '{:9.1f}'.format(value * 1000) if value is not None else '        -'
+
+
+def format_report(results):
+    lines = ["{} requests in {:.1f}s, {:.1f} req/s, {:.1%} errors".format(
+        results['total']['count'], results['meta']['elapsed'], results['total']['throughput'],
+        results['total']['error_rate'])]
+    lines.append("{:<10} {:>7} {:>7} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9}".format(
+        'kind', 'count', 'errors', 'req/s', 'p50 ms', 'p90 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    rows = sorted(results['requests'].items()) + [('turnaround', results['jobs']['turnaround'])]
+    for kind, item in rows:
+        if not item['count']:
+            continue
+        lines.append("{:<10} {:>7} {:>7} {:>8.1f} {} {} {} {} {}".format(
+            kind, item['count'], item['errors'], item['throughput'],
+            _ms(item['p50']), _ms(item['p90']), _ms(item['p95']), _ms(item['p99']), _ms(item['max'])))
+    jobs = results['jobs']
+    if jobs['succeeded'] or jobs['failed'] or jobs['timeout']:
+        lines.append("jobs: {succeeded} succeeded, {failed} failed, {timeout} timed out".format(**jobs))
+    for message, count in sorted(results['errors'].items(), key=lambda item: -item[1]):
+        lines.append("  {:>5} x {}".format(count, message))
+    return '\n'.join(lines)
+
+
+def compare(previous, current):
+    """Lines comparing the latency and throughput of two results."""
+    lines = ["{:<10} {:>9} {:>9} {:>9} {:>9}".format('kind', 'p50', 'p95', 'req/s', 'errors')]
+    rows = [(kind, previous['requests'].get(kind), current['requests'].get(kind)) for kind in KINDS + ('poll',)]
+    rows.append(('turnaround', previous['jobs']['turnaround'], current['jobs']['turnaround']))
+    for kind, old, new in rows:
+        if not old or not new or not old['count'] or not new['count']:
+            continue
+        changes = []
+        for name in ('p50', 'p95', 'throughput'):
+            if old[name] and new[name] is not None:
+                changes.append('{:>+8.1%}'.format(new[name] / old[name] - 1))
+            else:
+                changes.append('{:>9}'.format('-'))
+        changes.append('{:>+8.1%}'.format(new['error_rate'] - old['error_rate']))
+        lines.append("{:<10} {}".format(kind, ' '.join(changes)))
+    return '\n'.join(lines)
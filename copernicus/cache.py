@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+from pywps import configuration
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def cache_root():
+    """Return the root directory of the on-disk cache."""
+    root = configuration.get_config_value("cache", "cache_root")
+    return root or os.path.join(tempfile.gettempdir(), 'copernicus-cache')
+
+
+def make_key(*args, **kwargs):
+    """Build a stable cache key from the given arguments."""
+    text = json.dumps([args, kwargs], sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class Cache(object):
+    """Directory based key/value store for files.
+
+    Each entry is a directory ``<root>/<namespace>/<key>`` with the cached
+    files and a ``manifest.json`` describing them. Entries are written to a
+    temporary directory first and moved in place, so readers never see
+    half written entries.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, namespace, root=None):
+        self.namespace = namespace
+        self.root = os.path.join(root or cache_root(), namespace)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def manifest(self, key):
+        """Return the manifest of an entry or ``None`` if there is none."""
+        manifest_file = os.path.join(self.path(key), self.MANIFEST)
+        try:
+            with open(manifest_file, 'r') as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def get(self, key):
+        """Return a dict of name -> path of the files cached under key."""
+        manifest = self.manifest(key)
+        if manifest is None:
+            return None
+        entry_dir = self.path(key)
+        files = {}
+        for name, filename in manifest['files'].items():
+            path = os.path.join(entry_dir, filename)
+            if not os.path.exists(path):
+                LOGGER.warning("cache entry %s is incomplete, missing %s", key, filename)
+                return None
+            files[name] = path
+        return files
+
+    def meta(self, key):
+        manifest = self.manifest(key)
+        if manifest is None:
+            return None
+        return manifest.get('meta', {})
+
+    def put(self, key, files, meta=None):
+        """Copy files (dict of name -> path) into the cache under key."""
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        tmp_dir = tempfile.mkdtemp(prefix='.{}-'.format(key), dir=self.root)
+        manifest = dict(files={}, meta=meta or {}, created=time.time())
+        try:
+            for name, path in files.items():
+                filename = '{}_{}'.format(name, os.path.basename(path))
+                shutil.copyfile(path, os.path.join(tmp_dir, filename))
+                manifest['files'][name] = filename
+            with open(os.path.join(tmp_dir, self.MANIFEST), 'w') as fp:
+                json.dump(manifest, fp)
+            self.remove(key)
+            os.rename(tmp_dir, self.path(key))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return self.get(key)
+
+    def add_file(self, key, name, path):
+        """Add or replace a single file of an existing entry."""
+        manifest = self.manifest(key)
+        if manifest is None:
+            raise KeyError(key)
+        filename = '{}_{}'.format(name, os.path.basename(path))
+        target = os.path.join(self.path(key), filename)
+        shutil.copyfile(path, target + '.tmp')
+        os.rename(target + '.tmp', target)
+        manifest['files'][name] = filename
+        manifest_file = os.path.join(self.path(key), self.MANIFEST)
+        with open(manifest_file + '.tmp', 'w') as fp:
+            json.dump(manifest, fp)
+        os.rename(manifest_file + '.tmp', manifest_file)
+        return target
+
+    def remove(self, key):
+        if os.path.isdir(self.path(key)):
+            shutil.rmtree(self.path(key), ignore_errors=True)
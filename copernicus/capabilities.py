@@ -0,0 +1,168 @@
+"""
+Cached GetCapabilities and DescribeProcess responses.
+
+pywps serialises all processes with their inputs, outputs and metadata on
+every GetCapabilities and DescribeProcess request. :class:`CapabilitiesCache`
+keeps the rendered responses of GET requests in memory, keyed on the
+request parameters, the ``Accept`` and ``Accept-Language`` headers, and
+serves them with a strong ETag, conditional GET (304) and gzip. The cache
+is dropped when the configuration or the processes, including their inputs
+updated from the data catalogue, change.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from six.moves.urllib.parse import parse_qsl
+
+from pywps import configuration
+
+CACHED_REQUESTS = ('getcapabilities', 'describeprocess')
+# parameters which do not change the response
+IGNORED = ('service',)
+MAX_ENTRIES = 256
+
+
+def enabled():
+    return str(configuration.get_config_value("cache", "capabilities")).lower() != 'false'
+
+
+# the loaded configuration and the number of changes made to it since
+_config = dict(config=None, changes=0)
+
+
+def _count_changes(config):
+    """Count the changes of config made with ``set``, e.g. by tests and benchmarks."""
+    original = config.set
+
+    def set_option(section, option, value=None):
+        original(section, option, value)
+        _config['changes'] += 1
+
+    config.set = set_option
+    _config.update(config=config, changes=0)
+
+
+def config_fingerprint():
+    """Changes when the configuration is loaded again or an option is set."""
+    if _config['config'] is not configuration.CONFIG:
+        _count_changes(configuration.CONFIG)
+    return id(_config['config']), _config['changes']
+
+
+def processes_fingerprint(processes):
+    if hasattr(processes, 'values'):
+        processes = processes.values()
+    # the catalogue refresh replaces the inputs of the processes,
+    # processes which are not constructed yet are not constructed here
+    return tuple((process.identifier, id(process)) if not getattr(process, 'loaded', True) else
+                 (process.identifier, process.version, id(process),
+                  tuple(id(inpt) for inpt in process.inputs),
+                  tuple(id(outpt) for outpt in process.outputs)) for process in processes)
+
+
+class Entry(object):
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = [(name, value) for name, value in headers
+                        if name.lower() not in ('content-length', 'etag', 'content-encoding', 'vary', 'cache-control')]
+        self.body = body
+        self.gzipped = gzip.compress(body)
+        self.etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        self.gzip_etag = '"{}-gzip"'.format(hashlib.sha1(body).hexdigest())
+
+
+class CapabilitiesCache(object):
+    """WSGI middleware caching the GetCapabilities and DescribeProcess responses of a pywps service."""
+
+    def __init__(self, application):
+        self.application = application
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.application, name)
+
+    def key(self, environ):
+        if environ.get('REQUEST_METHOD', 'GET') != 'GET':
+            return None
+        params = [(name.lower(), value) for name, value in parse_qsl(environ.get('QUERY_STRING', ''))]
+        request = dict(params).get('request', '').lower()
+        if request not in CACHED_REQUESTS:
+            return None
+        params = tuple(sorted((name, value.lower() if name == 'request' else value)
+                              for name, value in params if name not in IGNORED))
+        return (params, environ.get('HTTP_ACCEPT', ''), environ.get('HTTP_ACCEPT_LANGUAGE', ''))
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _check_fingerprint(self):
+        fingerprint = (config_fingerprint(), processes_fingerprint(getattr(self.application, 'processes', ())))
+        if fingerprint != self.fingerprint:
+            with self.lock:
+                self.entries.clear()
+                self.fingerprint = fingerprint
+
+    def __call__(self, environ, start_response):
+        key = self.key(environ)
+        if key is None:
+            return self.application(environ, start_response)
+        self._check_fingerprint()
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            status, headers, body = self._render(environ)
+            if not status.startswith('200'):
+                # errors are not cached
+                start_response(status, headers)
+                return [body]
+            entry = Entry(status, headers, body)
+            with self.lock:
+                self.entries[key] = entry
+                while len(self.entries) > MAX_ENTRIES:
+                    self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+        return self._serve(entry, environ, start_response)
+
+    def _render(self, environ):
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            return lambda data: None
+
+        result = self.application(environ, capture)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return captured['status'], captured['headers'], body
+
+    def _serve(self, entry, environ, start_response):
+        use_gzip = 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '')
+        etag = entry.gzip_etag if use_gzip else entry.etag
+        headers = list(entry.headers) + [
+            ('ETag', etag),
+            ('Vary', 'Accept, Accept-Encoding, Accept-Language'),
+            ('Cache-Control', 'no-cache')]
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH', '')
+        if if_none_match and (if_none_match.strip() == '*' or etag in
+                              [tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')]):
+            start_response('304 Not Modified', [('ETag', etag), ('Vary', 'Accept, Accept-Encoding, Accept-Language')])
+            return []
+        body = entry.gzipped if use_gzip else entry.body
+        if use_gzip:
+            headers.append(('Content-Encoding', 'gzip'))
+        headers.append(('Content-Length', str(len(body))))
+        start_response(entry.status, headers)
+        return [body]
@@ -0,0 +1,517 @@
+"""
+Indexed view of the CMIP5 and OBS data below ``archive_root`` and ``obs_root``.
+
+The catalogue is built from the file names (which follow the ESMValTool
+input file conventions) and is used to reject requests for data which is not
+available before ESMValTool is launched. The numbers of checked and rejected
+requests are served with the job metrics at ``/jobs/metrics``.
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import threading
+
+from pywps import configuration
+from pywps.app.exceptions import ProcessError
+
+from copernicus.cache import cache_root
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# longest message a ProcessError passes to the client
+MAX_MESSAGE_LENGTH = 300
+
+FACETS = ('project', 'dataset', 'exp', 'ensemble', 'mip', 'short_name')
+
+CMIP5_FILENAME = re.compile(
+    r'^(?P<short_name>[^_]+)_(?P<mip>[^_]+)_(?P<dataset>[^_]+)_(?P<exp>[^_]+)_(?P<ensemble>r\d+i\d+p\d+)'
+    r'(?:_(?P<start>\d{4})\d*-(?P<end>\d{4})\d*)?(?:_[^.]*)?\.nc$')
+OBS_FILENAME = re.compile(
+    r'^OBS_(?P<dataset>.+?)_(?P<type>[^_]+)_(?P<version>[^_]+)_(?P<mip>[^_]+)_(?P<short_name>[A-Za-z][^_]*)'
+    r'(?:_(?P<start>\d{4})\d*-(?P<end>\d{4})\d*)?\.nc$')
+
+
+class PreflightError(ProcessError):
+    """Raised if a recipe asks for data which is not in the catalogue.
+
+    The message is passed to the WPS client, so it is reduced to the
+    characters and the length :class:`ProcessError` allows; the full list of
+    errors is kept in ``errors``.
+    """
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        message = "requested data is not available: " + self.errors[0]
+        for index, error in enumerate(self.errors[1:], 1):
+            if len(message) + len(error) + len("; and 99 more") > MAX_MESSAGE_LENGTH:
+                message += " and {} more".format(len(self.errors) - index)
+                break
+            message += "; " + error
+        super(PreflightError, self).__init__(message, max_length=MAX_MESSAGE_LENGTH)
+
+
+def parse_filename(filename):
+    """Return the facets and the year range of a data file or ``None``."""
+    match = CMIP5_FILENAME.match(filename)
+    project = 'CMIP5'
+    if match is None:
+        match = OBS_FILENAME.match(filename)
+        project = 'OBS'
+    if match is None:
+        return None
+    groups = match.groupdict()
+    facets = dict(
+        project=project,
+        dataset=groups['dataset'],
+        exp=groups.get('exp'),
+        ensemble=groups.get('ensemble'),
+        mip=groups['mip'],
+        short_name=groups['short_name'])
+    if groups['start'] is None:
+        return facets, None, None
+    return facets, int(groups['start']), int(groups['end'])
+
+
+class Catalog(object):
+    """In-memory index of data files keyed on their facets.
+
+    Besides the index the catalogue remembers the modification time, sub
+    directories and data files of every scanned directory, so a rescan only
+    needs to list directories which changed since the previous scan.
+    """
+
+    def __init__(self, roots=None):
+        self.roots = roots or {}
+        self.entries = {}
+        self.dirs = {}
+        self.created = time.time()
+
+    @classmethod
+    def scan(cls, roots, previous=None):
+        """Build a catalogue from a dict of project -> root directory.
+
+        If a previous catalogue of the same roots is given, unchanged
+        directories are taken from it without listing them again.
+        """
+        catalog = cls(roots)
+        previous_dirs = previous.dirs if previous is not None and previous.roots == roots else {}
+        for project, root in roots.items():
+            if not root or not os.path.isdir(root):
+                continue
+            stack = ['']
+            while stack:
+                reldir = stack.pop()
+                subdirs, files = catalog._scan_dir(project, root, reldir, previous_dirs)
+                for facets, start, end, path in files:
+                    catalog.add(dict(zip(FACETS, facets)), start, end, path)
+                stack.extend(os.path.join(reldir, subdir) for subdir in subdirs)
+        return catalog
+
+    def _scan_dir(self, project, root, reldir, previous_dirs):
+        dir_key = '{}:{}'.format(project, reldir)
+        path = os.path.join(root, reldir)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return [], []
+        old = previous_dirs.get(dir_key)
+        if old is not None and old['mtime'] == mtime:
+            subdirs, files = old['subdirs'], old['files']
+        else:
+            subdirs, files = [], []
+            for name in sorted(os.listdir(path)):
+                if os.path.isdir(os.path.join(path, name)):
+                    subdirs.append(name)
+                    continue
+                parsed = parse_filename(name)
+                if parsed is None or parsed[0]['project'] != project:
+                    continue
+                facets, start, end = parsed
+                files.append([[facets[facet] for facet in FACETS], start, end, os.path.join(reldir, name)])
+        self.dirs[dir_key] = dict(mtime=mtime, subdirs=subdirs, files=files)
+        return subdirs, files
+
+    def save(self, filename):
+        """Write the catalogue to a JSON file."""
+        dirname = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(filename + '.tmp', 'w') as fp:
+            json.dump(dict(roots=self.roots, created=self.created, dirs=self.dirs), fp)
+        os.rename(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Read a catalogue written by :meth:`save`."""
+        with open(filename) as fp:
+            data = json.load(fp)
+        catalog = cls(data['roots'])
+        catalog.created = data['created']
+        catalog.dirs = data['dirs']
+        for info in catalog.dirs.values():
+            for facets, start, end, path in info['files']:
+                catalog.add(dict(zip(FACETS, facets)), start, end, path)
+        return catalog
+
+    def add(self, facets, start, end, path):
+        key = tuple(facets[name] for name in FACETS)
+        self.entries.setdefault(key, []).append((start, end, path))
+
+    def covers(self, project):
+        """True if the catalogue has a data root for the project."""
+        root = self.roots.get(project)
+        return bool(root) and os.path.isdir(root)
+
+    def select(self, **facets):
+        """Return the keys matching the given facets (``None`` matches all)."""
+        keys = []
+        for key in self.entries:
+            entry = dict(zip(FACETS, key))
+            if all(value is None or entry[name] == value for name, value in facets.items()):
+                keys.append(key)
+        return keys
+
+    def values(self, facet, **facets):
+        """Return the sorted values of a facet among the matching entries."""
+        index = FACETS.index(facet)
+        return sorted(set(key[index] for key in self.select(**facets) if key[index] is not None))
+
+    def coverage(self, keys):
+        """Return the merged year intervals of the given keys."""
+        intervals = sorted(
+            (start, end) for key in keys for start, end, _ in self.entries[key] if start is not None)
+        merged = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [tuple(interval) for interval in merged]
+
+    def files(self, requirement):
+        """Return the paths (relative to the project root) needed for a requirement."""
+        paths = []
+        for key in self._keys(requirement):
+            for start, end, path in self.entries[key]:
+                if start is None or (start <= requirement['end_year'] and end >= requirement['start_year']):
+                    paths.append(path)
+        return sorted(paths)
+
+    def check(self, requirement):
+        """Return ``None`` if the requirement can be satisfied, else a message."""
+        keys = self._keys(requirement)
+        if not keys:
+            return self._explain(requirement)
+        if all(start is None for key in keys for start, _, _ in self.entries[key]):
+            return None
+        start_year, end_year = requirement['start_year'], requirement['end_year']
+        coverage = self.coverage(keys)
+        for start, end in coverage:
+            if start <= start_year and end >= end_year:
+                return None
+        return "{} covers {}, requested {}-{}".format(
+            describe(requirement),
+            ', '.join('{}-{}'.format(start, end) for start, end in coverage),
+            start_year, end_year)
+
+    def _keys(self, requirement):
+        keys = []
+        for exp in _as_list(requirement.get('exp')):
+            for mip in _mip_candidates(requirement):
+                facets = dict((name, requirement.get(name)) for name in FACETS)
+                facets.update(exp=exp, mip=mip)
+                keys.extend(self.select(**facets))
+        return keys
+
+    def _explain(self, requirement):
+        """Find the first facet which can not be satisfied."""
+        facets = dict(project=requirement['project'])
+        for name in FACETS[1:]:
+            wanted = _as_list(requirement.get(name))
+            if name == 'mip':
+                wanted = _mip_candidates(requirement)
+            if wanted == [None]:
+                continue
+            available = self.values(name, **facets)
+            found = [value for value in wanted if value in available]
+            if not found:
+                return "no {} data with {}={} for {} (available: {})".format(
+                    requirement['project'], name, '/'.join(str(v) for v in wanted),
+                    ', '.join('{}={}'.format(k, v) for k, v in facets.items() if k != 'project') or 'any',
+                    ', '.join(available) or 'none')
+            if len(found) == 1:
+                facets[name] = found[0]
+        return "no data found for {}".format(describe(requirement))
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _mip_candidates(requirement):
+    # early ESMValTool 2 OBS files carry the field (e.g. T3M) in place of the mip
+    candidates = [requirement.get('mip')]
+    if requirement.get('project') == 'OBS' and requirement.get('field'):
+        candidates.append(requirement['field'])
+    if candidates[0] is None:
+        return [None]
+    return candidates
+
+
+def describe(requirement):
+    return ' '.join(
+        str('/'.join(str(v) for v in _as_list(requirement[name])))
+        for name in FACETS if requirement.get(name) is not None)
+
+
+def recipe_requirements(recipe):
+    """Return the input data requirements of a parsed recipe.
+
+    Dataset settings are merged into the variable settings as done by
+    ESMValTool. Derived variables are skipped.
+    """
+    requirements = []
+    for diagnostic in (recipe.get('diagnostics') or {}).values():
+        for short_name, variable in (diagnostic.get('variables') or {}).items():
+            variable = dict(variable or {})
+            if variable.get('derive'):
+                continue
+            datasets = list(recipe.get('datasets') or [])
+            datasets.extend(diagnostic.get('additional_datasets') or [])
+            datasets.extend(variable.pop('additional_datasets', None) or [])
+            for dataset in datasets:
+                requirement = dict(variable)
+                requirement.update(dataset)
+                requirement.setdefault('short_name', short_name)
+                if 'start_year' not in requirement or 'end_year' not in requirement:
+                    continue
+                requirement['start_year'] = int(requirement['start_year'])
+                requirement['end_year'] = int(requirement['end_year'])
+                if requirement not in requirements:
+                    requirements.append(requirement)
+    return requirements
+
+
+def data_roots():
+    return dict(
+        CMIP5=configuration.get_config_value("data", "archive_root"),
+        OBS=configuration.get_config_value("data", "obs_root"))
+
+
+def catalog_file():
+    filename = configuration.get_config_value("data", "catalog_file")
+    if not filename:
+        # one catalogue file per set of data roots
+        digest = hashlib.sha1(json.dumps(data_roots(), sort_keys=True).encode('utf-8')).hexdigest()
+        filename = os.path.join(cache_root(), 'catalog_{}.json'.format(digest[:12]))
+    return filename
+
+
+def catalog_max_age():
+    return float(configuration.get_config_value("data", "catalog_max_age") or 600)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_rescan_thread = None
+
+
+def get_catalog():
+    """Return the catalogue of the configured data roots.
+
+    On first use the catalogue is read from ``[data] catalog_file``. It is
+    (incrementally) rescanned if there is none for the configured roots. If
+    it is older than ``[data] catalog_max_age`` seconds it is rescanned in a
+    background thread and the old catalogue is used until the scan is done.
+    """
+    global _catalog
+    with _catalog_lock:
+        roots = data_roots()
+        if _catalog is None or _catalog.roots != roots:
+            _catalog = None
+            try:
+                _catalog = Catalog.load(catalog_file())
+            except (IOError, OSError, ValueError, KeyError):
+                LOGGER.debug("no usable data catalogue in %s", catalog_file())
+            if _catalog is not None and _catalog.roots != roots:
+                _catalog = None
+        if _catalog is None:
+            _catalog = _rescan(roots, None)
+        elif time.time() - _catalog.created > catalog_max_age():
+            _rescan_in_background(_catalog)
+        return _catalog
+
+
+def _rescan_in_background(previous):
+    """Replace the stale catalogue previous by a rescan in a thread, one at a time."""
+    global _rescan_thread
+    if _rescan_thread is not None and _rescan_thread.is_alive():
+        return
+
+    def rescan():
+        global _catalog
+        try:
+            catalog = _rescan(previous.roots, previous)
+        except Exception:
+            LOGGER.exception("rescanning the data catalogue failed")
+            return
+        with _catalog_lock:
+            # the data roots may have changed in the meantime
+            if _catalog is previous:
+                _catalog = catalog
+        for func in _refresh_callbacks:
+            try:
+                func(catalog)
+            except Exception:
+                LOGGER.exception("refresh callback failed")
+
+    _rescan_thread = threading.Thread(target=rescan, name='catalog-rescan')
+    _rescan_thread.daemon = True
+    _rescan_thread.start()
+
+
+def refresh_catalog():
+    """Rescan the data roots and replace the current catalogue."""
+    global _catalog
+    previous = get_catalog()
+    catalog = _rescan(previous.roots, previous)
+    with _catalog_lock:
+        _catalog = catalog
+    return catalog
+
+
+def _rescan(roots, previous):
+    started = time.time()
+    catalog = Catalog.scan(roots, previous=previous)
+    LOGGER.info("scanned data catalogue with %d entries in %.2fs",
+                len(catalog.entries), time.time() - started)
+    try:
+        catalog.save(catalog_file())
+    except (IOError, OSError):
+        LOGGER.warning("could not write data catalogue %s", catalog_file(), exc_info=True)
+    return catalog
+
+
+_refresh_callbacks = []
+_refresh_thread = None
+
+
+def start_background_refresh(callback=None):
+    """Refresh the catalogue every ``catalog_max_age`` seconds in a daemon thread.
+
+    Callbacks are called with the new catalogue after each refresh. Only one
+    refresh thread is started per process.
+    """
+    global _refresh_thread
+    if callback is not None:
+        _refresh_callbacks.append(callback)
+    if _refresh_thread is not None:
+        return _refresh_thread
+
+    def refresh_loop():
+        while True:
+            time.sleep(catalog_max_age())
+            try:
+                catalog = refresh_catalog()
+                for func in _refresh_callbacks:
+                    func(catalog)
+            except Exception:
+                LOGGER.exception("refreshing the data catalogue failed")
+
+    _refresh_thread = threading.Thread(target=refresh_loop, name='catalog-refresh')
+    _refresh_thread.daemon = True
+    _refresh_thread.start()
+    return _refresh_thread
+
+
+PREFLIGHT_FILE = 'preflight_stats.json'
+
+
+def preflight_file():
+    return os.path.join(cache_root(), PREFLIGHT_FILE)
+
+
+def _read_stats(fp):
+    fp.seek(0)
+    try:
+        return json.load(fp)
+    except ValueError:
+        return dict(checked=0, rejected=0)
+
+
+def count_preflight(rejected):
+    """Count a pre-flight check, shared by all processes handling jobs. Returns the counts."""
+    filename = preflight_file()
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'a+') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        stats = _read_stats(fp)
+        stats['checked'] += 1
+        stats['rejected'] += int(rejected)
+        fp.seek(0)
+        fp.truncate()
+        json.dump(stats, fp)
+    return stats
+
+
+def preflight_stats():
+    """Return the numbers of checked and rejected recipes."""
+    try:
+        with open(preflight_file()) as fp:
+            fcntl.flock(fp, fcntl.LOCK_SH)
+            return _read_stats(fp)
+    except (IOError, OSError):
+        return dict(checked=0, rejected=0)
+
+
+def prometheus():
+    """The pre-flight counts in the Prometheus text format."""
+    stats = preflight_stats()
+    lines = []
+    for metric, help_text in (
+            ('checked', 'Number of recipes checked against the data catalogue'),
+            ('rejected', 'Number of recipes rejected because data is not available')):
+        name = 'copernicus_preflight_{}'.format(metric)
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} counter'.format(name))
+        lines.append('{} {}'.format(name, stats[metric]))
+    return '\n'.join(lines) + '\n'
+
+
+def preflight(recipe_file):
+    """Check the data requirements of a recipe against the catalogue.
+
+    Raises :class:`PreflightError` listing every requirement that can not be
+    satisfied.
+    """
+    import yaml
+
+    if str(configuration.get_config_value("data", "preflight")).lower() == 'false':
+        return
+    started = time.time()
+    with open(recipe_file) as fp:
+        recipe = yaml.safe_load(fp)
+    catalog = get_catalog()
+    errors = []
+    for requirement in recipe_requirements(recipe):
+        if not catalog.covers(requirement.get('project')):
+            continue
+        error = catalog.check(requirement)
+        if error and error not in errors:
+            errors.append(error)
+    try:
+        stats = count_preflight(bool(errors))
+    except (IOError, OSError):
+        LOGGER.warning("could not count the pre-flight check", exc_info=True)
+        stats = dict(checked=0, rejected=0)
+    if errors:
+        LOGGER.warning("pre-flight check rejected recipe %s in %.3fs (%d of %d rejected so far): %s",
+                       recipe_file, time.time() - started, stats['rejected'], stats['checked'], '; '.join(errors))
+        raise PreflightError(errors)
+    LOGGER.debug("pre-flight check passed in %.3fs", time.time() - started)
@@ -6,20 +6,23 @@
 ###########################################################
 
 import os
+import json
+import functools
 import psutil
 import click
-from jinja2 import Environment, PackageLoader
 from pywps import configuration
 
 from copernicus import wsgi
+from copernicus import watchdog
+from copernicus import events
+from copernicus import templating
 from six.moves.urllib.parse import urlparse
 
 PID_FILE = os.path.abspath(os.path.join(os.path.curdir, "pywps.pid"))
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
-template_env = Environment(
-    loader=PackageLoader('copernicus', 'templates'), autoescape=True)
+template_env = templating.environment('templates', autoescape=True)
 
 
 def write_user_config(**kwargs):
@@ -85,6 +88,13 @@ def _run(application, bind_host=None, daemon=False):
         '/static': os.path.join(os.path.dirname(__file__), 'static'),
         '/outputs': configuration.get_config_value('server', 'outputpath')
     }
+    if events.enabled():
+        # status events are pushed by a separate asyncio server
+        events.start(bind_host)
+    if watchdog.enabled():
+        # application is a factory, each worker creates its own app
+        watchdog.Supervisor(application, bind_host, port, static_files).serve_forever()
+        return
     run_simple(
         hostname=bind_host,
         port=port,
@@ -197,7 +207,14 @@ def start(config, bind_host, daemon, hostname, port, maxsingleinputsize,
 
     if config:
         cfgfiles.append(config)
-    app = wsgi.create_app(cfgfiles)
+    configuration.load_configuration(wsgi.config_files(cfgfiles))
+    # compile the templates once, forked workers and jobs inherit them
+    from copernicus import runner
+    templating.precompile(template_env, runner.template_env)
+    if watchdog.enabled():
+        app = functools.partial(wsgi.create_app, cfgfiles)
+    else:
+        app = wsgi.create_app(cfgfiles)
     # let's start the service ...
     # See:
     # * https://github.com/geopython/pywps-flask/blob/master/demo.py
@@ -224,5 +241,173 @@ def start(config, bind_host, daemon, hostname, port, maxsingleinputsize,
         _run(app, bind_host=bind_host)
 
 
+@cli.command()
+@click.option(
+    '--config', '-c', metavar='PATH', help='path to pywps configuration file.')
+@click.option(
+    '--process',
+    '-p',
+    'identifiers',
+    multiple=True,
+    help='identifier of process to materialize (default: all materialized processes).')
+@click.option(
+    '--limit',
+    metavar='INT',
+    type=int,
+    help='maximum number of input combinations per process, starting with the defaults '
+         '(default: the defaults and all combinations varying a single input).')
+@click.option(
+    '--set',
+    'fixed',
+    metavar='NAME=VALUE[,VALUE]',
+    multiple=True,
+    help='restrict an input to the given values.')
+@click.option('--force', is_flag=True, help='recompute results already in the store.')
+def materialize(config, identifiers, limit, fixed, force):
+    """Precompute results of processes with a fixed input space."""
+    from copernicus import materialize as store
+
+    cfgfiles = [get_user_config_path()] if os.path.exists(get_user_config_path()) else []
+    if config:
+        cfgfiles.append(config)
+    app = wsgi.create_app(cfgfiles)
+    restrictions = {}
+    for item in fixed:
+        name, values = item.split('=', 1)
+        restrictions[name] = values.split(',')
+    jobs = store.materialize(
+        app,
+        identifiers or store.MATERIALIZED_PROCESSES,
+        limit=limit,
+        fixed=restrictions,
+        force=force)
+    for identifier, inputs, status, duration in jobs:
+        click.echo("{} {} {} ({:.1f}s)".format(
+            identifier,
+            ';'.join('{}={}'.format(k, v) for k, v in sorted(inputs.items())),
+            status,
+            duration))
+
+
+@cli.command('prepare-reference')
+@click.option(
+    '--config', '-c', metavar='PATH', help='path to pywps configuration file.')
+@click.option('--start-year', type=int, help='first year to prepare (default: all available).')
+@click.option('--end-year', type=int, help='last year to prepare (default: all available).')
+def prepare_reference(config, start_year, end_year):
+    """Preprocess the observations used by the recipes once."""
+    from copernicus import reference
+
+    cfgfiles = [os.path.join(os.path.dirname(__file__), 'default.cfg')]
+    if os.path.exists(get_user_config_path()):
+        cfgfiles.append(get_user_config_path())
+    if config:
+        cfgfiles.append(config)
+    configuration.load_configuration(cfgfiles)
+    years = None
+    if start_year or end_year:
+        years = set(range(start_year or 0, (end_year or 9999) + 1))
+    for spec in reference.template_specs():
+        click.echo("{dataset} {short_name} {level:g}Pa {target_grid} {scheme}".format(**spec))
+        try:
+            written = reference.prepare(spec, years=years)
+        except Exception as err:
+            click.echo("  failed: {}".format(err))
+            continue
+        click.echo("  {} years prepared in {}".format(len(written), reference.spec_dir(spec)))
+
+
+@cli.command('make-testdata')
+@click.argument('root', type=click.Path(file_okay=False))
+@click.option(
+    '--process', '-p', 'identifiers', multiple=True, help='process to generate data for (default: all).')
+@click.option(
+    '--variable', 'variables', multiple=True, type=click.Choice(['zg', 'pr', 'tas', 'tasmax', 'tasmin', 'ts', 'psl']),
+    help='variable to generate (default: all).')
+@click.option(
+    '--frequency', 'frequencies', multiple=True, type=click.Choice(['day', 'mon']),
+    help='frequency to generate (default: all).')
+@click.option('--grid', default=5., help='grid spacing in degrees.')
+@click.option('--start-year', type=int, help='first year of the processes which take the period as input.')
+@click.option('--end-year', type=int, help='last year of the processes which take the period as input.')
+@click.option('--years-per-file', default=10, help='maximum number of years per file.')
+@click.option('--dry-run', is_flag=True, help='only list the files.')
+@click.option('--force', is_flag=True, help='overwrite existing files.')
+def make_testdata(root, identifiers, variables, frequencies, grid, start_year, end_year, years_per_file,
+                  dry_run, force):
+    """Generate a synthetic CMIP5 and OBS archive for the recipes of the processes."""
+    from copernicus import testdata
+
+    options = dict(identifiers=identifiers, variables=variables, frequencies=frequencies,
+                   years=(start_year, end_year) if start_year and end_year else None,
+                   years_per_file=years_per_file)
+    if dry_run:
+        for project, relpath, _, _, _ in testdata.plan(**options):
+            click.echo(os.path.join(root, project, relpath))
+        return
+    for path, written in testdata.generate(root, resolution=grid, force=force, **options):
+        click.echo("{} {}".format('written' if written else 'exists ', path))
+    click.echo("\n[data]\narchive_root = {}\nobs_root = {}".format(
+        os.path.abspath(os.path.join(root, 'CMIP5')), os.path.abspath(os.path.join(root, 'OBS'))))
+
+
+@cli.command()
+@click.argument('url', default='http://localhost:5000/wps')
+@click.option(
+    '--mix', default='caps=1,describe=1,sync=1,async=1', show_default=True,
+    help='weights of the request kinds caps, describe, sync and async.')
+@click.option('--concurrency', '-n', default=10, help='number of concurrent clients.')
+@click.option('--duration', default=30., help='seconds to run.')
+@click.option('--requests', 'count', type=int, help='number of requests to send instead of a duration.')
+@click.option('--process', '-p', 'identifier', default='sleep', help='process to execute.')
+@click.option('--inputs', default='delay=1', help='DataInputs of the Execute requests.')
+@click.option('--describe', default='all', help='identifier of the DescribeProcess requests.')
+@click.option('--poll-interval', default=1., help='seconds between status polls of async jobs.')
+@click.option('--timeout', default=600., help='seconds until a request or job is given up.')
+@click.option('--output', '-o', metavar='PATH', help='write the results as JSON to this file.')
+@click.option('--compare', metavar='PATH', help='compare with the JSON results of an earlier run.')
+def bench(url, mix, concurrency, duration, count, identifier, inputs, describe, poll_interval, timeout,
+          output, compare):
+    """Measure a running service under a mix of WPS requests."""
+    from copernicus import bench as load
+
+    try:
+        weights = load.parse_mix(mix)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint='--mix')
+    results = load.Bench(
+        url, weights, concurrency=concurrency, duration=duration, requests=count, identifier=identifier,
+        inputs=inputs, describe=describe, poll_interval=poll_interval, timeout=timeout).run()
+    click.echo(load.format_report(results))
+    if output:
+        with open(output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+        click.echo("results written to {}".format(output))
+    if compare:
+        with open(compare) as fp:
+            click.echo("\nchange against {}:\n{}".format(compare, load.compare(json.load(fp), results)))
+
+
+@cli.command('profile-startup')
+@click.option(
+    '--config', '-c', metavar='PATH', help='path to pywps configuration file.')
+@click.option('--top', default=20, help='number of slowest imports to show.')
+@click.option(
+    '--flamegraph', metavar='PATH', help='write folded stacks for flamegraph.pl or speedscope to this file.')
+def profile_startup(config, top, flamegraph):
+    """Time the cold start of the service per phase and module import."""
+    from copernicus import startup
+
+    cfgfiles = [get_user_config_path()] if os.path.exists(get_user_config_path()) else []
+    if config:
+        cfgfiles.append(config)
+    timings, imports = startup.profile(cfgfiles)
+    click.echo(startup.format_report(timings, imports, top=top))
+    if flamegraph:
+        with open(flamegraph, 'w') as fp:
+            fp.write('\n'.join(startup.folded_stacks(timings, imports)) + '\n')
+        click.echo("folded stacks written to {}".format(flamegraph))
+
+
 if __name__ == "__main__":
     start()
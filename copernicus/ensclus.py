@@ -0,0 +1,266 @@
+"""
+Incremental re-clustering for the EnsClus process.
+
+EnsClus spends almost all of its time reading the ensemble members and
+computing the ``extreme`` statistic. The resulting ensemble anomaly field does
+not depend on ``numclus`` and ``perc``, so after a first successful run we keep
+the anomalies and their principal components in the cache and only redo the
+k-means step when just the clustering parameters change. The cache key
+covers the data the anomalies are computed from, so new or replaced input
+files are not served from old anomalies.
+"""
+import os
+
+import numpy as np
+
+from copernicus.cache import Cache, make_key
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+CACHE_NAMESPACE = 'ensclus'
+
+
+def cache_key(recipe_file, season, area, extreme):
+    """Key of the anomaly field of a recipe, independent of numclus and perc.
+
+    Besides the options the key covers the datasets and years the recipe asks
+    for, the data roots and the size and modification time of the catalogued
+    input files.
+    """
+    import yaml
+    from copernicus import catalog
+
+    with open(recipe_file) as fp:
+        requirements = catalog.recipe_requirements(yaml.safe_load(fp))
+    roots = catalog.data_roots()
+    return make_key('ensclus', requirements, roots, input_files(requirements, roots), season, area, extreme)
+
+
+def input_files(requirements, roots):
+    """Sorted (path, size, modification time) of the catalogued files of the requirements."""
+    from copernicus import catalog
+
+    data = catalog.get_catalog()
+    files = set()
+    for requirement in requirements:
+        project = requirement.get('project')
+        if not roots.get(project) or not data.covers(project):
+            continue
+        for path in data.files(requirement):
+            try:
+                stat = os.stat(os.path.join(roots[project], path))
+            except OSError:
+                files.add((path, None, None))
+            else:
+                files.add((path, stat.st_size, stat.st_mtime))
+    return sorted(files, key=str)
+
+
+def load_state(key):
+    """Return the cached files for key or ``None``."""
+    files = Cache(CACHE_NAMESPACE).get(key)
+    if files is None or 'state' not in files:
+        return None
+    return files
+
+
+def save_state(key, anomalies_file, extreme_file, recipe_file):
+    """Compute the PCs of the anomaly field and store them in the cache."""
+    members = _member_names(recipe_file)
+    lat, lon, anomalies = _read_anomalies(anomalies_file)
+    if len(members) != anomalies.shape[0]:
+        members = ['member{}'.format(i) for i in range(anomalies.shape[0])]
+    pcs, variance_fraction = principal_components(anomalies, lat)
+    state_file = os.path.join(os.path.dirname(os.path.abspath(recipe_file)), 'ensclus_state.npz')
+    np.savez(
+        state_file,
+        members=np.array(members),
+        lat=lat,
+        lon=lon,
+        anomalies=anomalies.reshape(anomalies.shape[0], -1),
+        pcs=pcs,
+        variance_fraction=variance_fraction)
+    return Cache(CACHE_NAMESPACE).put(
+        key,
+        dict(state=state_file, ens_anomalies=anomalies_file, ens_extreme=extreme_file))
+
+
+def principal_components(anomalies, lat):
+    """Return the PCs and explained variance fraction of the anomaly field.
+
+    The field is weighted with sqrt(cos(lat)) as done by EnsClus.
+    """
+    weights = np.sqrt(np.abs(np.cos(np.deg2rad(lat))))[:, np.newaxis]
+    field = np.ma.filled(np.ma.masked_invalid(anomalies * weights), 0.)
+    field = field.reshape(field.shape[0], -1)
+    u, s, _ = np.linalg.svd(field, full_matrices=False)
+    variance = s ** 2
+    return u * s, variance / variance.sum()
+
+
+def select_numpcs(variance_fraction, perc):
+    """Return the number of PCs explaining at least perc percent of the variance."""
+    cumulative = np.cumsum(variance_fraction)
+    numpcs = int(np.searchsorted(cumulative, float(perc) / 100. - 1e-12) + 1)
+    return min(numpcs, len(variance_fraction))
+
+
+def kmeans(points, numclus, init=None, n_init=20, max_iter=300, seed=0):
+    """Lloyd's k-means on the rows of points.
+
+    If init centroids are given they are used as the only start, otherwise the
+    best of n_init k-means++ starts is returned. Returns (labels, centroids).
+    """
+    rng = np.random.RandomState(seed)
+    if init is not None:
+        starts = [np.array(init, dtype=float)]
+    else:
+        starts = [_kmeans_plusplus(points, numclus, rng) for _ in range(n_init)]
+    best = None
+    for centroids in starts:
+        labels, centroids, inertia = _lloyd(points, centroids, max_iter)
+        if best is None or inertia < best[2]:
+            best = (labels, centroids, inertia)
+    return best[0], best[1]
+
+
+def _kmeans_plusplus(points, numclus, rng):
+    centroids = [points[rng.randint(len(points))]]
+    for _ in range(1, numclus):
+        dist = np.min(_distances(points, np.array(centroids)), axis=1) ** 2
+        if dist.sum() == 0:
+            centroids.append(points[rng.randint(len(points))])
+        else:
+            centroids.append(points[rng.choice(len(points), p=dist / dist.sum())])
+    return np.array(centroids, dtype=float)
+
+
+def _lloyd(points, centroids, max_iter):
+    labels = None
+    for _ in range(max_iter):
+        new_labels = np.argmin(_distances(points, centroids), axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for k in range(len(centroids)):
+            if np.any(labels == k):
+                centroids[k] = points[labels == k].mean(axis=0)
+    inertia = np.sum((points - centroids[labels]) ** 2)
+    return labels, centroids, inertia
+
+
+def _distances(points, centroids):
+    return np.sqrt(((points[:, np.newaxis, :] - centroids[np.newaxis, :, :]) ** 2).sum(axis=2))
+
+
+def recluster(key, files, numclus, perc, workdir):
+    """Run the clustering step on cached anomalies.
+
+    Returns a dict with the statistics file, the plot and the cached NetCDF files.
+    """
+    numclus = int(numclus)
+    state = np.load(files['state'])
+    numpcs = select_numpcs(state['variance_fraction'], perc)
+    points = state['pcs'][:, :numpcs]
+    if numclus > len(points):
+        raise Exception("numclus={} exceeds the number of ensemble members ({})".format(numclus, len(points)))
+
+    centroids_name = 'centroids_{}_{}'.format(numclus, numpcs)
+    init = np.load(files[centroids_name]) if centroids_name in files else None
+    labels, centroids = kmeans(points, numclus, init=init)
+
+    out_dir = os.path.join(workdir, 'output', 'recluster')
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    name = '{}clus_{}perc'.format(numclus, perc)
+    centroids_file = os.path.join(out_dir, '{}.npy'.format(centroids_name))
+    np.save(centroids_file, centroids)
+    try:
+        Cache(CACHE_NAMESPACE).add_file(key, centroids_name, centroids_file)
+    except Exception:
+        LOGGER.warning("could not store centroids for warm start", exc_info=True)
+
+    statistics_file = os.path.join(out_dir, 'statistics_{}.txt'.format(name))
+    _write_statistics(statistics_file, state, numpcs, perc, labels, centroids, points)
+    plot_file = os.path.join(out_dir, 'anomalies_{}.png'.format(name))
+    _plot_clusters(plot_file, state, labels)
+    return dict(
+        statistics=statistics_file,
+        plot=plot_file,
+        ens_anomalies=files['ens_anomalies'],
+        ens_extreme=files['ens_extreme'])
+
+
+def _write_statistics(statistics_file, state, numpcs, perc, labels, centroids, points):
+    members = state['members']
+    explained = 100. * np.sum(state['variance_fraction'][:numpcs])
+    distances = _distances(points, centroids)
+    with open(statistics_file, 'w') as fp:
+        fp.write("EnsClus re-clustering of {} members\n".format(len(members)))
+        fp.write("numclus = {}, perc = {}, numpcs = {} ({:.1f}% of variance)\n\n".format(
+            len(centroids), perc, numpcs, explained))
+        for k in range(len(centroids)):
+            idx = np.where(labels == k)[0]
+            if len(idx) == 0:
+                fp.write("Cluster {}: empty\n\n".format(k))
+                continue
+            closest = idx[np.argmin(distances[idx, k])]
+            fp.write("Cluster {}: {} members\n".format(k, len(idx)))
+            fp.write("  members: {}\n".format(', '.join(members[idx])))
+            fp.write("  representative member: {}\n".format(members[closest]))
+            fp.write("  distance of representative member to centroid: {:.4f}\n".format(distances[closest, k]))
+            fp.write("  intra-cluster standard deviation: {:.4f}\n\n".format(
+                np.sqrt(np.mean(distances[idx, k] ** 2))))
+
+
+def _plot_clusters(plot_file, state, labels):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    lat, lon = state['lat'], state['lon']
+    anomalies = state['anomalies'].reshape(-1, len(lat), len(lon))
+    numclus = int(labels.max()) + 1
+    fig, axes = plt.subplots(1, numclus, figsize=(5 * numclus, 4), squeeze=False)
+    composites = [np.nanmean(anomalies[labels == k], axis=0) for k in range(numclus) if np.any(labels == k)]
+    vmax = max(np.nanmax(np.abs(c)) for c in composites)
+    for k, ax in enumerate(axes[0]):
+        if not np.any(labels == k):
+            ax.set_axis_off()
+            continue
+        mesh = ax.pcolormesh(lon, lat, np.nanmean(anomalies[labels == k], axis=0),
+                             cmap='RdBu_r', vmin=-vmax, vmax=vmax, shading='auto')
+        ax.set_title('Cluster {} ({} members)'.format(k, int(np.sum(labels == k))))
+    fig.colorbar(mesh, ax=axes[0].tolist(), orientation='horizontal')
+    fig.savefig(plot_file)
+    plt.close(fig)
+
+
+def _read_anomalies(anomalies_file):
+    from netCDF4 import Dataset
+
+    with Dataset(anomalies_file) as ds:
+        lat = _read_coord(ds, ('lat', 'latitude'))
+        lon = _read_coord(ds, ('lon', 'longitude'))
+        for variable in ds.variables.values():
+            if variable.ndim >= 3:
+                data = np.ma.filled(variable[:].astype(float), np.nan)
+                return lat, lon, data.reshape(-1, len(lat), len(lon))
+    raise Exception("no anomaly field found in {}".format(anomalies_file))
+
+
+def _read_coord(ds, names):
+    for name in names:
+        if name in ds.variables:
+            return np.array(ds.variables[name][:], dtype=float)
+    raise Exception("coordinate {} not found".format(names[0]))
+
+
+def _member_names(recipe_file):
+    """Return the dataset names of the recipe in order."""
+    import yaml
+
+    with open(recipe_file) as fp:
+        recipe = yaml.safe_load(fp)
+    return [dataset['dataset'] for dataset in recipe.get('datasets', [])]
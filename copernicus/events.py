@@ -0,0 +1,209 @@
+"""
+Server-Sent Events with the status of WPS jobs.
+
+Instead of polling the status document of an asynchronous Execute request
+clients can subscribe to ``/events/<uuid>`` on ``[events] port`` of
+``copernicus start``::
+
+    $ curl -N http://localhost:5001/events/<uuid>
+
+A ``status`` event with the WPS status, percentage, message and estimated
+remaining time is sent whenever one of them changes and the stream ends
+after the final status. All subscribers are served by one asyncio loop in
+a separate process, which reads the status of all subscribed jobs from the
+request database with one query every ``poll_interval`` seconds.
+"""
+import re
+import json
+import signal
+import asyncio
+import multiprocessing
+
+from pywps import configuration
+from pywps.response.status import WPS_STATUS
+
+from copernicus import jobs
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+STATUS_NAMES = dict((value, name.lower()) for name, value in WPS_STATUS._asdict().items())
+FINAL = ('succeeded', 'failed')
+
+NOT_FOUND = b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+HEADER = (b'HTTP/1.1 200 OK\r\n'
+          b'Content-Type: text/event-stream\r\n'
+          b'Cache-Control: no-cache\r\n'
+          b'Access-Control-Allow-Origin: *\r\n'
+          b'\r\n')
+
+
+def _value(option, default):
+    value = configuration.get_config_value("events", option)
+    return value if value not in (None, '') else default
+
+
+def enabled():
+    return str(_value('enabled', 'false')).lower() == 'true'
+
+
+def read_states(job_ids):
+    """Status of the given jobs from the request database."""
+    from pywps import dblog
+
+    session = dblog.get_session()
+    try:
+        rows = session.query(dblog.ProcessInstance).filter(dblog.ProcessInstance.uuid.in_(job_ids)).all()
+        states = dict((row.uuid, dict(
+            job_id=row.uuid,
+            status=STATUS_NAMES.get(row.status, 'unknown'),
+            percent_done=row.percent_done,
+            message=row.message)) for row in rows)
+    finally:
+        session.close()
+    for job_id, state in states.items():
+        # estimated by the runner, see copernicus.progress
+        record = jobs.get(job_id) or {}
+        state['remaining'] = record.get('remaining')
+    return states
+
+
+def format_event(state, event_id):
+    return 'id: {}\nevent: status\ndata: {}\n\n'.format(event_id, json.dumps(state)).encode('utf-8')
+
+
+class EventServer(object):
+    """Push status changes of jobs to their subscribers."""
+
+    def __init__(self, interval=1., keepalive=15., read=read_states):
+        self.interval = interval
+        self.keepalive = keepalive
+        self.read = read
+        # job -> set of queues of its subscribers
+        self.subscribers = {}
+        # job -> last read status
+        self.states = {}
+        self.events = 0
+        self.wakeup = None
+
+    async def serve(self, host, port):
+        self.wakeup = asyncio.Event()
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        LOGGER.info("serving status events on %s:%s", host, port)
+        poller = asyncio.ensure_future(self.poll())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            poller.cancel()
+
+    async def handle(self, reader, writer):
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            # headers are not used
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            path = request[1].split('?')[0] if len(request) > 1 else ''
+            job_id = path[len('/events/'):].strip('/')
+            if request[:1] != ['GET'] or not path.startswith('/events/') or not re.match(r'^[\w-]+$', job_id):
+                writer.write(NOT_FOUND)
+                await writer.drain()
+                return
+            if job_id not in self.states and not await self.exists(job_id):
+                # unknown or expired job, there will never be an event
+                writer.write(NOT_FOUND)
+                await writer.drain()
+                return
+            writer.write(HEADER)
+            await self.stream(job_id, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def exists(self, job_id):
+        """Whether the job is in the request database, its status is kept for the stream."""
+        loop = asyncio.get_event_loop()
+        try:
+            states = await loop.run_in_executor(None, self.read, [job_id])
+        except Exception:
+            LOGGER.warning("could not read the status of %s", job_id, exc_info=True)
+            # the poll retries
+            return True
+        if job_id not in states:
+            return False
+        self.states.setdefault(job_id, states[job_id])
+        return True
+
+    async def stream(self, job_id, writer):
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(job_id, set()).add(queue)
+        if job_id in self.states:
+            queue.put_nowait(self.states[job_id])
+        else:
+            # read the current status of the new job right away
+            self.wakeup.set()
+        try:
+            while True:
+                try:
+                    state = await asyncio.wait_for(queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    writer.write(b': keepalive\n\n')
+                    await writer.drain()
+                    continue
+                self.events += 1
+                writer.write(format_event(state, self.events))
+                await writer.drain()
+                if state['status'] in FINAL:
+                    return
+        finally:
+            subscribers = self.subscribers[job_id]
+            subscribers.discard(queue)
+            if not subscribers:
+                del self.subscribers[job_id]
+                self.states.pop(job_id, None)
+
+    async def poll(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            self.wakeup.clear()
+            job_ids = list(self.subscribers)
+            if job_ids:
+                try:
+                    # the database is read in a thread to keep the loop responsive
+                    states = await loop.run_in_executor(None, self.read, job_ids)
+                except Exception:
+                    LOGGER.warning("could not read the status of %d jobs", len(job_ids), exc_info=True)
+                    states = {}
+                for job_id, state in states.items():
+                    if job_id in self.subscribers and state != self.states.get(job_id):
+                        self.states[job_id] = state
+                        for queue in self.subscribers[job_id]:
+                            queue.put_nowait(state)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+def _serve(host, port, interval, keepalive):
+    import resource
+
+    # the parent stops this process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # every subscriber holds a connection
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    asyncio.run(EventServer(interval, keepalive).serve(host, port))
+
+
+def start(host):
+    """Serve status events in a child process, returns the process."""
+    process = multiprocessing.get_context('fork').Process(
+        target=_serve,
+        args=(host, int(_value('port', 5001)), float(_value('poll_interval', 1.)), float(_value('keepalive', 15.))),
+        name='copernicus-events')
+    process.daemon = True
+    process.start()
+    return process
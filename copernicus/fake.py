@@ -0,0 +1,223 @@
+"""
+Stand-in for ESMValTool to benchmark the service without the science stack.
+
+With ``[runner] backend = fake`` a run reads the rendered recipe and
+``config.yml`` and writes the output tree ESMValTool would write: the run
+directory with ``main_log.txt``, and for every diagnostic script the plots
+and data files the ``get_outputs`` methods of the processes look for. Every
+preprocessor and diagnostic task is logged like ESMValTool does, so the
+progress of a run is reported as usual, and takes ``[fake] task_duration``
+seconds of which the share ``cpu_load`` is spent computing. File sizes and a
+failure rate are configurable as well.
+"""
+import os
+import time
+import random
+import shutil
+import hashlib
+import logging
+
+import yaml
+
+from pywps import configuration
+
+from copernicus import tracing
+
+LOGGER = logging.getLogger("PYWPS")
+
+# file name patterns of the outputs per diagnostic/script, as globbed by the
+# get_outputs methods of the processes, relative to plot_dir or work_dir
+MILES = os.path.join('{dataset}', '{exp}', '{ensemble}', '{start_year}-{end_year}', '{seasons}')
+OUTPUTS = {
+    'miles_diagnostics/miles_block': [
+        ('plots', os.path.join(MILES, 'Block', name + '*.png')) for name in (
+            'TM90', 'NumberEvents', 'DurationEvents', 'LongBlockEvents', 'BlockEvents', 'ACN', 'CN', 'BI',
+            'MGI', 'Z500', 'ExtraBlock', 'InstBlock')] + [
+        ('work', os.path.join(MILES, 'Block', 'BlockFull*.nc')),
+        ('work', os.path.join(MILES, 'Block', 'BlockClim*.nc'))],
+    'miles_diagnostics/miles_eof': [
+        ('plots', os.path.join(MILES, 'EOFs', '{teles}', 'EOF{}_*.png'.format(i))) for i in range(1, 5)] + [
+        ('work', os.path.join(MILES, 'EOFs', '{teles}', 'EOFs*.nc'))],
+    'miles_diagnostics/miles_regimes': [
+        ('plots', os.path.join(MILES, 'Regimes', 'Regime{}_*.png'.format(i))) for i in range(1, 5)] + [
+        ('work', os.path.join(MILES, 'Regimes', 'RegimesPattern*.nc'))],
+    'capacity_factor/main': [('plots', 'capacity_factor*.png'), ('work', 'capacity_factor*.nc')],
+    'combine_indices/main': [('work', '*.nc')],
+    'dry_days/consecutive_dry_days': [
+        ('plots', '*dryfreq.png'), ('plots', '*drymax.png'), ('work', '*drymax.nc'), ('work', '*dryfreq.nc')],
+    'diurnal_temperature_indicator/main': [('plots', '*.png'), ('work', 'Seasonal_DTRindicator*.nc')],
+    'diagnostic/spi': [('plots', 'histplot.png'), ('work', 'CMPI5*spi*.nc'), ('work', 'OBS*spi*.nc')],
+    'diagnostic/spei': [('plots', 'histplot.png'), ('work', 'CMPI5*spei*.nc'), ('work', 'OBS*spei*.nc')],
+    'EnsClus/main': [
+        ('plots', 'anomalies*.png'), ('work', 'ens_extreme*.nc'), ('work', 'ens_anomalies*.nc'),
+        ('work', 'statistics*.txt')],
+    'extreme_index/main': [('plots', '{metric}*.png'), ('work', '*risk_insurance_index*.nc')],
+    'heatwaves_coldwaves/main': [('plots', '*extreme_spell*.png'), ('work', '*extreme_spell*.nc')],
+    'weather_regime/main': [
+        ('plots', '*Table_psl*.png'), ('plots', '*psl_predicted_regimes*.png'),
+        ('plots', '*psl_observed_regimes*.png'),
+        ('work', '*rmse*.nc'), ('work', '*exp*.nc'), ('work', '*obs*.nc')],
+    'anomaly_agreement/main': [('plots', 'tas*.png'), ('plots', 'Area*.png'), ('work', 'tas*.nc')],
+    # preproc example and shapefile selection
+    'diagnostic1/script1': [
+        ('plots', 'CMIP5*.png'), ('plots', 'CMIP5*.nc'), ('work', 'CMIP5*.nc'), ('work', 'CMIP5*.xlsx')],
+    'zmnam/main': [
+        ('plots', '*_{}Pa_{}.png'.format(level, kind))
+        for kind in ('mo_reg', 'da_pdf', 'mo_ts') for level in (5000, 25000, 50000, 100000)] + [
+        ('work', '*regr_map*.nc'), ('work', '*eofs*.nc'), ('work', '*pc_mo*.nc'), ('work', '*pc_da*.nc')],
+}
+
+# content of the written files, random so it does not compress
+BLOCK = random.Random(0).getrandbits(8 * 65536).to_bytes(65536, 'little')
+
+
+def _option(name, default):
+    value = configuration.get_config_value("fake", name)
+    return value if value not in (None, '') else default
+
+
+def _size(name, default):
+    return int(configuration.get_size_mb(str(_option(name, default))) * 1024 * 1024)
+
+
+def write_file(path, size):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'wb') as fp:
+        for offset in range(0, size, len(BLOCK)):
+            fp.write(BLOCK[:size - offset])
+
+
+def busy(duration, cpu_load):
+    """Spend duration seconds, the share cpu_load of it computing."""
+    end = time.time() + duration
+    while time.time() < end:
+        step = min(0.1, end - time.time())
+        until = time.time() + step * cpu_load
+        digest = BLOCK
+        while time.time() < until:
+            digest = hashlib.sha1(digest).digest()
+        time.sleep(max(0., step * (1 - cpu_load)))
+
+
+def output_name(pattern, token):
+    """Name matching a glob pattern with the wildcards replaced by token."""
+    parts = pattern.split('*')
+    name = parts[0]
+    for part in parts[1:]:
+        if name and not name.endswith(('_', '/', '.')):
+            name += '_'
+        name += token
+        if part and not part.startswith(('_', '.')):
+            name += '_'
+        name += part
+    return name
+
+
+def _datasets(recipe, diagnostic):
+    datasets = list(recipe.get('datasets') or [])
+    datasets.extend(diagnostic.get('additional_datasets') or [])
+    return datasets
+
+
+def tasks(recipe):
+    """Return the (task name, diagnostic name, script name or None) of a recipe, preprocessor tasks first."""
+    preprocessor, scripts = [], []
+    for diag_name, diagnostic in (recipe.get('diagnostics') or {}).items():
+        diagnostic = diagnostic or {}
+        for short_name in diagnostic.get('variables') or {}:
+            preprocessor.append(('{}/{}'.format(diag_name, short_name), diag_name, None))
+        for script_name in diagnostic.get('scripts') or {}:
+            scripts.append(('{}/{}'.format(diag_name, script_name), diag_name, script_name))
+    return preprocessor + scripts
+
+
+def patterns(recipe, diag_name, script_name):
+    """Return the (plots or work, glob pattern) of the outputs of a diagnostic script and a token for the wildcards."""
+    diagnostic = recipe['diagnostics'][diag_name] or {}
+    settings = dict((diagnostic.get('scripts') or {}).get(script_name) or {})
+    models = [dataset for dataset in _datasets(recipe, diagnostic) if dataset.get('project') == 'CMIP5']
+    fields = dict(dataset='fake', exp='fake', ensemble='r1i1p1', start_year='', end_year='')
+    fields.update(models[0] if models else {})
+    fields.update((key, value) for key, value in settings.items() if not isinstance(value, (dict, list)))
+    token = '{dataset}_{exp}_{ensemble}_{start_year}-{end_year}'.format(**fields)
+    found = OUTPUTS.get('{}/{}'.format(diag_name, script_name),
+                        [('plots', script_name + '*.png'), ('work', script_name + '*.nc')])
+    return [(kind, pattern.format(**fields)) for kind, pattern in found], token
+
+
+def outputs(recipe, diag_name, script_name):
+    """Return the (plots or work, relative path) of the output files of a diagnostic script."""
+    found, token = patterns(recipe, diag_name, script_name)
+    return [(kind, output_name(pattern, token)) for kind, pattern in found]
+
+
+def run_recipe(recipe_file, config_file, result_file):
+    """Pretend to run esmvaltool in this process and write the result to result_file."""
+    from copernicus.runner import _write_result
+
+    with open(recipe_file) as fp:
+        recipe = yaml.safe_load(fp)
+    with open(config_file) as fp:
+        cfg = yaml.safe_load(fp)
+    recipe_name = os.path.splitext(os.path.basename(recipe_file))[0]
+    output_dir = os.path.join(cfg['output_dir'], '{}_{}'.format(recipe_name, time.strftime('%Y%m%d_%H%M%S')))
+    result = {
+        'success': False,
+        'exception': None,
+        'logfile': os.path.join(output_dir, 'run', 'main_log.txt'),
+        'debug_logfile': os.path.join(output_dir, 'run', 'main_log_debug.txt'),
+        'plot_dir': os.path.join(output_dir, 'plots'),
+        'work_dir': os.path.join(output_dir, 'work'),
+        'preproc_dir': os.path.join(output_dir, 'preproc'),
+        'run_dir': os.path.join(output_dir, 'run'),
+    }
+    os.makedirs(result['run_dir'])
+    logger = logging.getLogger('esmvaltool')
+    logger.setLevel(logging.DEBUG)
+    for path, level in ((result['logfile'], logging.INFO), (result['debug_logfile'], logging.DEBUG)):
+        handler = logging.FileHandler(path)
+        handler.setLevel(level)
+        formatter = logging.Formatter('%(asctime)s UTC [%(process)d] %(levelname)s    %(message)s')
+        formatter.converter = time.gmtime
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    _write_result(result_file, result)
+
+    plot_size, data_size = _size('plot_size', '0.1mb'), _size('data_size', '1mb')
+    task_duration = float(_option('task_duration', 1))
+    cpu_load = min(1., max(0., float(_option('cpu_load', 0.5))))
+    try:
+        logger.info("Running fake esmvaltool for recipe %s", recipe_file)
+        if tracing.current_trace_id():
+            logger.info("trace_id=%s", tracing.current_trace_id())
+        time.sleep(float(_option('startup_time', 2)))
+        found = tasks(recipe)
+        logger.info("These tasks will be executed: %s", ', '.join(name for name, _, _ in found))
+        for name, diag_name, script_name in found:
+            logger.info("Starting task %s in process [%s]", name, os.getpid())
+            busy(task_duration, cpu_load)
+            if script_name is None:
+                diagnostic = recipe['diagnostics'][diag_name] or {}
+                for dataset in _datasets(recipe, diagnostic):
+                    write_file(os.path.join(result['preproc_dir'], name, '{}_{}.nc'.format(
+                        dataset.get('project', 'CMIP5'), dataset.get('dataset', 'fake'))), data_size)
+            else:
+                for kind, relpath in outputs(recipe, diag_name, script_name):
+                    root = result['plot_dir'] if kind == 'plots' else result['work_dir']
+                    write_file(os.path.join(root, diag_name, script_name, relpath),
+                               plot_size if relpath.endswith('.png') else data_size)
+                    logger.debug("wrote %s", relpath)
+            logger.info("Successfully completed task %s", name)
+        if random.random() < float(_option('failure_rate', 0)):
+            raise RuntimeError("fake failure")
+        if cfg.get('remove_preproc_dir'):
+            shutil.rmtree(result['preproc_dir'], ignore_errors=True)
+        logger.info("Run was successful")
+        result['success'] = True
+    except Exception as err:
+        logger.exception("Program terminated abnormally")
+        result['exception'] = str(err)
+    _write_result(result_file, result)
+    return result
@@ -0,0 +1,301 @@
+"""
+Registry of ESMValTool runs started by :func:`copernicus.runner.run`.
+
+Each run executes in its own process group and is recorded in a small JSON
+file below ``<cache_root>/jobs`` with its process group, timeout, status and
+timing. Records are changed under a lock shared by all server processes and
+removed ``[jobs] max_age`` seconds after the run ended. Cancelling a job
+kills the whole process tree, so the handler returns and pywps can start the
+next queued job right away. Only the user who started a job, as reported by
+the authenticating proxy, or a client with ``[jobs] admin_token`` may cancel
+it.
+"""
+import os
+import re
+import hmac
+import json
+import time
+import fcntl
+import signal
+import threading
+import contextlib
+
+from pywps import configuration
+
+from copernicus.cache import cache_root
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+WAITING = 'waiting'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMEOUT = 'timeout'
+
+UNITS = dict(second=1, minute=60, hour=3600)
+
+# seconds between removals of expired records by one process
+EXPIRE_INTERVAL = 3600
+_last_expiry = [0.]
+
+
+def _option(name, default=None):
+    value = configuration.get_config_value("jobs", name)
+    return value if value not in (None, '') else default
+
+
+def jobs_dir():
+    path = os.path.join(cache_root(), 'jobs')
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _job_file(job_id):
+    if not re.match(r'^[\w-]+$', str(job_id)):
+        raise ValueError("invalid job id {}".format(job_id))
+    return os.path.join(jobs_dir(), '{}.json'.format(job_id))
+
+
+def parse_duration(text):
+    """Return seconds of a duration like '2 minutes' or ``None``."""
+    match = re.match(r'^\s*([\d.]+)\s*(second|minute|hour)s?\s*$', str(text).lower())
+    if match is None:
+        return None
+    return float(match.group(1)) * UNITS[match.group(2)]
+
+
+def estimated_time(process):
+    """Estimated calculation time of a process from its metadata in seconds."""
+    for metadata in getattr(process, 'metadata', None) or []:
+        if getattr(metadata, 'title', None) == 'Estimated Calculation Time':
+            return parse_duration(metadata.href)
+    return None
+
+
+def timeout_for(process):
+    """Return the timeout of a run in seconds, ``None`` for no timeout.
+
+    ``[runner] timeout`` applies to all processes, otherwise the estimated
+    calculation time times ``timeout_factor`` is used, but at least
+    ``min_timeout``.
+    """
+    def value(option, default):
+        text = configuration.get_config_value("runner", option)
+        return float(text) if text not in (None, '') else default
+
+    timeout = value('timeout', None)
+    if timeout is not None:
+        return timeout or None
+    estimate = estimated_time(process)
+    if estimate is None:
+        return value('default_timeout', 7200.)
+    return max(estimate * value('timeout_factor', 10.), value('min_timeout', 600.))
+
+
+def get(job_id):
+    """Return the record of a job or ``None``."""
+    try:
+        with open(_job_file(job_id)) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+@contextlib.contextmanager
+def _locked():
+    """Serialise changes of job records between threads and processes."""
+    with open(os.path.join(jobs_dir(), '.lock'), 'a') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def update(job_id, **info):
+    """Create or update the record of a job."""
+    job_file = _job_file(job_id)
+    tmp_file = '{}.{}-{}.tmp'.format(job_file, os.getpid(), threading.get_ident())
+    with _locked():
+        record = get(job_id) or dict(job_id=job_id)
+        record.update(info)
+        with open(tmp_file, 'w') as fp:
+            json.dump(record, fp)
+        os.rename(tmp_file, job_file)
+    return record
+
+
+def list_jobs(status=None):
+    records = []
+    for name in sorted(os.listdir(jobs_dir())):
+        if name.endswith('.json'):
+            record = get(name[:-len('.json')])
+            if record and (status is None or record.get('status') == status):
+                records.append(record)
+    return records
+
+
+def cancel_requested(job_id):
+    return os.path.exists(_job_file(job_id) + '.cancel')
+
+
+def kill_tree(pgid, grace=10.):
+    """Terminate a process group and all descendants of its leader."""
+    import psutil
+
+    try:
+        leader = psutil.Process(pgid)
+        processes = [leader] + leader.children(recursive=True)
+    except psutil.Error:
+        processes = []
+    # descendants may have started their own session
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(pgid, sig)
+        except OSError:
+            pass
+        for process in processes:
+            try:
+                process.send_signal(sig)
+            except psutil.Error:
+                pass
+        deadline = time.time() + grace
+        while time.time() < deadline and _alive(processes):
+            time.sleep(0.1)
+        if not _alive(processes):
+            return
+
+
+def _alive(processes):
+    import psutil
+
+    for process in processes:
+        try:
+            if process.status() != psutil.STATUS_ZOMBIE:
+                return True
+        except psutil.Error:
+            pass
+    return False
+
+
+def cancel(job_id):
+    """Cancel a running job. Returns the job record or ``None`` if unknown."""
+    record = get(job_id)
+    if record is None:
+        return None
+    if record.get('status') not in (WAITING, RUNNING):
+        return record
+    open(_job_file(job_id) + '.cancel', 'w').close()
+    LOGGER.info("cancelling job %s", job_id)
+    if record.get('status') == RUNNING and record.get('pgid'):
+        kill_tree(record['pgid'], grace=float(
+            configuration.get_config_value("runner", "kill_grace") or 10))
+    return get(job_id)
+
+
+def cleanup(job_id):
+    try:
+        os.remove(_job_file(job_id) + '.cancel')
+    except OSError:
+        pass
+    if time.time() - _last_expiry[0] > EXPIRE_INTERVAL:
+        expire()
+
+
+def expire(max_age=None):
+    """Remove the records of jobs which ended more than max_age seconds ago."""
+    max_age = float(_option('max_age', 604800) if max_age is None else max_age)
+    _last_expiry[0] = time.time()
+    removed = 0
+    for record in list_jobs():
+        if record.get('status') in (WAITING, RUNNING):
+            continue
+        ended = record.get('finished')
+        if ended is None:
+            try:
+                ended = os.path.getmtime(_job_file(record['job_id']))
+            except OSError:
+                continue
+        if time.time() - ended > max_age:
+            with _locked():
+                for path in (_job_file(record['job_id']), _job_file(record['job_id']) + '.cancel'):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            removed += 1
+    if removed:
+        LOGGER.info("removed %d expired job records", removed)
+    return removed
+
+
+def requester(environ):
+    """Name of the user of a request, from ``[jobs] user_header`` or ``REMOTE_USER``."""
+    if not environ:
+        return None
+    header = _option('user_header')
+    if header:
+        return environ.get('HTTP_' + header.upper().replace('-', '_')) or None
+    return environ.get('REMOTE_USER') or None
+
+
+def may_cancel(record, environ):
+    """Whether the request may cancel the job: sent by its owner or with the admin token."""
+    token = _option('admin_token')
+    authorization = environ.get('HTTP_AUTHORIZATION', '')
+    if token and authorization.startswith('Bearer ') and hmac.compare_digest(
+            authorization[len('Bearer '):].strip().encode('utf-8'), token.encode('utf-8')):
+        return True
+    user = requester(environ)
+    return user is not None and user == record.get('owner')
+
+
+class JobsMiddleware(object):
+    """Serve ``/jobs`` (list), ``/jobs/<id>``, ``/jobs/<id>/cancel`` (POST) and ``/jobs/metrics``."""
+
+    def __init__(self, application, prefix='/jobs'):
+        self.application = application
+        self.prefix = prefix
+
+    def __getattr__(self, name):
+        return getattr(self.application, name)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.rstrip('/') != self.prefix and not path.startswith(self.prefix + '/'):
+            return self.application(environ, start_response)
+        parts = [part for part in path[len(self.prefix):].split('/') if part]
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if parts == ['metrics'] and method == 'GET':
+            from copernicus import catalog
+            from copernicus.resources import prometheus
+            body = (prometheus() + catalog.prometheus()).encode('utf-8')
+            start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'),
+                                      ('Content-Length', str(len(body)))])
+            return [body]
+        try:
+            if not parts and method == 'GET':
+                return self._json(start_response, '200 OK', list_jobs())
+            if len(parts) == 1 and method == 'GET':
+                record = get(parts[0])
+            elif len(parts) == 2 and parts[1] == 'cancel' and method == 'POST':
+                record = get(parts[0])
+                if record is not None:
+                    if not may_cancel(record, environ):
+                        return self._json(start_response, '403 Forbidden', dict(error='not allowed to cancel'))
+                    record = cancel(parts[0])
+            else:
+                return self._json(start_response, '405 Method Not Allowed', dict(error='not allowed'))
+        except ValueError as err:
+            return self._json(start_response, '400 Bad Request', dict(error=str(err)))
+        if record is None:
+            return self._json(start_response, '404 Not Found', dict(error='unknown job'))
+        return self._json(start_response, '200 OK', record)
+
+    def _json(self, start_response, status, content):
+        body = json.dumps(content).encode('utf-8')
+        start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return [body]
@@ -0,0 +1,216 @@
+"""
+Materialised results for processes with a small, enumerable input space.
+
+Processes like ``drought_indicator`` render a fixed period and only vary a
+few literal inputs. Their results can be precomputed offline with
+``copernicus materialize`` and served from the result store by Execute. A
+stored result is only used if it was computed with the same process version,
+recipe templates and data roots, and (optionally) is younger than
+``[cache] result_max_age`` seconds. Everything else falls back to a live run.
+"""
+import os
+import time
+import hashlib
+import itertools
+
+from pywps import Format, configuration
+from pywps.inout.outputs import ComplexOutput
+
+from copernicus.cache import Cache, make_key
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+CACHE_NAMESPACE = 'results'
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates', 'esmvaltool')
+
+# processes whose handlers serve from and write to the result store
+MATERIALIZED_PROCESSES = ('drought_indicator', 'multimodel_products')
+
+# process identifier -> (version, data roots and template mtimes, fingerprint)
+_FINGERPRINTS = {}
+
+
+def request_inputs(request):
+    """Return the literal inputs of a request as a dict of strings."""
+    return dict((name, str(values[0].data)) for name, values in request.inputs.items())
+
+
+def result_key(process, inputs):
+    return make_key(process.identifier, **dict((k, str(v)) for k, v in inputs.items()))
+
+
+def fingerprint(process):
+    """Fingerprint of everything a stored result depends on besides the inputs.
+
+    The templates are only read again when one of them changed.
+    """
+    names = sorted(os.listdir(TEMPLATE_DIR))
+    state = (process.version,
+             configuration.get_config_value("data", "archive_root"),
+             configuration.get_config_value("data", "obs_root"),
+             tuple((name, os.stat(os.path.join(TEMPLATE_DIR, name)).st_mtime) for name in names))
+    cached = _FINGERPRINTS.get(process.identifier)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+    digest = hashlib.sha1()
+    for value in state[:3]:
+        digest.update(str(value).encode('utf-8'))
+    for name in names:
+        with open(os.path.join(TEMPLATE_DIR, name), 'rb') as fp:
+            digest.update(fp.read())
+    _FINGERPRINTS[process.identifier] = (state, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def lookup(process, inputs):
+    """Return (files, meta) of a fresh stored result or ``None``."""
+    cache = Cache(CACHE_NAMESPACE)
+    key = result_key(process, inputs)
+    meta = cache.meta(key)
+    if meta is None:
+        return None
+    if meta.get('fingerprint') != fingerprint(process):
+        LOGGER.info("stored result %s of %s is stale", key, process.identifier)
+        return None
+    max_age = configuration.get_config_value("cache", "result_max_age")
+    if max_age and time.time() - meta.get('created', 0) > float(max_age):
+        LOGGER.info("stored result %s of %s is expired", key, process.identifier)
+        return None
+    files = cache.get(key)
+    if files is None:
+        return None
+    return files, meta
+
+
+def serve(process, request, response):
+    """Fill the response from the result store. Returns ``True`` on a hit."""
+    found = lookup(process, request_inputs(request))
+    if found is None:
+        return False
+    files, meta = found
+    response.update_status("serving precomputed result ...", 50)
+    for name, path in files.items():
+        response.outputs[name].output_format = Format(meta['formats'][name])
+        response.outputs[name].file = path
+    for name, data in meta['literals'].items():
+        response.outputs[name].data = data
+    response.update_status("done.", 100)
+    return True
+
+
+def store(process, request, response):
+    """Store the outputs of a successful live run in the result store."""
+    files, formats, literals = {}, {}, {}
+    for name, output in response.outputs.items():
+        if isinstance(output, ComplexOutput):
+            if output.file and os.path.exists(output.file):
+                files[name] = output.file
+                formats[name] = output.data_format.mime_type
+        elif output.data is not None:
+            literals[name] = output.data
+    meta = dict(
+        fingerprint=fingerprint(process),
+        inputs=request_inputs(request),
+        formats=formats,
+        literals=literals,
+        created=time.time())
+    try:
+        Cache(CACHE_NAMESPACE).put(result_key(process, meta['inputs']), files, meta=meta)
+    except Exception:
+        LOGGER.warning("could not store result of %s", process.identifier, exc_info=True)
+
+
+def allowed_values(inpt):
+    """Return the list of values an input may take."""
+    values = []
+    for allowed in inpt.allowed_values or []:
+        if allowed.allowed_type == 'range':
+            values.extend(range(int(allowed.minval), int(allowed.maxval) + 1, int(allowed.spacing or 1)))
+        else:
+            values.append(allowed.value)
+    if not values:
+        values = [inpt.data]
+    return values
+
+
+def combinations(process, fixed=None, limit=None):
+    """Generate input combinations of a process in priority order.
+
+    The defaults come first, then all combinations varying a single input.
+    The full product, which is far too large to compute for most processes,
+    only follows if a limit is given, up to limit combinations in total.
+    ``fixed`` maps input names to the list of values to restrict the
+    enumeration to.
+    """
+    fixed = fixed or {}
+    names = [inpt.identifier for inpt in process.inputs]
+    defaults, choices = {}, {}
+    for inpt in process.inputs:
+        values = [str(v) for v in allowed_values(inpt)]
+        if inpt.identifier in fixed:
+            values = [str(v) for v in fixed[inpt.identifier]]
+        choices[inpt.identifier] = values
+        default = str(inpt.data)
+        defaults[inpt.identifier] = default if default in values else values[0]
+
+    seen = set()
+
+    def candidates():
+        yield dict(defaults)
+        for name in names:
+            for value in choices[name]:
+                yield dict(defaults, **{name: value})
+        if limit is None:
+            return
+        for values in itertools.product(*[choices[name] for name in names]):
+            yield dict(zip(names, values))
+
+    for inputs in candidates():
+        marker = tuple(inputs[name] for name in names)
+        if marker in seen:
+            continue
+        if limit is not None and len(seen) >= limit:
+            return
+        seen.add(marker)
+        yield inputs
+
+
+def succeeded(document):
+    """Whether an Execute response succeeded and its ``success`` output, if any, is true."""
+    from lxml import etree
+
+    root = etree.fromstring(document)
+    if not root.xpath('//*[local-name()="ProcessSucceeded"]'):
+        return False
+    for output in root.xpath('//*[local-name()="Output"]'):
+        if output.xpath('string(*[local-name()="Identifier"])').strip() == 'success':
+            return output.xpath('string(.//*[local-name()="LiteralData"])').strip().lower() == 'true'
+    return True
+
+
+def materialize(service, identifiers, limit=None, fixed=None, force=False):
+    """Run missing combinations through the service and yield a report per job.
+
+    Results end up in the result store because the handlers of materialised
+    processes store the outputs of every successful live run.
+    """
+    from werkzeug.test import Client
+    from werkzeug.wrappers import Response
+
+    client = Client(service, Response)
+    for identifier in identifiers:
+        process = service.processes[identifier]
+        for inputs in combinations(process, fixed, limit):
+            if force:
+                Cache(CACHE_NAMESPACE).remove(result_key(process, inputs))
+            elif lookup(process, inputs) is not None:
+                yield identifier, inputs, 'cached', 0.
+                continue
+            datainputs = ';'.join('{}={}'.format(k, v) for k, v in sorted(inputs.items()))
+            started = time.time()
+            resp = client.get(
+                '?service=WPS&request=Execute&version=1.0.0&identifier={}&DataInputs={}'.format(
+                    identifier, datainputs))
+            status = 'done' if succeeded(resp.data) else 'failed'
+            yield identifier, inputs, status, time.time() - started
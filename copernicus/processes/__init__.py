@@ -1,39 +1,38 @@
-from .wps_sleep import Sleep
-from .wps_preproc_example import PreprocessExample
-from .wps_consecdrydays import ConsecDryDays
-from .wps_cvdp import CVDP
-from .wps_ensclus import EnsClus
-from .wps_shapeselect import ShapeSelect
-from .wps_blocking import Blocking
-from .wps_zmnam import ZMNAM
-from .wps_teleconnections import Teleconnections
-from .wps_weather_regimes import WeatherRegimes
-from .wps_modes_variability import ModesVariability
-from .wps_combined_indices import CombinedIndices
-from .wps_multimodel_products import MultimodelProducts
-from .wps_heatwaves_coldwaves import HeatwavesColdwaves
-from .wps_diurnal_temperature_index import DiurnalTemperatureIndex
-from .wps_capacity_factor import CapacityFactor
-from .wps_extreme_index import ExtremeIndex
-from .wps_drought_indicator import DroughtIndicator
+from .registry import LazyProcess
 
-processes = [
-    CVDP(),
-    EnsClus(),
-    Sleep(),
-    Blocking(),
-    PreprocessExample(),
-    ZMNAM(),
-    Teleconnections(),
-    WeatherRegimes(),
-    ModesVariability(),
-    CombinedIndices(),
-    MultimodelProducts(),
-    HeatwavesColdwaves(),
-    DiurnalTemperatureIndex(),
-    CapacityFactor(),
-    ExtremeIndex(),
-    DroughtIndicator(),
-    ConsecDryDays(),
-    ShapeSelect(),
+# identifier, title and class of every process, which is imported on first use
+PROCESSES = [
+    ('cvdp', 'NCAR CVDPackage', 'wps_cvdp:CVDP'),
+    ('ensclus', 'EnsClus - Ensemble Clustering', 'wps_ensclus:EnsClus'),
+    ('sleep', 'Sleep Process', 'wps_sleep:Sleep'),
+    ('blocking', 'Blocking metrics and indices', 'wps_blocking:Blocking'),
+    ('preproc', 'Preprocessing Demo', 'wps_preproc_example:PreprocessExample'),
+    ('zmnam', 'Stratosphere-troposphere coupling and annular modes indices (ZMNAM)', 'wps_zmnam:ZMNAM'),
+    ('teleconnections', 'Teleconnection indices', 'wps_teleconnections:Teleconnections'),
+    ('weather_regimes', 'Weather regimes', 'wps_weather_regimes:WeatherRegimes'),
+    ('modes_of_variability', 'Modes of variability', 'wps_modes_variability:ModesVariability'),
+    ('combined_indices', 'Single and multi-model indices based on area averages',
+     'wps_combined_indices:CombinedIndices'),
+    ('multimodel_products', 'Generic multi-model products', 'wps_multimodel_products:MultimodelProducts'),
+    ('heatwaves_coldwaves', 'Heatwave and coldwave duration', 'wps_heatwaves_coldwaves:HeatwavesColdwaves'),
+    ('diurnal_temperature_index', 'Diurnal Temperature Variation (DTR) Indicator',
+     'wps_diurnal_temperature_index:DiurnalTemperatureIndex'),
+    ('capacity_factor', 'Capacity factor of wind power', 'wps_capacity_factor:CapacityFactor'),
+    ('extreme_index', 'Combined Climate Extreme Index', 'wps_extreme_index:ExtremeIndex'),
+    ('drought_indicator', 'Drought indicator', 'wps_drought_indicator:DroughtIndicator'),
+    ('consecdrydays', 'Consecutive Dry Days', 'wps_consecdrydays:ConsecDryDays'),
+    ('shapefile_selection', 'Shapefile selection', 'wps_shapeselect:ShapeSelect'),
 ]
+
+processes = [LazyProcess(identifier, title, '{}.{}'.format(__name__, path))
+             for identifier, title, path in PROCESSES]
+
+
+def __getattr__(name):
+    # the process classes are still importable from this package
+    for _, _, path in PROCESSES:
+        module, classname = path.split(':')
+        if classname == name:
+            import importlib
+            return getattr(importlib.import_module('.' + module, __name__), classname)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
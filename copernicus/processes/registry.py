@@ -0,0 +1,67 @@
+"""
+Lazily loaded processes.
+
+A :class:`LazyProcess` knows the identifier, title and class path of a
+process. The module of the process is imported and the process constructed
+on the first access to any other attribute, e.g. when it is described or
+executed. pywps deep-copies a process before executing it, which yields
+the constructed process.
+"""
+import copy
+import threading
+import importlib
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# callbacks called with every process constructed by a LazyProcess
+on_load = []
+
+
+class LazyProcess(object):
+    """Stand-in for a pywps process constructed on first use."""
+
+    def __init__(self, identifier, title, path):
+        self.identifier = identifier
+        self.title = title
+        self.path = path
+        self._process = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._process is not None
+
+    def load(self):
+        if self._process is None:
+            with self._lock:
+                if self._process is None:
+                    module, classname = self.path.split(':')
+                    process = getattr(importlib.import_module(module), classname)()
+                    if process.identifier != self.identifier:
+                        raise ValueError("{} has identifier {}, registered as {}".format(
+                            self.path, process.identifier, self.identifier))
+                    for callback in on_load:
+                        try:
+                            callback(process)
+                        except Exception:
+                            LOGGER.warning("could not prepare process %s", self.identifier, exc_info=True)
+                    self._process = process
+        return self._process
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('_process', '_lock'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        if name in ('identifier', 'title', 'path', '_process', '_lock'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.load(), name, value)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.load(), memo)
+
+    def __repr__(self):
+        return '<LazyProcess {} ({})>'.format(self.identifier, 'loaded' if self.loaded else self.path)
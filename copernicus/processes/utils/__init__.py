@@ -1 +1,2 @@
-from .esmvaltool_utils import year_ranges, default_outputs, model_experiment_ensemble, outputs_from_plot_names
\ No newline at end of file
+from .esmvaltool_utils import year_ranges, default_outputs, model_experiment_ensemble, outputs_from_plot_names, \
+    update_allowed_values
\ No newline at end of file
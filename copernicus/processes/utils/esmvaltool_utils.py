@@ -70,7 +70,29 @@ def model_experiment_ensemble(models=['MPI-ESM-LR'],
                               ensembles=['r1i1p1'],
                               ensemble_name='Ensemble',
                               start_end_year=None,
-                              start_end_defaults=None):
+                              start_end_defaults=None,
+                              variables=None):
+    """Return model, experiment, ensemble (and year range) inputs.
+
+    The given values are advertised until :func:`update_allowed_values`
+    replaces them with what is available in the data catalogue. ``variables``
+    is a list of (short_name, mip) tuples the recipe needs for each model.
+    """
+    selection = DatasetSelection(
+        models=models,
+        model_name=model_name,
+        experiments=experiments,
+        experiment_name=experiment_name,
+        ensembles=ensembles,
+        ensemble_name=ensemble_name,
+        start_end_year=start_end_year,
+        start_end_defaults=start_end_defaults,
+        variables=variables)
+    return selection.inputs()
+
+
+def _dataset_inputs(models, model_name, experiments, experiment_name,
+                    ensembles, ensemble_name, start_end_year, start_end_defaults):
     model_long_name = model_name.replace('_', ' ').capitalize()
     experiment_long_name = model_name.replace('_', ' ').capitalize()
     ensemble_long_name = model_name.replace('_', ' ').capitalize()
@@ -105,6 +127,93 @@ def model_experiment_ensemble(models=['MPI-ESM-LR'],
     return inputs
 
 
+class DatasetSelection(object):
+    """Model/experiment/ensemble inputs of a process backed by the data catalogue."""
+
+    def __init__(self, variables=None, **settings):
+        self.variables = variables or [(None, None)]
+        self.settings = settings
+
+    def inputs(self, catalog=None):
+        settings = dict(self.settings)
+        if catalog is not None:
+            settings.update(self.choices(catalog))
+        inputs = _dataset_inputs(**settings)
+        for inpt in inputs:
+            inpt.dataset_selection = self
+        return inputs
+
+    def _keys(self, catalog, **facets):
+        keys = []
+        for short_name, mip in self.variables:
+            keys.extend(catalog.select(project='CMIP5', short_name=short_name, mip=mip, **facets))
+        return keys
+
+    def choices(self, catalog):
+        """Return the settings which differ from the given ones, based on the catalogue.
+
+        Experiments are limited to the ones given for the process, models to
+        those having all required variables. Returns an empty dict if the
+        catalogue has no matching data.
+        """
+        experiments = [exp for exp in self.settings['experiments']
+                       if self._keys(catalog, exp=exp)]
+        if not experiments:
+            return {}
+        models = sorted(set(
+            key[1] for exp in experiments for key in self._keys(catalog, exp=exp)
+            if all(catalog.select(project='CMIP5', dataset=key[1], exp=exp, short_name=short_name, mip=mip)
+                   for short_name, mip in self.variables)))
+        if not models:
+            return {}
+        models = _default_first(models, self.settings['models'][0])
+        ensembles = _default_first(
+            sorted(set(key[3] for exp in experiments for key in self._keys(catalog, dataset=models[0], exp=exp))),
+            self.settings['ensembles'][0])
+        choices = dict(models=models, experiments=experiments, ensembles=ensembles)
+
+        if self.settings['start_end_year'] is not None:
+            coverage = catalog.coverage(self._keys(
+                catalog, dataset=models[0], exp=experiments[0], ensemble=ensembles[0]))
+            if coverage:
+                start_year, end_year = coverage[0][0], coverage[-1][1]
+                defaults = self.settings['start_end_defaults'] or self.settings['start_end_year']
+                choices['start_end_year'] = (start_year, end_year)
+                choices['start_end_defaults'] = (
+                    min(max(defaults[0], start_year), end_year),
+                    max(min(defaults[1], end_year), start_year))
+        return choices
+
+
+def _default_first(values, default):
+    if default in values:
+        values.remove(default)
+        values.insert(0, default)
+    return values
+
+
+def update_allowed_values(processes, catalog=None):
+    """Replace the dataset inputs of the processes with values from the catalogue."""
+    if catalog is None:
+        from copernicus.catalog import get_catalog
+        catalog = get_catalog()
+    if not any(catalog.covers(project) for project in catalog.roots):
+        LOGGER.info("no data roots available, keeping configured allowed values")
+        return
+    for process in processes:
+        if not getattr(process, 'loaded', True):
+            # updated when it is constructed, see copernicus.processes.registry
+            continue
+        selections = []
+        for inpt in process.inputs:
+            selection = getattr(inpt, 'dataset_selection', None)
+            if selection is not None and selection not in selections:
+                selections.append(selection)
+        for selection in selections:
+            updated = dict((inpt.identifier, inpt) for inpt in selection.inputs(catalog))
+            process.inputs[:] = [updated.get(inpt.identifier, inpt) for inpt in process.inputs]
+
+
 def outputs_from_plot_names(plotlist):
     plots = []
     for plot in plotlist:
@@ -77,29 +77,30 @@ class CombinedIndices(Process):
             status_supported=True,
             store_supported=True)
 
-    def _handler(self, request, response):
-        response.update_status("starting ...", 0)
-
-        # build esgf search constraints
-        constraints = dict(
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='combined_indices_wp6',
+            # build esgf search constraints
+            constraints=dict(),
+            options=dict(
+                weights=inputs['weights'],
+                moninf=inputs['moninf'],
+                monsup=inputs['monsup'],
+            ),
+            start_year=1950,
+            end_year=2005,
         )
 
-        options = dict(
-            weights=request.inputs['weights'][0].data,
-            moninf=request.inputs['moninf'][0].data,
-            monsup=request.inputs['monsup'][0].data,
-        )
+    def _handler(self, request, response):
+        response.update_status("starting ...", 0)
 
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=self.workdir,
-            diag='combined_indices_wp6',
-            constraints=constraints,
-            options=options,
-            start_year=1950,
-            end_year=2005,
             output_format='png',
+            **self.recipe_parameters(runner.literal_inputs(request.inputs))
         )
 
         # recipe output
@@ -108,7 +109,7 @@ class CombinedIndices(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -135,7 +136,7 @@ class CombinedIndices(Process):
 
         response.outputs['archive'].output_format = Format('application/zip')
         response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
+            os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
 
         response.update_status("done.", 100)
         return response
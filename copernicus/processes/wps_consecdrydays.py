@@ -77,35 +77,36 @@ class ConsecDryDays(Process):
             status_supported=True,
             store_supported=True)
 
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='consecdrydays',
+            # build esgf search constraints
+            constraints=dict(
+                model=inputs['model'],
+                experiment=inputs['experiment'],
+                time_frequency='day',
+                cmor_table='day',
+                ensemble=inputs['ensemble'],
+            ),
+            options=dict(
+                frlim=inputs['frlim'],
+                plim=inputs['plim'],
+            ),
+            start_year=inputs['start_year'],
+            end_year=inputs['end_year'],
+        )
+
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
         workdir = self.workdir
 
-        # build esgf search constraints
-        constraints = dict(
-            model=request.inputs['model'][0].data,
-            experiment=request.inputs['experiment'][0].data,
-            time_frequency='day',
-            cmor_table='day',
-            ensemble=request.inputs['ensemble'][0].data,
-        )
-
-        #build options
-        options = dict(
-            frlim=request.inputs['frlim'][0].data,
-            plim=request.inputs['plim'][0].data,
-        )
-
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=workdir,
-            diag='consecdrydays',
-            constraints=constraints,
-            start_year=request.inputs['start_year'][0].data,
-            end_year=request.inputs['end_year'][0].data,
-	    options=options,
             output_format='png',
+            **self.recipe_parameters(runner.literal_inputs(request.inputs))
         )
 
         # recipe output
@@ -114,7 +115,7 @@ class ConsecDryDays(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -138,7 +139,8 @@ class ConsecDryDays(Process):
         response.update_status("creating archive of diagnostic result ...", 90)
 
         response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
+        response.outputs['archive'].file = runner.compress_output(
+            os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
 
         response.update_status("done.", 100)
         return response
@@ -62,28 +62,32 @@ class CVDP(Process):
             status_supported=True,
             store_supported=True)
 
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='cvdp',
+            # build esgf search constraints
+            constraints=dict(
+                model=inputs['model'],
+                experiment=inputs['experiment'],
+                time_frequency='mon',
+                cmor_table='Amon',
+                ensemble=inputs['ensemble'],
+            ),
+            start_year=inputs['start_year'],
+            end_year=inputs['end_year'],
+        )
+
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
         workdir = self.workdir
 
-        # build esgf search constraints
-        constraints = dict(
-            model=request.inputs['model'][0].data,
-            experiment=request.inputs['experiment'][0].data,
-            time_frequency='mon',
-            cmor_table='Amon',
-            ensemble=request.inputs['ensemble'][0].data,
-        )
-
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=workdir,
-            diag='cvdp',
-            constraints=constraints,
-            start_year=request.inputs['start_year'][0].data,
-            end_year=request.inputs['end_year'][0].data,
             output_format='png',
+            **self.recipe_parameters(runner.literal_inputs(request.inputs))
         )
 
         # recipe output
@@ -92,7 +96,7 @@ class CVDP(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -117,7 +121,7 @@ class CVDP(Process):
 
         response.outputs['archive'].output_format = Format('application/zip')
         response.outputs['archive'].file = runner.compress_output(
-            os.path.join(workdir, 'output'), 'diagnostic_result.zip')
+            os.path.join(workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
 
         response.update_status("done.", 100)
         return response
@@ -63,24 +63,26 @@ class DiurnalTemperatureIndex(Process):
             status_supported=True,
             store_supported=True)
 
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='diurnal_temperature_index_wp7',
+            # build esgf search constraints
+            constraints=dict(),
+            options=dict(),
+            start_year=1961,
+            end_year=2080,
+        )
+
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
 
-        # build esgf search constraints
-        constraints = dict()
-
-        options = dict()
-
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=self.workdir,
-            diag='diurnal_temperature_index_wp7',
-            constraints=constraints,
-            options=options,
-            start_year=1961,
-            end_year=2080,
             output_format='png',
+            **self.recipe_parameters(runner.literal_inputs(request.inputs))
         )
 
         # recipe output
@@ -89,7 +91,7 @@ class DiurnalTemperatureIndex(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -116,7 +118,7 @@ class DiurnalTemperatureIndex(Process):
 
         response.outputs['archive'].output_format = Format('application/zip')
         response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
+            os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
 
         response.update_status("done.", 100)
         return response
@@ -7,7 +7,7 @@ from pywps.response.status import WPS_STATUS
 
 from copernicus.processes.utils import default_outputs, model_experiment_ensemble, year_ranges, outputs_from_plot_names
 
-from .. import runner, util
+from .. import materialize, runner, util
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -86,24 +86,30 @@ class DroughtIndicator(Process):
             status_supported=True,
             store_supported=True)
 
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='spei',
+            # build esgf search constraints
+            constraints=dict(),
+            options=dict(),
+            start_year=2000,
+            end_year=2005,
+        )
+
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
 
-        # build esgf search constraints
-        constraints = dict()
-
-        options = dict()
+        # serve precomputed result if available
+        if materialize.serve(self, request, response):
+            return response
 
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=self.workdir,
-            diag='spei',
-            constraints=constraints,
-            options=options,
-            start_year=2000,
-            end_year=2005,
             output_format='png',
+            **self.recipe_parameters(runner.literal_inputs(request.inputs))
         )
 
         # recipe output
@@ -112,7 +118,7 @@ class DroughtIndicator(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -132,14 +138,19 @@ class DroughtIndicator(Process):
 
         try:
             self.get_outputs(result, response)
+            complete = True
         except Exception as e:
             response.update_status("exception occured: " + str(e), 85)
+            complete = False
 
         response.update_status("creating archive of diagnostic result ...", 90)
 
         response.outputs['archive'].output_format = Format('application/zip')
         response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
+            os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
+
+        if complete:
+            materialize.store(self, request, response)
 
         response.update_status("done.", 100)
         return response
@@ -1,11 +1,12 @@
 import logging
 import os
+import traceback
 
 from pywps import FORMATS, ComplexInput, ComplexOutput, Format, LiteralInput, LiteralOutput, Process
 from pywps.app.Common import Metadata
 from pywps.response.status import WPS_STATUS
 
-from copernicus import runner, util
+from copernicus import ensclus, runner, util
 
 from .utils import default_outputs, model_experiment_ensemble, year_ranges
 
@@ -130,36 +131,57 @@ class EnsClus(Process):
             status_supported=True,
             store_supported=True)
 
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='ensclus',
+            # build esgf search constraints
+            constraints=dict(
+                # model=inputs['model'], # currently not used in recipy
+                experiment='historical',  # inputs['experiment'],
+                mip='Amon',
+                ensemble='r1i1p1',  # inputs['ensemble'],
+            ),
+            options=dict(
+                season=inputs['season'],
+                area=inputs['area'],
+                extreme=inputs['extreme'],
+                numclus=inputs['numclus'],
+                perc=inputs['perc'],
+            ),
+            start_year=inputs['start_year'],
+            end_year=inputs['end_year'],
+        )
+
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
         workdir = self.workdir
 
-        # build esgf search constraints
-        constraints = dict(
-            # model=request.inputs['model'][0].data, # currently not used in recipy
-            experiment='historical', # request.inputs['experiment'][0].data,
-            mip='Amon',
-            ensemble='r1i1p1' # request.inputs['ensemble'][0].data,
-        )
+        parameters = self.recipe_parameters(runner.literal_inputs(request.inputs))
+        options = parameters['options']
 
-        options = dict(
-            season=request.inputs['season'][0].data,
-            area=request.inputs['area'][0].data,
-            extreme=request.inputs['extreme'][0].data,
-            numclus=request.inputs['numclus'][0].data,
-            perc=request.inputs['perc'][0].data,
+        # the anomaly field only depends on the input data, season, area and extreme
+        recipe_file = runner.render_recipe(workdir=workdir, **parameters)
+        cache_key = ensclus.cache_key(
+            recipe_file,
+            season=options['season'],
+            area=options['area'],
+            extreme=options['extreme'],
         )
 
+        # re-cluster cached anomalies without checking or staging the input data
+        cached = ensclus.load_state(cache_key)
+        if cached is not None:
+            response.outputs['recipe'].output_format = FORMATS.TEXT
+            response.outputs['recipe'].file = recipe_file
+            return self._recluster(cache_key, cached, options, response)
+
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=workdir,
-            diag='ensclus',
-            constraints=constraints,
-            start_year=request.inputs['start_year'][0].data,
-            end_year=request.inputs['end_year'][0].data,
             output_format='png',
-            options=options,
+            **parameters
         )
 
         # recipe output
@@ -168,7 +190,7 @@ class EnsClus(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         # log output
         response.outputs['log'].output_format = FORMATS.TEXT
@@ -185,6 +207,8 @@ class EnsClus(Process):
                 self.get_outputs(result, response)
             except Exception as e:
                 response.update_status("exception occured: " + str(e), 85)
+            else:
+                self.cache_anomalies(cache_key, recipe_file, response)
         else:
             LOGGER.exception('esmvaltool failed!')
             response.update_status("exception occured: " + result['exception'],
@@ -194,7 +218,7 @@ class EnsClus(Process):
 
         response.outputs['archive'].output_format = Format('application/zip')
         response.outputs['archive'].file = runner.compress_output(
-            os.path.join(workdir, 'output'), 'diagnostic_result.zip')
+            os.path.join(workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
 
         response.update_status("done.", 100)
         return response
@@ -236,3 +260,64 @@ class EnsClus(Process):
             path_filter=os.path.join('EnsClus', 'main'),
             name_filter="statistics*",
             output_format="txt")
+
+    def cache_anomalies(self, cache_key, recipe_file, response):
+        try:
+            ensclus.save_state(
+                cache_key,
+                anomalies_file=response.outputs['ens_anomalies'].file,
+                extreme_file=response.outputs['ens_extreme'].file,
+                recipe_file=recipe_file)
+        except Exception:
+            LOGGER.warning('could not cache ensclus anomalies', exc_info=True)
+
+    def _recluster(self, cache_key, cached, options, response):
+        response.update_status("re-clustering cached anomalies ...", 20)
+        # ESMValTool does not run, both logs are the log of the re-clustering
+        log_file = os.path.join(self.workdir, 'recluster.log')
+        with open(log_file, 'w') as log:
+            log.write("re-clustering cached anomalies {} with numclus={}, perc={}\n".format(
+                cache_key, options['numclus'], options['perc']))
+            error = None
+            try:
+                result = ensclus.recluster(
+                    cache_key, cached, options['numclus'], options['perc'], self.workdir)
+            except Exception as e:
+                LOGGER.exception('re-clustering failed!')
+                traceback.print_exc(file=log)
+                error = str(e)
+            else:
+                log.write("statistics written to {}\n".format(result['statistics']))
+        for name in ('log', 'debug_log'):
+            response.outputs[name].output_format = FORMATS.TEXT
+            response.outputs[name].file = log_file
+        if error is not None:
+            response.outputs['success'].data = False
+            response.update_status("exception occured: " + error, 100)
+            return response
+
+        response.outputs['success'].data = True
+        response.update_status("collecting output ...", 80)
+        response.outputs['plot'].output_format = Format('application/png')
+        response.outputs['plot'].file = result['plot']
+
+        response.outputs['ens_extreme'].output_format = FORMATS.NETCDF
+        response.outputs['ens_extreme'].file = result['ens_extreme']
+
+        response.outputs['ens_climatologies'].output_format = FORMATS.NETCDF
+        response.outputs['ens_climatologies'].file = result['ens_anomalies']
+
+        response.outputs['ens_anomalies'].output_format = FORMATS.NETCDF
+        response.outputs['ens_anomalies'].file = result['ens_anomalies']
+
+        response.outputs['statistics'].output_format = FORMATS.TEXT
+        response.outputs['statistics'].file = result['statistics']
+
+        response.update_status("creating archive of diagnostic result ...", 90)
+
+        response.outputs['archive'].output_format = Format('application/zip')
+        response.outputs['archive'].file = runner.compress_output(
+            os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
+
+        response.update_status("done.", 100)
+        return response
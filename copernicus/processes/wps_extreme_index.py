@@ -71,26 +71,29 @@ class ExtremeIndex(Process):
             status_supported=True,
             store_supported=True)
 
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='extreme_index_wp7',
+            # build esgf search constraints
+            constraints=dict(),
+            options=dict(metric=inputs['metric']),
+            start_year=1971,
+            end_year=2040,
+        )
+
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
 
-        # build esgf search constraints
-        constraints = dict()
-
-        options = dict(
-            metric=request.inputs['metric'][0].data
-        )
+        parameters = self.recipe_parameters(runner.literal_inputs(request.inputs))
+        constraints, options = parameters['constraints'], parameters['options']
 
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=self.workdir,
-            diag='extreme_index_wp7',
-            constraints=constraints,
-            options=options,
-            start_year=1971,
-            end_year=2040,
             output_format='png',
+            **parameters
         )
 
         # recipe output
@@ -99,7 +102,7 @@ class ExtremeIndex(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -126,7 +129,7 @@ class ExtremeIndex(Process):
 
         response.outputs['archive'].output_format = Format('application/zip')
         response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
+            os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
 
         response.update_status("done.", 100)
         return response
@@ -90,13 +90,9 @@ class HeatwavesColdwaves(Process):
             status_supported=True,
             store_supported=True)
 
-    def _handler(self, request, response):
-        response.update_status("starting ...", 0)
-
-        # build esgf search constraints
-        constraints = dict()
-
-        op = request.inputs['operator'][0].data
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        op = inputs['operator']
         if op == 'exceedances':
             operator = '>'
         elif op == 'non-exceedances':
@@ -104,23 +100,29 @@ class HeatwavesColdwaves(Process):
         else:
             raise Exception('Unknown operator for task: ' + op)
 
-        options = dict(
-            quantile=request.inputs['quantile'][0].data,
-            min_duration=request.inputs['min_duration'][0].data,
-            operator=operator,
-            season=request.inputs['season'][0].data,
+        return dict(
+            diag='heatwaves_coldwaves_wp7',
+            # build esgf search constraints
+            constraints=dict(),
+            options=dict(
+                quantile=inputs['quantile'],
+                min_duration=inputs['min_duration'],
+                operator=operator,
+                season=inputs['season'],
+            ),
+            start_year=1971,
+            end_year=2080,
         )
 
+    def _handler(self, request, response):
+        response.update_status("starting ...", 0)
+
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=self.workdir,
-            diag='heatwaves_coldwaves_wp7',
-            constraints=constraints,
-            options=options,
-            start_year=1971,
-            end_year=2080,
             output_format='png',
+            **self.recipe_parameters(runner.literal_inputs(request.inputs))
         )
 
         # recipe output
@@ -129,7 +131,7 @@ class HeatwavesColdwaves(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -156,7 +158,7 @@ class HeatwavesColdwaves(Process):
 
         response.outputs['archive'].output_format = Format('application/zip')
         response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
+            os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
 
         response.update_status("done.", 100)
         return response
@@ -21,7 +21,8 @@ class ModesVariability(Process):
                 experiments=['historical'],
                 experiment_name='Experiment_historical',
                 ensembles=['r1i1p1'],
-                ensemble_name='Ensemble_historical'),
+                ensemble_name='Ensemble_historical',
+                variables=[('psl', 'Amon')]),
             *year_ranges((1850, 2005), (1971, 2000),
                          start_name='start_historical',
                          end_name='end_historical'),
@@ -31,7 +32,8 @@ class ModesVariability(Process):
                 experiments=['rcp85'],
                 experiment_name='Experiment_projection',
                 ensembles=['r1i1p1'],
-                ensemble_name='Ensemble_projection'),
+                ensemble_name='Ensemble_projection',
+                variables=[('psl', 'Amon')]),
             *year_ranges((2006, 2050), (2020, 2050),
                          start_name='start_projection',
                          end_name='end_projection'),
@@ -140,49 +142,48 @@ class ModesVariability(Process):
             status_supported=True,
             store_supported=True)
 
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='modes_of_variability_wp4',
+            # build esgf search constraints
+            constraints=dict(
+                model_historical=inputs['model_historical'],
+                experiment_historical=inputs['experiment_historical'],
+                ensemble_historical=inputs['ensemble_historical'],
+                start_year_historical=inputs['start_historical'],
+                end_year_historical=inputs['end_historical'],
+                model_projection=inputs['model_projection'],
+                experiment_projection=inputs['experiment_projection'],
+                ensemble_projection=inputs['ensemble_projection'],
+                start_year_projection=inputs['start_projection'],
+                end_year_projection=inputs['end_projection'],
+            ),
+            options=dict(
+                region=inputs['region'],
+                start_historical='{}-01-01'.format(inputs['start_historical']),
+                end_historical='{}-12-31'.format(inputs['end_historical']),
+                start_projection='{}-01-01'.format(inputs['start_projection']),
+                end_projection='{}-12-31'.format(inputs['end_projection']),
+                ncenters=int(inputs['ncenters']),
+                detrend_order=int(inputs['detrend_order']),
+                cluster_method=inputs['cluster_method'],
+                eofs=inputs['eofs'],
+                frequency=inputs['frequency'],
+            ),
+            start_year=inputs['start_historical'],
+            end_year=inputs['end_projection'],
+        )
+
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
 
-        # build esgf search constraints
-        constraints = dict(
-            model_historical=request.inputs['model_historical'][0].data,
-            experiment_historical=request.inputs['experiment_historical'][0].data,
-            ensemble_historical=request.inputs['ensemble_historical'][0].data,
-            start_year_historical=request.inputs['start_historical'][0].data,
-            end_year_historical=request.inputs['end_historical'][0].data,
-            model_projection=request.inputs['model_projection'][0].data,
-            experiment_projection=request.inputs['experiment_projection'][0].data,
-            ensemble_projection=request.inputs['ensemble_projection'][0].data,
-            start_year_projection=request.inputs['start_projection'][0].data,
-            end_year_projection=request.inputs['end_projection'][0].data)
-
-        options = dict(
-            region=request.inputs['region'][0].data,
-            start_historical='{}-01-01'.format(
-                request.inputs['start_historical'][0].data),
-            end_historical='{}-12-31'.format(
-                request.inputs['end_historical'][0].data),
-            start_projection='{}-01-01'.format(
-                request.inputs['start_projection'][0].data),
-            end_projection='{}-12-31'.format(
-                request.inputs['end_projection'][0].data),
-            ncenters=int(request.inputs['ncenters'][0].data),
-            detrend_order=int(request.inputs['detrend_order'][0].data),
-            cluster_method=request.inputs['cluster_method'][0].data,
-            eofs=request.inputs['eofs'][0].data,
-            frequency=request.inputs['frequency'][0].data,
-        )
-
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=self.workdir,
-            diag='modes_of_variability_wp4',
-            constraints=constraints,
-            options=options,
-            start_year=constraints['start_year_historical'],
-            end_year=constraints['end_year_projection'],
             output_format='png',
+            **self.recipe_parameters(runner.literal_inputs(request.inputs))
         )
 
         # recipe output
@@ -191,7 +192,7 @@ class ModesVariability(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -218,7 +219,7 @@ class ModesVariability(Process):
 
         response.outputs['archive'].output_format = Format('application/zip')
         response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
+            os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
 
         response.update_status("done.", 100)
         return response
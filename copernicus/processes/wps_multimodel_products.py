@@ -9,7 +9,7 @@ from pywps.validator.allowed_value import ALLOWEDVALUETYPE
 
 from copernicus.processes.utils import default_outputs, model_experiment_ensemble, year_ranges, outputs_from_plot_names
 
-from .. import runner, util
+from .. import materialize, runner, util
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -95,29 +95,35 @@ class MultimodelProducts(Process):
             status_supported=True,
             store_supported=True)
 
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='multimodel_products_wp5',
+            # build esgf search constraints
+            constraints=dict(),
+            options=dict(
+                moninf=inputs['moninf'],
+                monsup=inputs['monsup'],
+                agreement_threshold=int(inputs['agreement_threshold']),
+                running_mean=int(inputs['running_mean']),
+            ),
+            start_year=1961,
+            end_year=2099,
+        )
+
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
 
-        # build esgf search constraints
-        constraints = dict()
-
-        options = dict(
-            moninf=request.inputs['moninf'][0].data,
-            monsup=request.inputs['monsup'][0].data,
-            agreement_threshold=int(request.inputs['agreement_threshold'][0].data),
-            running_mean=int(request.inputs['running_mean'][0].data),
-        )
+        # serve precomputed result if available
+        if materialize.serve(self, request, response):
+            return response
 
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=self.workdir,
-            diag='multimodel_products_wp5',
-            constraints=constraints,
-            options=options,
-            start_year=1961,
-            end_year=2099,
             output_format='png',
+            **self.recipe_parameters(runner.literal_inputs(request.inputs))
         )
 
         # recipe output
@@ -126,7 +132,7 @@ class MultimodelProducts(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -146,14 +152,19 @@ class MultimodelProducts(Process):
 
         try:
             self.get_outputs(result, response)
+            complete = True
         except Exception as e:
             response.update_status("exception occured: " + str(e), 85)
+            complete = False
 
         response.update_status("creating archive of diagnostic result ...", 90)
 
         response.outputs['archive'].output_format = Format('application/zip')
         response.outputs['archive'].file = runner.compress_output(
-            os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
+            os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
+
+        if complete:
+            materialize.store(self, request, response)
 
         response.update_status("done.", 100)
         return response
@@ -22,7 +22,8 @@ class PreprocessExample(Process):
                 ensembles=['r2i1p1'],
                 ensemble_name='ensemble1',
                 start_end_year=(1850, 2005),
-                start_end_defaults=(2000, 2005)
+                start_end_defaults=(2000, 2005),
+                variables=[('ta', 'Amon')]
             ),
             *model_experiment_ensemble(
                 models=['bcc-csm1-1'],
@@ -31,7 +32,8 @@ class PreprocessExample(Process):
                 ensembles=['r1i1p1'],
                 ensemble_name='ensemble2',
                 start_end_year=(1850, 2005),
-                start_end_defaults=(2000, 2005)
+                start_end_defaults=(2000, 2005),
+                variables=[('ta', 'Amon')]
             ),
             *model_experiment_ensemble(
                 models=['MPI-ESM-LR'],
@@ -40,7 +42,8 @@ class PreprocessExample(Process):
                 ensembles=['r1i1p1'],
                 ensemble_name='ensemble3',
                 start_end_year=(1850, 2005),
-                start_end_defaults=(2000, 2005)
+                start_end_defaults=(2000, 2005),
+                variables=[('ta', 'Amon')]
             ),
             LiteralInput('extract_levels', 'Extraction levels',
                          abstract='Choose an extraction level for the preprocessor.',
@@ -87,35 +90,37 @@ class PreprocessExample(Process):
             status_supported=True,
             store_supported=True)
 
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='preproc',
+            # build esgf search constraints
+            constraints=dict(
+                model1=inputs['model1'],
+                ensemble1=inputs['ensemble1'],
+                model2=inputs['model2'],
+                ensemble2=inputs['ensemble2'],
+                model3=inputs['model3'],
+                ensemble3=inputs['ensemble3'],
+                experiment=inputs['experiment'],
+            ),
+            options=dict(
+                extract_levels=inputs['extract_levels'],
+            ),
+            start_year=inputs['start_year'],
+            end_year=inputs['end_year'],
+        )
+
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
         workdir = self.workdir
 
-        # build esgf search constraints
-        constraints = dict(
-            model1=request.inputs['model1'][0].data,
-            ensemble1=request.inputs['ensemble1'][0].data,
-            model2=request.inputs['model2'][0].data,
-            ensemble2=request.inputs['ensemble2'][0].data,
-            model3=request.inputs['model3'][0].data,
-            ensemble3=request.inputs['ensemble3'][0].data,
-            experiment=request.inputs['experiment'][0].data,
-        )
-
-        options = dict(
-            extract_levels=request.inputs['extract_levels'][0].data
-        )
-
         # generate recipe
         response.update_status("generate recipe ...", 10)
         recipe_file, config_file = runner.generate_recipe(
             workdir=workdir,
-            diag='preproc',
-            constraints=constraints,
-            start_year=request.inputs['start_year'][0].data,
-            end_year=request.inputs['end_year'][0].data,
             output_format='png',
-            options=options
+            **self.recipe_parameters(runner.literal_inputs(request.inputs))
         )
 
         # recipe output
@@ -124,7 +129,7 @@ class PreprocessExample(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -148,7 +153,8 @@ class PreprocessExample(Process):
         response.update_status("creating archive of diagnostic result ...", 90)
 
         response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(os.path.join(workdir, 'output'), 'diagnostic_result.zip')
+        response.outputs['archive'].file = runner.compress_output(
+            os.path.join(workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
 
         response.update_status("done.", 100)
         return response
@@ -1,15 +1,98 @@
-from pywps import Process, LiteralInput, LiteralOutput
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import subprocess
+
+from pywps import Process, LiteralInput, LiteralOutput, ComplexOutput, FORMATS
 from pywps.app.Common import Metadata
 
+from copernicus import runner
+from copernicus.fake import BLOCK, write_file
+
+MB = 1024 * 1024
+
+# burn() in a child process that only imports the standard library
+BURN = ("import hashlib, os, sys, time\n"
+        "block, end = os.urandom(65536), time.time() + float(sys.argv[1])\n"
+        "while time.time() < end:\n"
+        "    hashlib.sha1(block).digest()\n")
+
+
+def burn(seconds):
+    """Keep one core busy for seconds, hashing releases the GIL so threads run in parallel."""
+    end = time.time() + seconds
+    while time.time() < end:
+        hashlib.sha1(BLOCK).digest()
+
+
+def burn_parallel(seconds, workers, parallel):
+    """Burn seconds in each of workers threads or processes."""
+    if seconds <= 0 or workers < 1:
+        return
+    if parallel == 'processes':
+        children = [subprocess.Popen([sys.executable, '-c', BURN, str(seconds)])
+                    for _ in range(workers)]
+        for child in children:
+            child.wait()
+    else:
+        threads = [threading.Thread(target=burn, args=(seconds,)) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def allocate(size):
+    """Allocate size bytes and touch every page so the memory is resident."""
+    memory = bytearray(size)
+    memory[::4096] = b'\x01' * len(range(0, size, 4096))
+    return memory
+
+
+def read_files(paths):
+    size = 0
+    for path in paths:
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(MB), b''):
+                size += len(chunk)
+    return size
+
 
 class Sleep(Process):
     def __init__(self):
         inputs = [
             LiteralInput('delay', 'Delay between every update',
-                         default='1', data_type='float')
+                         default='1', data_type='float'),
+            LiteralInput('updates', 'Number of status updates',
+                         abstract='Status updates, the delay is slept before every update and at the end.',
+                         default='4', data_type='integer', min_occurs=0),
+            LiteralInput('cpu', 'CPU seconds per worker',
+                         abstract='Seconds every worker keeps a core busy, spread over the updates.',
+                         default='0', data_type='float', min_occurs=0),
+            LiteralInput('workers', 'Number of workers burning CPU',
+                         default='1', data_type='integer', min_occurs=0),
+            LiteralInput('parallel', 'Run the workers as threads or processes',
+                         default='threads', data_type='string', min_occurs=0,
+                         allowed_values=['threads', 'processes']),
+            LiteralInput('memory', 'Memory to allocate in MB',
+                         abstract='Memory held from the start until the end of the process.',
+                         default='0', data_type='float', min_occurs=0),
+            LiteralInput('files', 'Number of output files',
+                         abstract='Files written, read back and published as an archive.',
+                         default='0', data_type='integer', min_occurs=0),
+            LiteralInput('file_size', 'Size of every output file in MB',
+                         default='1', data_type='float', min_occurs=0),
         ]
         outputs = [
-            LiteralOutput('sleep_output', 'Sleep Output', data_type='string')
+            LiteralOutput('sleep_output', 'Sleep Output', data_type='string'),
+            LiteralOutput('stats', 'Measured load', abstract='Timings and sizes of the load as JSON.',
+                          data_type='string'),
+            ComplexOutput('archive', 'Archive of the output files',
+                          as_reference=True,
+                          supported_formats=[FORMATS.ZIP]),
         ]
 
         super(Sleep, self).__init__(
@@ -18,7 +101,9 @@ class Sleep(Process):
             version='1.0',
             title='Sleep Process',
             abstract='Testing a long running process, in the sleep.'
-                     'This process will sleep for a given delay or 10 seconds if not a valid value.',
+                     'This process will sleep for a given delay or 10 seconds if not a valid value. '
+                     'It can also keep CPUs busy, allocate memory and write output files to '
+                     'generate a synthetic load.',
             profile='',
             metadata=[
                 Metadata('PyWPS Demo', 'https://pywps-demo.readthedocs.io/en/latest/'),
@@ -29,24 +114,49 @@ class Sleep(Process):
             status_supported=True
         )
 
-    @staticmethod
-    def _handler(request, response):
-        import time
-
-        if 'delay' in request.inputs:
-            sleep_delay = request.inputs['delay'][0].data
-        else:
-            sleep_delay = 1
-
-        time.sleep(sleep_delay)
-        response.update_status('PyWPS Process started. Waiting...', 20)
-        time.sleep(sleep_delay)
-        response.update_status('PyWPS Process started. Waiting...', 40)
-        time.sleep(sleep_delay)
-        response.update_status('PyWPS Process started. Waiting...', 60)
-        time.sleep(sleep_delay)
-        response.update_status('PyWPS Process started. Waiting...', 80)
-        time.sleep(sleep_delay)
+    def _handler(self, request, response):
+        def value(name, default):
+            return request.inputs[name][0].data if name in request.inputs else default
+
+        sleep_delay = value('delay', 1)
+        updates = max(0, value('updates', 4))
+        workers = value('workers', 1)
+        parallel = value('parallel', 'threads')
+        cpu_step = value('cpu', 0) / (updates + 1)
+        stats = dict(cpu=0., memory=0, written=0, write=0., read=0., archive=0.)
+
+        started = time.time()
+        memory = allocate(int(value('memory', 0) * MB))
+        stats['memory'] = len(memory)
+        for step in range(updates + 1):
+            begin = time.time()
+            burn_parallel(cpu_step, workers, parallel)
+            stats['cpu'] += time.time() - begin
+            time.sleep(sleep_delay)
+            if step < updates:
+                response.update_status('PyWPS Process started. Waiting...', 100 * (step + 1) // (updates + 1))
+
+        output_dir = os.path.join(self.workdir, 'output')
+        paths = [os.path.join(output_dir, 'file_{:05d}.dat'.format(i)) for i in range(value('files', 0))]
+        begin = time.time()
+        for path in paths:
+            write_file(path, int(value('file_size', 1) * MB))
+        stats['write'] = time.time() - begin
+        stats['written'] = sum(os.path.getsize(path) for path in paths)
+        begin = time.time()
+        read_files(paths)
+        stats['read'] = time.time() - begin
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        begin = time.time()
+        response.outputs['archive'].output_format = FORMATS.ZIP
+        response.outputs['archive'].file = runner.compress_output(
+            output_dir, os.path.join(self.workdir, 'sleep_result.zip'))
+        stats['archive'] = time.time() - begin
+        stats['total'] = time.time() - started
+        del memory
+
         response.outputs['sleep_output'].data = 'done sleeping (delay={})'.format(sleep_delay)
+        response.outputs['stats'].data = json.dumps(stats, sort_keys=True)
 
         return response
@@ -20,7 +20,8 @@ class Teleconnections(Process):
                 experiments=['historical'],
                 ensembles=['r2i1p1'],
                 start_end_year=(1850, 2005),
-                start_end_defaults=(1980, 1989)
+                start_end_defaults=(1980, 1989),
+                variables=[('zg', 'day')]
             ),
             LiteralInput(
                 'ref_model',
@@ -79,34 +80,38 @@ class Teleconnections(Process):
             status_supported=True,
             store_supported=True)
 
+    def recipe_parameters(self, inputs):
+        """Arguments of :func:`copernicus.runner.render_recipe` for the inputs (identifier -> value)."""
+        return dict(
+            diag='miles_eof',
+            # build esgf search constraints
+            constraints=dict(
+                model=inputs['model'],
+                experiment=inputs['experiment'],
+                ensemble=inputs['ensemble'],
+            ),
+            options=dict(
+                season=inputs['season'],
+                teles=inputs['teles'],
+            ),
+            start_year=inputs['start_year'],
+            end_year=inputs['end_year'],
+        )
+
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
         workdir = self.workdir
 
-        # build esgf search constraints
-        constraints = dict(
-            model=request.inputs['model'][0].data,
-            experiment=request.inputs['experiment'][0].data,
-            ensemble=request.inputs['ensemble'][0].data,
-        )
-
-        options = dict(
-            season=request.inputs['season'][0].data,
-            teles=request.inputs['teles'][0].data
-        )
+        parameters = self.recipe_parameters(runner.literal_inputs(request.inputs))
+        constraints, options = parameters['constraints'], parameters['options']
+        start_year, end_year = parameters['start_year'], parameters['end_year']
 
         # generate recipe
         response.update_status("generate recipe ...", 10)
-        start_year = request.inputs['start_year'][0].data
-        end_year = request.inputs['end_year'][0].data
         recipe_file, config_file = runner.generate_recipe(
             workdir=workdir,
-            diag='miles_eof',
-            constraints=constraints,
-            options=options,
-            start_year=start_year,
-            end_year=end_year,
             output_format='png',
+            **parameters
         )
 
         # recipe output
@@ -115,7 +120,7 @@ class Teleconnections(Process):
 
         # run diag
         response.update_status("running diagnostic ...", 20)
-        result = runner.run(recipe_file, config_file)
+        result = runner.run(recipe_file, config_file, process=self, response=response)
 
         response.outputs['success'].data = result['success']
 
@@ -145,7 +150,8 @@ class Teleconnections(Process):
         response.update_status("creating archive of diagnostic result ...", 90)
 
         response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(os.path.join(workdir, 'output'), 'diagnostic_result.zip')
+        response.outputs['archive'].file = runner.compress_output(
+            os.path.join(workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'))
 
         response.update_status("done.", 100)
         return response
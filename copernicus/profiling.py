@@ -0,0 +1,152 @@
+"""
+Opt-in sampling profiler for single Execute requests.
+
+With ``[profiling] enabled = true`` an Execute request sent with the header
+``X-Copernicus-Profile: true`` or the query parameter ``profile=true`` is
+profiled: while its handler runs, a thread samples the Python stacks of all
+threads of the job every ``[profiling] interval`` seconds. This covers the
+handler, the runner and the output collection, but not ESMValTool itself,
+which runs in a child process. The samples are written in the collapsed
+stack format understood by speedscope and flamegraph.pl and attached to the
+response as the extra output ``profile``. Requests without the header or
+parameter, and all requests while profiling is disabled, are not affected.
+"""
+import os
+import sys
+import time
+import threading
+
+from pywps import Format, configuration
+from pywps.inout.outputs import ComplexOutput
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+HEADER = 'X-Copernicus-Profile'
+PARAMETER = 'profile'
+TRUE = ('1', 'true', 'yes', 'on')
+
+_INSTALLED = False
+
+
+def enabled():
+    return str(configuration.get_config_value("profiling", "enabled")).lower() == 'true'
+
+
+def interval():
+    return float(configuration.get_config_value("profiling", "interval") or 0.01)
+
+
+def requested(wps_request):
+    """Whether the HTTP request asks for a profile."""
+    http_request = getattr(wps_request, 'http_request', None)
+    if http_request is None:
+        return False
+    value = http_request.headers.get(HEADER) or http_request.args.get(PARAMETER) or ''
+    return value.strip().lower() in TRUE
+
+
+def frame_name(code):
+    return '{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno).replace(';', ':')
+
+
+class Sampler(object):
+    """Count the stacks of all other threads every interval seconds."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        own = threading.current_thread().ident
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'thread-{}'.format(ident)))
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def write(self, path):
+        """Write the stacks in collapsed stack format."""
+        with open(path, 'w') as fp:
+            for stack, count in sorted(self.stacks.items()):
+                fp.write('{} {}\n'.format(stack, count))
+        return path
+
+
+def profile_output(process, path):
+    output = ComplexOutput(
+        'profile', 'Profile',
+        abstract='Sampled Python stacks of the request in collapsed stack format, e.g. for speedscope.',
+        as_reference=True,
+        supported_formats=[Format('text/plain')])
+    output.workdir = process.workdir
+    output.uuid = process.uuid
+    output.output_format = Format('text/plain')
+    output.file = path
+    return output
+
+
+def profiled(process, handler):
+    """Wrap the handler of process to profile it and attach the profile."""
+    def _handler(request, response):
+        sampler = Sampler(interval()).start()
+        started = time.time()
+        try:
+            return handler(request, response)
+        finally:
+            sampler.stop()
+            path = sampler.write(os.path.join(process.workdir, 'profile.collapsed'))
+            LOGGER.info("profiled %s: %d samples in %.1fs, written to %s",
+                        process.identifier, sampler.samples, time.time() - started, path)
+            response.outputs['profile'] = profile_output(process, path)
+    return _handler
+
+
+def install():
+    """Profile the handlers of requests asking for it if profiling is enabled."""
+    global _INSTALLED
+    from pywps import Process
+
+    if not enabled() or _INSTALLED:
+        return _INSTALLED
+    original = Process._run_process
+
+    def _run_process(self, wps_request, wps_response):
+        if not requested(wps_request):
+            return original(self, wps_request, wps_response)
+        handler = self.handler
+        self.handler = profiled(self, handler)
+        try:
+            return original(self, wps_request, wps_response)
+        finally:
+            self.handler = handler
+
+    Process._run_process = _run_process
+    _INSTALLED = True
+    return _INSTALLED
@@ -0,0 +1,169 @@
+"""
+Progress of an ESMValTool run parsed from its ``main_log.txt``.
+
+ESMValTool logs the tasks it is going to execute and the start and
+successful completion of every preprocessor and diagnostic task. The log
+is read incrementally while the run is going on and the share of finished
+tasks is mapped onto the 20-80% range of the WPS status, together with an
+estimate of the remaining time.
+"""
+import re
+import json
+import time
+import statistics
+
+from pywps import configuration
+
+from copernicus import jobs
+from copernicus import resources
+
+TASKS = re.compile(r'These tasks will be executed: (.*)$')
+STARTED = re.compile(r'Starting task (\S+)')
+COMPLETED = re.compile(r'Successfully completed task (\S+)')
+
+# share of a task that counts as done once it is started
+STARTED_WEIGHT = 0.3
+
+
+class LogTail(object):
+    """Read the lines appended to a file since the last call."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.offset = 0
+        self.rest = ''
+
+    def lines(self):
+        if not self.path:
+            return []
+        try:
+            with open(self.path) as fp:
+                fp.seek(self.offset)
+                data = fp.read()
+                self.offset = fp.tell()
+        except (IOError, OSError):
+            return []
+        lines = (self.rest + data).split('\n')
+        # keep an incomplete last line for the next call
+        self.rest = lines.pop()
+        return lines
+
+
+def predicted_duration(process):
+    """Median duration of earlier runs of a process, else its estimated calculation time."""
+    identifier = getattr(process, 'identifier', None)
+    durations = [entry['duration'] for entry in resources.history(identifier)
+                 if identifier and entry.get('status') == jobs.FINISHED and entry.get('duration')]
+    if durations:
+        return statistics.median(durations)
+    return jobs.estimated_time(process)
+
+
+class Progress(object):
+    """Task based progress of one ESMValTool run."""
+
+    def __init__(self, predicted=None, low=20, high=80):
+        self.predicted = predicted
+        self.low = low
+        self.high = high
+        self.tasks = []
+        self.started = set()
+        self.completed = set()
+
+    def feed(self, line):
+        match = TASKS.search(line)
+        if match:
+            self.tasks = [task.strip() for task in match.group(1).split(',') if task.strip()]
+            return
+        match = COMPLETED.search(line)
+        if match:
+            self.completed.add(match.group(1))
+            return
+        match = STARTED.search(line)
+        if match:
+            self.started.add(match.group(1))
+
+    @property
+    def total(self):
+        return max(len(self.tasks), len(self.started | self.completed))
+
+    def fraction(self):
+        if not self.total:
+            return 0.
+        running = len(self.started - self.completed)
+        return min((len(self.completed) + STARTED_WEIGHT * running) / float(self.total), 1.)
+
+    def percentage(self):
+        return int(self.low + (self.high - self.low) * self.fraction())
+
+    def remaining(self, elapsed):
+        """Estimated seconds until the run is done or ``None``."""
+        fraction = self.fraction()
+        if fraction > 0:
+            estimate = elapsed / fraction - elapsed
+            if self.predicted:
+                # blend with the prediction while only few tasks are done
+                estimate = fraction * estimate + (1 - fraction) * max(self.predicted - elapsed, 0)
+            return max(estimate, 0.)
+        if self.predicted:
+            return max(self.predicted - elapsed, 0.)
+        return None
+
+    def message(self, elapsed):
+        text = "running diagnostic: {} of {} tasks done".format(len(self.completed), self.total or '?')
+        remaining = self.remaining(elapsed)
+        if remaining is not None:
+            text += ", about {} left".format(_format_seconds(remaining))
+        return text + " ..."
+
+
+class Reporter(object):
+    """Follow the log of a run and report its progress at most every ``[runner] status_interval`` seconds.
+
+    The path of the log is read from the result file the run writes when it starts.
+    """
+
+    def __init__(self, job_id, result_file, response=None, predicted=None, started=None):
+        self.job_id = job_id
+        self.result_file = result_file
+        self.response = response
+        self.progress = Progress(predicted)
+        self.tail = LogTail()
+        self.started = started or time.time()
+        self.interval = float(configuration.get_config_value("runner", "status_interval") or 5.)
+        self.reported = None
+        self.last = 0.
+
+    def _logfile(self):
+        try:
+            with open(self.result_file) as fp:
+                return json.load(fp).get('logfile')
+        except (IOError, OSError, ValueError):
+            return None
+
+    def poll(self):
+        if self.tail.path is None:
+            self.tail.path = self._logfile()
+        for line in self.tail.lines():
+            self.progress.feed(line)
+        now = time.time()
+        if now - self.last < self.interval:
+            return
+        elapsed = now - self.started
+        percentage = self.progress.percentage()
+        message = self.progress.message(elapsed)
+        if (percentage, message) == self.reported:
+            return
+        self.last = now
+        self.reported = (percentage, message)
+        remaining = self.progress.remaining(elapsed)
+        jobs.update(self.job_id, progress=percentage,
+                    remaining=None if remaining is None else round(remaining))
+        if self.response is not None:
+            self.response.update_status(message, percentage)
+
+
+def _format_seconds(seconds):
+    if seconds < 90:
+        return "{:.0f}s".format(seconds)
+    return "{:.0f} min".format(seconds / 60.)
@@ -0,0 +1,272 @@
+"""
+Store of preprocessed observation reference data.
+
+Recipes like MiLES blocking compare a model with ERA-Interim and every run
+reads the full resolution, multi-level observation record again only to
+extract one pressure level and regrid it. ``copernicus prepare-reference``
+does these two steps once per (dataset, variable, level, target grid) and
+writes the result as one NetCDF4 file per year, chunked by time step, in an
+OBS directory layout below ``[data] reference_root``.
+
+:func:`reference_root_for` is used by ``generate_recipe``: if every OBS
+dataset of a recipe is available in one prepared store, the OBS root of the
+ESMValTool configuration points at it. ESMValTool then only selects the
+yearly files of the requested period and its ``extract_levels`` and
+``regrid`` steps leave the data unchanged.
+"""
+import os
+import json
+
+import numpy as np
+
+from pywps import configuration
+
+from copernicus import catalog
+from copernicus import regrid
+from copernicus.cache import cache_root, make_key
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+MANIFEST = 'manifest.json'
+
+# preprocessor steps that may follow extract_levels and regrid unchanged
+FOLLOWING_STEPS = ('extract_region', 'extract_season', 'extract_month', 'extract_time')
+
+
+def store_root():
+    root = configuration.get_config_value("data", "reference_root")
+    return root or os.path.join(cache_root(), 'reference')
+
+
+def reference_spec(requirement, preprocessor):
+    """Return the spec of the prepared reference for an OBS requirement or ``None``."""
+    if requirement.get('project') != 'OBS' or not preprocessor:
+        return None
+    steps = set(preprocessor)
+    if not {'extract_levels', 'regrid'} <= steps or steps - {'extract_levels', 'regrid'} - set(FOLLOWING_STEPS):
+        return None
+    levels = preprocessor['extract_levels'].get('levels')
+    if isinstance(levels, (list, tuple)):
+        if len(levels) != 1:
+            return None
+        levels = levels[0]
+    settings = preprocessor['regrid']
+    if not isinstance(settings.get('target_grid'), str) or os.path.isfile(settings['target_grid']):
+        return None
+    return dict(
+        dataset=requirement['dataset'],
+        type=requirement.get('type'),
+        version=str(requirement.get('version')),
+        tier=requirement.get('tier'),
+        field=requirement.get('field'),
+        mip=requirement.get('mip'),
+        short_name=requirement['short_name'],
+        level=float(levels),
+        level_scheme=preprocessor['extract_levels'].get('scheme', 'linear'),
+        target_grid=settings['target_grid'],
+        lat_offset=bool(settings.get('lat_offset', True)),
+        lon_offset=bool(settings.get('lon_offset', True)),
+        scheme=settings.get('scheme', 'linear'))
+
+
+def spec_dir(spec):
+    return os.path.join(store_root(), make_key(**spec)[:16])
+
+
+def prepared_years(spec):
+    try:
+        with open(os.path.join(spec_dir(spec), MANIFEST)) as fp:
+            return set(json.load(fp)['years'])
+    except (IOError, OSError, ValueError, KeyError):
+        return set()
+
+
+def recipe_specs(recipe):
+    """Return (requirement, spec) of the OBS requirements of a parsed recipe."""
+    preprocessors = recipe.get('preprocessors') or {}
+    specs = []
+    for requirement in catalog.recipe_requirements(recipe):
+        if requirement.get('project') != 'OBS':
+            continue
+        preprocessor = preprocessors.get(requirement.get('preprocessor'))
+        specs.append((requirement, reference_spec(requirement, preprocessor)))
+    return specs
+
+
+def reference_root_for(recipe_file):
+    """Return the prepared OBS root serving all OBS data of a recipe or ``None``."""
+    import yaml
+
+    if str(configuration.get_config_value("data", "use_reference")).lower() == 'false':
+        return None
+    with open(recipe_file) as fp:
+        recipe = yaml.safe_load(fp)
+    roots = set()
+    for requirement, spec in recipe_specs(recipe):
+        years = set(range(requirement['start_year'], requirement['end_year'] + 1))
+        if spec is None or not years <= prepared_years(spec):
+            return None
+        roots.add(spec_dir(spec))
+    if len(roots) != 1:
+        return None
+    root = roots.pop()
+    LOGGER.info("using prepared observations in %s", root)
+    return root
+
+
+def stock_grid(spec, lat_offset=True, lon_offset=True):
+    """Points of the global ESMValTool stock grid ``<dx>x<dy>``."""
+    dx, dy = [float(value) for value in spec.lower().split('x')]
+    if lat_offset:
+        lat = np.arange(-90. + dy / 2., 90., dy)
+    else:
+        lat = np.linspace(-90., 90., int(round(180. / dy)) + 1)
+    if lon_offset:
+        lon = np.arange(dx / 2., 360., dx)
+    else:
+        lon = np.arange(0., 360., dx)
+    return dict(lat=lat, lon=lon)
+
+
+def _level_weights(plev, level):
+    """Indices and weights interpolating linearly to one pressure level."""
+    plev = np.asarray(plev, dtype=float)
+    exact = np.where(np.isclose(plev, level))[0]
+    if len(exact):
+        return [exact[0]], [1.]
+    order = np.argsort(plev)
+    right = np.searchsorted(plev[order], level)
+    if right == 0 or right == len(plev):
+        raise ValueError("level {} outside of {}-{}".format(level, plev.min(), plev.max()))
+    lower, upper = order[right - 1], order[right]
+    fraction = (level - plev[lower]) / (plev[upper] - plev[lower])
+    return [lower, upper], [1. - fraction, fraction]
+
+
+def _coord_name(ds, names):
+    for name in names:
+        if name in ds.variables:
+            return name
+    raise ValueError("none of {} found".format(', '.join(names)))
+
+
+def prepare(spec, years=None, block=31):
+    """Prepare the yearly reference files of a spec. Returns the years written."""
+    from netCDF4 import Dataset, num2date
+
+    requirement = dict(spec, project='OBS', start_year=0, end_year=9999)
+    current = catalog.get_catalog()
+    sources = [os.path.join(catalog.data_roots()['OBS'], path) for path in current.files(requirement)]
+    if not sources:
+        raise ValueError("no OBS data found for {}".format(catalog.describe(requirement)))
+    # time steps of each year, a year may be split over several files
+    pieces = {}
+    for source in sources:
+        with Dataset(source) as ds:
+            time = ds.variables['time']
+            dates = num2date(time[:], time.units, getattr(time, 'calendar', 'standard'))
+            file_years = np.array([date.year for date in dates])
+        for year in sorted(set(file_years)):
+            pieces.setdefault(int(year), []).append((source, np.where(file_years == year)[0]))
+    data_dir = os.path.join(spec_dir(spec), 'Tier{}'.format(spec['tier']), spec['dataset'])
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    done = prepared_years(spec)
+    written = []
+    for year in sorted(pieces):
+        if (years and year not in years) or year in done:
+            continue
+        filename = 'OBS_{dataset}_{type}_{version}_{field}_{short_name}_{year}0101-{year}1231.nc'.format(
+            year=year, **spec)
+        LOGGER.info("preparing %s", filename)
+        _write_year(os.path.join(data_dir, filename), pieces[year], spec, block)
+        written.append(year)
+        _update_manifest(spec, written)
+    return written
+
+
+def _write_year(filename, pieces, spec, block):
+    from netCDF4 import Dataset
+
+    target = stock_grid(spec['target_grid'], spec['lat_offset'], spec['lon_offset'])
+    nlat, nlon = len(target['lat']), len(target['lon'])
+    tmp_file = filename + '.tmp'
+    with Dataset(tmp_file, 'w', format='NETCDF4') as out:
+        out.createDimension('time', sum(len(indices) for _, indices in pieces))
+        out.createDimension('plev', 1)
+        out.createDimension('lat', nlat)
+        out.createDimension('lon', nlon)
+        position = 0
+        for source, indices in pieces:
+            with Dataset(source) as ds:
+                variable = ds.variables[spec['short_name']]
+                time = ds.variables['time']
+                if position == 0:
+                    data = _create_variables(out, ds, variable, time, target, spec)
+                grid = dict(lat=ds.variables[_coord_name(ds, ('lat', 'latitude'))][:],
+                            lon=ds.variables[_coord_name(ds, ('lon', 'longitude'))][:])
+                weights = regrid.get_weights(grid, target, spec['scheme'])
+                levels, level_weights = _level_weights(
+                    ds.variables[_coord_name(ds, ('plev', 'lev'))][:], spec['level'])
+                out.variables['time'][position:position + len(indices)] = time[indices]
+                # the time steps of a year are consecutive in each file
+                for start in range(indices[0], indices[-1] + 1, block):
+                    stop = min(start + block, indices[-1] + 1)
+                    values = sum(weight * np.ma.asarray(variable[start:stop, level], dtype=float)
+                                 for level, weight in zip(levels, level_weights))
+                    data[position:position + stop - start, 0] = regrid.apply_weights(
+                        weights, values, spec['scheme'], (nlat, nlon))
+                    position += stop - start
+    os.rename(tmp_file, filename)
+
+
+def _create_variables(out, ds, variable, time, target, spec):
+    out.setncatts(dict((name, ds.getncattr(name)) for name in ds.ncattrs()))
+    times = out.createVariable('time', 'f8', ('time',))
+    times.setncatts(dict((name, time.getncattr(name)) for name in time.ncattrs() if name != '_FillValue'))
+    for name, values, attrs in (
+            ('plev', [spec['level']], dict(units='Pa', standard_name='air_pressure', positive='down')),
+            ('lat', target['lat'], dict(units='degrees_north', standard_name='latitude')),
+            ('lon', target['lon'], dict(units='degrees_east', standard_name='longitude'))):
+        coord = out.createVariable(name, 'f8', (name,))
+        coord.setncatts(attrs)
+        coord[:] = values
+    # one chunk per time step, so slicing a period reads only its time steps
+    data = out.createVariable(
+        spec['short_name'], 'f4', ('time', 'plev', 'lat', 'lon'),
+        zlib=True, chunksizes=(1, 1, len(target['lat']), len(target['lon'])), fill_value=np.float32(1e20))
+    data.setncatts(dict((name, variable.getncattr(name)) for name in variable.ncattrs()
+                        if name not in ('_FillValue', 'missing_value', 'scale_factor', 'add_offset')))
+    return data
+
+
+def _update_manifest(spec, years):
+    manifest_file = os.path.join(spec_dir(spec), MANIFEST)
+    manifest = dict(spec=spec, years=sorted(prepared_years(spec) | set(years)))
+    with open(manifest_file + '.tmp', 'w') as fp:
+        json.dump(manifest, fp)
+    os.rename(manifest_file + '.tmp', manifest_file)
+
+
+def template_specs():
+    """Specs of the OBS references used by the recipe templates."""
+    import collections
+    import yaml
+    from copernicus import runner
+
+    specs = []
+    for name in runner.template_env.list_templates(filter_func=lambda name: name.startswith('recipe_')):
+        # the OBS datasets and preprocessors do not depend on the process inputs
+        try:
+            rendered = runner.template_env.get_template(name).render(
+                diag='', workdir='', start_year=0, end_year=0,
+                constraints=collections.defaultdict(str), options=collections.defaultdict(str))
+            found = recipe_specs(yaml.safe_load(rendered))
+        except Exception:
+            LOGGER.debug("could not render %s", name, exc_info=True)
+            continue
+        for _, spec in found:
+            if spec is not None and spec not in specs:
+                specs.append(spec)
+    return specs
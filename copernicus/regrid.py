@@ -0,0 +1,392 @@
+"""
+Cache of regridding weights shared by all ESMValTool runs.
+
+Most recipes regrid models to the grid of an observation (or a stock
+``1x1`` grid), and the ESMValTool ``regrid`` preprocessor computes the
+interpolation weights for the same pair of grids again in every run. For
+rectilinear grids the weights are separable in latitude and longitude, so
+they are computed here once per (source grid, target grid, scheme), stored
+as a sparse matrix in the cache below ``[cache] cache_root`` and applied as
+one sparse matrix product over all time steps and levels.
+
+:func:`install` replaces the ``regrid`` preprocessor function for the runs
+started by :func:`copernicus.runner.run`. Grids or schemes that are not
+supported fall back to the original ESMValTool function.
+"""
+import os
+import hashlib
+import inspect
+import tempfile
+
+import numpy as np
+
+from pywps import configuration
+
+from copernicus.cache import Cache, make_key
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+CACHE_NAMESPACE = 'regrid'
+
+SCHEMES = ('linear', 'linear_extrapolate', 'nearest', 'area_weighted')
+
+# weights loaded in this process, by cache key
+_WEIGHTS = {}
+
+
+def enabled():
+    return str(configuration.get_config_value("cache", "regrid_weights")).lower() != 'false'
+
+
+def grid_hash(lat, lon, lat_bounds=None, lon_bounds=None):
+    """Content hash of a rectilinear grid definition."""
+    digest = hashlib.sha1()
+    for values in (lat, lon, lat_bounds, lon_bounds):
+        if values is not None:
+            digest.update(np.ascontiguousarray(values, dtype='f8').tobytes())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+def guess_bounds(points):
+    """Cell bounds half way between points, like iris' ``guess_bounds``."""
+    points = np.asarray(points, dtype=float)
+    if len(points) == 1:
+        return np.array([[points[0] - 0.5, points[0] + 0.5]])
+    edges = np.empty(len(points) + 1)
+    edges[1:-1] = (points[:-1] + points[1:]) / 2.
+    edges[0] = points[0] - (points[1] - points[0]) / 2.
+    edges[-1] = points[-1] + (points[-1] - points[-2]) / 2.
+    return np.stack([edges[:-1], edges[1:]], axis=1)
+
+
+def linear_weights(source, target, circular=False, extrapolate=False):
+    """Return (rows, cols, values) of 1D linear interpolation weights."""
+    source = np.asarray(source, dtype=float)
+    target = np.asarray(target, dtype=float)
+    index = np.arange(len(source))
+    if circular:
+        # extend by one period on both sides
+        target = source[0] + np.mod(target - source[0], 360.)
+        source = np.concatenate([source, source[:1] + 360.])
+        index = np.concatenate([index, index[:1]])
+    order = np.argsort(source)
+    source, index = source[order], index[order]
+    rows, cols, values = [], [], []
+    for row, value in enumerate(target):
+        if (value < source[0] or value > source[-1]) and not extrapolate:
+            continue
+        right = min(max(np.searchsorted(source, value), 1), len(source) - 1)
+        left = right - 1
+        span = source[right] - source[left]
+        fraction = (value - source[left]) / span if span else 0.
+        rows.extend([row, row])
+        cols.extend([index[left], index[right]])
+        values.extend([1. - fraction, fraction])
+    return rows, cols, values
+
+
+def nearest_weights(source, target, circular=False):
+    rows, cols, values = linear_weights(source, target, circular)
+    nearest = {}
+    for row, col, value in zip(rows, cols, values):
+        if row not in nearest or value > nearest[row][1]:
+            nearest[row] = (col, value)
+    rows = sorted(nearest)
+    return rows, [nearest[row][0] for row in rows], [1.] * len(rows)
+
+
+def area_weights(source_bounds, target_bounds, circular=False, latitude=False):
+    """Return (rows, cols, values) of 1D overlap fractions of cells."""
+    source_bounds = np.sort(np.asarray(source_bounds, dtype=float), axis=1)
+    target_bounds = np.sort(np.asarray(target_bounds, dtype=float), axis=1)
+    if latitude:
+        # area is proportional to sin(lat) differences
+        source_bounds = np.sin(np.deg2rad(np.clip(source_bounds, -90., 90.)))
+        target_bounds = np.sin(np.deg2rad(np.clip(target_bounds, -90., 90.)))
+    shifts = (-360., 0., 360.) if circular else (0.,)
+    rows, cols, values = [], [], []
+    for row, (lower, upper) in enumerate(target_bounds):
+        for col, (src_lower, src_upper) in enumerate(source_bounds):
+            overlap = 0.
+            for shift in shifts:
+                overlap += max(0., min(upper, src_upper + shift) - max(lower, src_lower + shift))
+            if overlap > 0:
+                rows.append(row)
+                cols.append(col)
+                values.append(overlap)
+    return rows, cols, values
+
+
+def _sparse(rows, cols, values, shape):
+    from scipy import sparse
+    return sparse.csr_matrix((values, (rows, cols)), shape=shape)
+
+
+def compute_weights(source, target, scheme):
+    """Weights mapping a flattened (lat, lon) source field to the target grid.
+
+    ``source`` and ``target`` are dicts with ``lat``, ``lon`` points and
+    optional ``lat_bounds``, ``lon_bounds``.
+    """
+    from scipy import sparse
+
+    shapes = []
+    matrices = []
+    for axis in ('lat', 'lon'):
+        circular = axis == 'lon' and _is_global(source['lon'])
+        if scheme == 'area_weighted':
+            source_bounds = source.get(axis + '_bounds')
+            target_bounds = target.get(axis + '_bounds')
+            if source_bounds is None:
+                source_bounds = guess_bounds(source[axis])
+            if target_bounds is None:
+                target_bounds = guess_bounds(target[axis])
+            rows, cols, values = area_weights(source_bounds, target_bounds, circular, latitude=axis == 'lat')
+        elif scheme == 'nearest':
+            rows, cols, values = nearest_weights(source[axis], target[axis], circular)
+        else:
+            rows, cols, values = linear_weights(
+                source[axis], target[axis], circular, extrapolate=scheme == 'linear_extrapolate')
+        shape = (len(target[axis]), len(source[axis]))
+        matrices.append(_sparse(rows, cols, values, shape))
+        shapes.append(shape)
+    weights = sparse.kron(matrices[0], matrices[1], format='csr')
+    if scheme == 'area_weighted':
+        # normalise by the covered area of each target cell
+        totals = np.asarray(weights.sum(axis=1)).ravel()
+        totals[totals == 0] = 1.
+        weights = sparse.diags(1. / totals).dot(weights).tocsr()
+    return weights
+
+
+def _is_global(lon):
+    lon = np.asarray(lon, dtype=float)
+    if len(lon) < 2:
+        return False
+    step = np.abs(np.diff(lon)).mean()
+    return abs(step * len(lon) - 360.) < step / 2.
+
+
+def get_weights(source, target, scheme):
+    """Return cached weights, computing and storing them on a miss."""
+    from scipy import sparse
+
+    key = make_key(grid_hash(**source), grid_hash(**target), scheme)
+    if key in _WEIGHTS:
+        return _WEIGHTS[key]
+    cache = Cache(CACHE_NAMESPACE)
+    files = cache.get(key)
+    if files is not None:
+        weights = sparse.load_npz(files['weights'])
+    else:
+        LOGGER.info("computing %s regridding weights %s", scheme, key)
+        weights = compute_weights(source, target, scheme)
+        tmp_dir = tempfile.mkdtemp(prefix='regrid_')
+        weights_file = os.path.join(tmp_dir, 'weights.npz')
+        sparse.save_npz(weights_file, weights)
+        try:
+            cache.put(key, dict(weights=weights_file), meta=dict(scheme=scheme, shape=list(weights.shape)))
+        except Exception:
+            LOGGER.warning("could not store regridding weights", exc_info=True)
+        finally:
+            os.remove(weights_file)
+            os.rmdir(tmp_dir)
+    _WEIGHTS[key] = weights
+    return weights
+
+
+def apply_weights(weights, data, scheme, target_shape):
+    """Regrid the last two dimensions of data with a sparse matrix product.
+
+    Returns a masked array. A target point is masked if it has no valid
+    source data (or, for ``linear``, if any of its neighbours is missing).
+    """
+    data = np.ma.asarray(data)
+    leading = data.shape[:-2]
+    values = data.reshape(-1, data.shape[-2] * data.shape[-1])
+    valid = (~np.ma.getmaskarray(values)).astype(float)
+    filled = np.ma.filled(values.astype(float), 0.)
+    # (W @ X.T).T for all time steps at once
+    result = weights.dot(filled.T).T
+    coverage = weights.dot(valid.T).T
+    if scheme.startswith('linear'):
+        mask = np.abs(coverage - 1.) > 1e-6
+    else:
+        mask = coverage <= 0.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(mask, 0., result / np.where(mask, 1., coverage))
+    shape = leading + tuple(target_shape)
+    return np.ma.masked_array(result.reshape(shape), mask=mask.reshape(shape))
+
+
+def _grid(cube):
+    """Rectilinear grid definition of a cube or ``None``."""
+    try:
+        lat = cube.coord(axis='Y', dim_coords=True)
+        lon = cube.coord(axis='X', dim_coords=True)
+    except Exception:
+        return None
+    if cube.coord_dims(lat) != (cube.ndim - 2,) or cube.coord_dims(lon) != (cube.ndim - 1,):
+        return None
+    return dict(
+        lat=lat.points,
+        lon=lon.points,
+        lat_bounds=lat.bounds,
+        lon_bounds=lon.bounds)
+
+
+def _regridded_points(weights, points, coord_dims, grid_dims, scheme, source_shape, target_shape):
+    """Regrid the points of a coordinate spanning one or both grid dimensions.
+
+    Returns the points and their dimensions in the regridded cube.
+    """
+    points = np.asarray(points, dtype=float)
+    dims = list(coord_dims)
+    # spread the points over the grid dimensions they do not span
+    for dim, size in zip(grid_dims, source_shape):
+        if dim not in dims:
+            points = np.repeat(points[..., np.newaxis], size, axis=-1)
+            dims.append(dim)
+    leading = [dim for dim in dims if dim not in grid_dims]
+    points = np.transpose(points, [dims.index(dim) for dim in leading + list(grid_dims)])
+    result = apply_weights(weights, points, scheme, target_shape)
+    if grid_dims[1] not in coord_dims:
+        result = result.mean(axis=-1)
+    if grid_dims[0] not in coord_dims:
+        result = result.mean(axis=-2 if grid_dims[1] in coord_dims else -1)
+    spanned = [dim for dim in grid_dims if dim in coord_dims]
+    return np.ma.filled(result, np.nan), tuple(leading + spanned)
+
+
+def _cell_areas(target_grid, radius=6371000.):
+    """Areas in m2 of the cells of a rectilinear grid."""
+    lat = target_grid.coord(axis='Y', dim_coords=True)
+    lon = target_grid.coord(axis='X', dim_coords=True)
+    lat_bounds = lat.bounds if lat.bounds is not None else guess_bounds(lat.points)
+    lon_bounds = lon.bounds if lon.bounds is not None else guess_bounds(lon.points)
+    sin_lat = np.sin(np.deg2rad(np.clip(lat_bounds, -90., 90.)))
+    return radius ** 2 * np.outer(np.abs(np.diff(sin_lat, axis=1)).ravel(),
+                                  np.deg2rad(np.abs(np.diff(lon_bounds, axis=1))).ravel())
+
+
+def _regridded_cube(cube, target_grid, data, weights, scheme):
+    """Cube of regridded data with the coordinates, cell measures and aux factories of cube."""
+    import iris.cube
+
+    if np.issubdtype(cube.dtype, np.floating) or scheme == 'nearest':
+        data = data.astype(cube.dtype)
+    result = iris.cube.Cube(data)
+    result.metadata = cube.metadata
+    dims = cube.ndim - 2
+    grid_dims = (dims, dims + 1)
+    source_shape = cube.shape[dims:]
+    target_shape = data.shape[dims:]
+    grid_coords = (target_grid.coord(axis='Y', dim_coords=True).copy(),
+                   target_grid.coord(axis='X', dim_coords=True).copy())
+    # coordinates of the regridded cube by the id of the original, for the aux factories
+    coords = {}
+    for coord in cube.dim_coords:
+        dim = cube.coord_dims(coord)[0]
+        coords[id(coord)] = coord.copy() if dim < dims else grid_coords[dim - dims]
+        result.add_dim_coord(coords[id(coord)], dim)
+    for coord in cube.aux_coords:
+        coord_dims = cube.coord_dims(coord)
+        if all(dim < dims for dim in coord_dims):
+            new_coord = coord.copy()
+        else:
+            points, coord_dims = _regridded_points(
+                weights, coord.points, coord_dims, grid_dims, scheme, source_shape, target_shape)
+            new_coord = coord.copy(points=points.astype(coord.dtype)
+                                   if np.issubdtype(coord.dtype, np.floating) else points)
+        result.add_aux_coord(new_coord, coord_dims)
+        coords[id(coord)] = new_coord
+    for measure in cube.cell_measures():
+        measure_dims = cube.cell_measure_dims(measure)
+        if all(dim < dims for dim in measure_dims):
+            result.add_cell_measure(measure.copy(), measure_dims)
+            continue
+        if measure.measure == 'area' and tuple(measure_dims) == grid_dims:
+            values = _cell_areas(target_grid)
+        else:
+            values, measure_dims = _regridded_points(
+                weights, measure.data, measure_dims, grid_dims, scheme, source_shape, target_shape)
+        result.add_cell_measure(measure.copy(values.astype(measure.data.dtype)), measure_dims)
+    for factory in cube.aux_factories:
+        try:
+            result.add_aux_factory(factory.updated(coords))
+        except Exception:
+            LOGGER.warning("could not carry over the derived coordinate %s", factory.name(), exc_info=True)
+    return result
+
+
+def _offsets(function, lat_offset, lon_offset):
+    """The grid offset keywords accepted by function, older ESMValTool versions have none."""
+    try:
+        parameters = inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return {}
+    return dict((name, value) for name, value in (('lat_offset', lat_offset), ('lon_offset', lon_offset))
+                if name in parameters)
+
+
+def cached_regrid(original):
+    """Wrap the ESMValTool ``regrid`` preprocessor function."""
+
+    def regrid(cube, target_grid, scheme, lat_offset=True, lon_offset=True):
+        offsets = _offsets(original, lat_offset, lon_offset)
+        if scheme not in SCHEMES:
+            return original(cube, target_grid, scheme, **offsets)
+        try:
+            target_cube = _target_cube(cube, target_grid, lat_offset, lon_offset)
+            source, target = _grid(cube), _grid(target_cube)
+        except Exception:
+            LOGGER.debug("no target grid for %s, using ESMValTool regrid", target_grid, exc_info=True)
+            source, target = None, None
+        if source is None or target is None:
+            return original(cube, target_grid, scheme, **offsets)
+        weights = get_weights(source, target, scheme)
+        data = apply_weights(weights, cube.data, scheme, (len(target['lat']), len(target['lon'])))
+        return _regridded_cube(cube, target_cube, data, weights, scheme)
+
+    regrid.original = original
+    return regrid
+
+
+# stock target cubes by (grid spec, lat_offset, lon_offset)
+_TARGETS = {}
+
+
+def _target_cube(cube, target_grid, lat_offset=True, lon_offset=True):
+    import iris
+    from esmvaltool.preprocessor import _regrid
+
+    if not isinstance(target_grid, str):
+        return target_grid
+    if os.path.isfile(target_grid):
+        return iris.load_cube(target_grid)
+    key = (target_grid, lat_offset, lon_offset)
+    if key not in _TARGETS:
+        _TARGETS[key] = _regrid._stock_cube(target_grid, **_offsets(_regrid._stock_cube, lat_offset, lon_offset))
+    # the cached cube is shared by all cubes, whatever their coordinate system
+    target = _TARGETS[key].copy()
+    for axis in ('X', 'Y'):
+        target.coord(axis=axis).coord_system = cube.coord(axis=axis).coord_system
+    return target
+
+
+def install():
+    """Use cached weights in the ``regrid`` preprocessor of this process."""
+    if not enabled():
+        return
+    try:
+        import esmvaltool.preprocessor as preprocessor
+        from esmvaltool.preprocessor import _regrid
+    except ImportError:
+        return
+    if hasattr(_regrid.regrid, 'original'):
+        return
+    regrid = cached_regrid(_regrid.regrid)
+    _regrid.regrid = regrid
+    preprocessor.regrid = regrid
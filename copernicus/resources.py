@@ -0,0 +1,266 @@
+"""
+Resource accounting of ESMValTool runs.
+
+:class:`ResourceSampler` samples the process tree of a run with psutil and
+keeps peak RSS, CPU seconds, I/O bytes and the number of processes. The
+summary is stored with the job record and appended to a metrics history,
+which is served at ``/jobs/metrics`` and used to predict the memory of
+future runs.
+
+The history keeps the last ``[runner] metrics_history`` runs per process.
+When the file grows beyond ``metrics_max_size`` it is compacted: older runs
+are dropped and only counted in a totals line at the top of the file, so the
+counters at ``/jobs/metrics`` never decrease. Each process reads the file
+incrementally and keeps the recent runs and totals in memory.
+"""
+import os
+import json
+import time
+import fcntl
+import threading
+import collections
+
+from pywps import configuration
+
+from copernicus import catalog
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+HISTORY_FILE = 'metrics.jsonl'
+# summed per process, peak_rss is the maximum
+TOTALS = ('runs', 'cpu_seconds', 'read_bytes', 'write_bytes', 'peak_rss')
+
+
+def sample_interval():
+    return float(configuration.get_config_value("runner", "sample_interval") or 1.)
+
+
+class ResourceSampler(object):
+    """Sample the resources of a process and all its descendants."""
+
+    def __init__(self, pid):
+        import psutil
+
+        self.root = psutil.Process(pid)
+        self.cpu = 0.
+        # last seen I/O counters of every process, exited processes keep their values
+        self.io = {}
+        self.rss = 0
+        self.peak_rss = 0
+        self.peak_processes = 0
+        self.samples = 0
+        self.last = 0.
+
+    def sample(self):
+        import psutil
+
+        try:
+            processes = [self.root] + self.root.children(recursive=True)
+        except psutil.Error:
+            return
+        rss = 0
+        count = 0
+        cpu = 0.
+        for process in processes:
+            try:
+                with process.oneshot():
+                    rss += process.memory_info().rss
+                    times = process.cpu_times()
+                    cpu += times.user + times.system
+                    if process is self.root:
+                        # descendants which already exited and were waited for
+                        cpu += times.children_user + times.children_system
+                    try:
+                        counters = process.io_counters()
+                        self.io[process.pid] = (counters.read_bytes, counters.write_bytes)
+                    except (AttributeError, psutil.AccessDenied):
+                        pass
+                count += 1
+            except psutil.Error:
+                continue
+        self.cpu = max(self.cpu, cpu)
+        self.rss = rss
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_processes = max(self.peak_processes, count)
+        self.samples += 1
+        self.last = time.time()
+
+    def summary(self):
+        return dict(
+            peak_rss=self.peak_rss,
+            cpu_seconds=round(self.cpu, 2),
+            read_bytes=sum(read for read, _ in self.io.values()),
+            write_bytes=sum(write for _, write in self.io.values()),
+            peak_processes=self.peak_processes,
+            samples=self.samples)
+
+
+def input_size(recipe_file):
+    """Total size in bytes of the input files of a recipe according to the catalogue."""
+    import yaml
+
+    with open(recipe_file) as fp:
+        recipe = yaml.safe_load(fp)
+    roots = catalog.data_roots()
+    current = catalog.get_catalog()
+    paths = set()
+    for requirement in catalog.recipe_requirements(recipe):
+        project = requirement.get('project')
+        if current.covers(project):
+            paths.update(os.path.join(roots[project], path) for path in current.files(requirement))
+    size = 0
+    for path in paths:
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    return size
+
+
+def history_file():
+    from copernicus.jobs import jobs_dir
+    return os.path.join(jobs_dir(), HISTORY_FILE)
+
+
+def history_size():
+    return int(configuration.get_config_value("runner", "metrics_history") or 100)
+
+
+def history_max_size():
+    size = configuration.get_config_value("runner", "metrics_max_size") or '1mb'
+    return int(configuration.get_size_mb(size) * 1024 * 1024)
+
+
+def _add(totals, entry):
+    total = totals.setdefault(entry.get('process') or 'unknown', dict.fromkeys(TOTALS, 0))
+    total['runs'] += 1
+    total['cpu_seconds'] += entry.get('cpu_seconds') or 0.
+    total['read_bytes'] += entry.get('read_bytes') or 0
+    total['write_bytes'] += entry.get('write_bytes') or 0
+    total['peak_rss'] = max(total['peak_rss'], entry.get('peak_rss') or 0)
+
+
+def _merge(totals, other):
+    for name, values in other.items():
+        total = totals.setdefault(name, dict.fromkeys(TOTALS, 0))
+        for key in TOTALS:
+            value = values.get(key) or 0
+            total[key] = max(total[key], value) if key == 'peak_rss' else total[key] + value
+
+
+class _History(object):
+    """Recent runs and totals per process, read incrementally from the history file."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset(None)
+
+    def reset(self, key):
+        self.key = key
+        self.offset = 0
+        self.entries = {}
+        self.totals = {}
+
+    def refresh(self):
+        filename = history_file()
+        with self.lock:
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                self.reset(None)
+                return
+            # a compacted history is a new file
+            key = (filename, stat.st_ino)
+            if key != self.key or stat.st_size < self.offset:
+                self.reset(key)
+            if stat.st_size == self.offset:
+                return
+            with open(filename, 'rb') as fp:
+                fp.seek(self.offset)
+                for line in fp:
+                    if not line.endswith(b'\n'):
+                        # being appended
+                        break
+                    self.offset += len(line)
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    if 'totals' in entry:
+                        _merge(self.totals, entry['totals'])
+                        continue
+                    _add(self.totals, entry)
+                    name = entry.get('process')
+                    if name not in self.entries:
+                        self.entries[name] = collections.deque(maxlen=history_size())
+                    self.entries[name].append(entry)
+
+
+_history = _History()
+
+
+def _compact(filename):
+    """Keep the last history_size() runs per process, count the others in the totals line."""
+    totals, entries = {}, {}
+    with open(filename) as fp:
+        for line in fp:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if 'totals' in entry:
+                _merge(totals, entry['totals'])
+                continue
+            kept = entries.setdefault(entry.get('process'), collections.deque(maxlen=history_size()))
+            if len(kept) == kept.maxlen:
+                _add(totals, kept[0])
+            kept.append(entry)
+    tmp_file = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp_file, 'w') as fp:
+        fp.write(json.dumps(dict(totals=totals)) + '\n')
+        for kept in entries.values():
+            for entry in kept:
+                fp.write(json.dumps(entry) + '\n')
+    os.rename(tmp_file, filename)
+    LOGGER.info("compacted metrics history %s", filename)
+
+
+def record(job):
+    """Append the resources of a finished job to the metrics history."""
+    entry = dict((key, job.get(key)) for key in ('job_id', 'process', 'status', 'duration', 'input_size', 'predicted_memory'))
+    entry.update(job.get('resources') or {})
+    filename = history_file()
+    with open(filename + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with open(filename, 'a') as fp:
+            fp.write(json.dumps(entry) + '\n')
+        if os.path.getsize(filename) > history_max_size():
+            _compact(filename)
+
+
+def history(process=None):
+    """Return the recent recorded metrics, optionally of one process only."""
+    _history.refresh()
+    if process is not None:
+        return list(_history.entries.get(process, []))
+    return [entry for entries in _history.entries.values() for entry in entries]
+
+
+def prometheus():
+    """Metrics history aggregated per process in the Prometheus text format."""
+    _history.refresh()
+    totals = _history.totals
+    lines = []
+    for metric, kind, help_text in (
+            ('runs', 'counter', 'Number of finished esmvaltool runs'),
+            ('cpu_seconds', 'counter', 'CPU seconds used by esmvaltool runs'),
+            ('read_bytes', 'counter', 'Bytes read by esmvaltool runs'),
+            ('write_bytes', 'counter', 'Bytes written by esmvaltool runs'),
+            ('peak_rss', 'gauge', 'Largest peak resident memory of an esmvaltool run in bytes')):
+        name = 'copernicus_job_{}'.format(metric)
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for process, total in sorted(totals.items()):
+            lines.append('{}{{process="{}"}} {}'.format(name, process, total[metric]))
+    return '\n'.join(lines) + '\n'
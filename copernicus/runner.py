@@ -1,25 +1,232 @@
 import os
 import glob
 import sys
+import json
+import time
+import uuid
+import shutil
 import zipfile
+import functools
+import importlib
+import subprocess
 
-from jinja2 import Environment, PackageLoader, select_autoescape
+from jinja2 import select_autoescape
 
 from pywps import configuration
 
+from copernicus import catalog
+from copernicus import staging
+from copernicus import regrid
+from copernicus import reference
+from copernicus import jobs
+from copernicus import resources
+from copernicus import admission
+from copernicus import progress
+from copernicus import templating
+from copernicus import tracing
+
 import logging
 LOGGER = logging.getLogger("PYWPS")
 
-template_env = Environment(
-    loader=PackageLoader('copernicus', '/templates/esmvaltool'),
+template_env = templating.environment(
+    'templates/esmvaltool',
     autoescape=select_autoescape(['yml', ])
 )
 
 VERSION = "2.0.0"
 
+# seconds between checks of a running esmvaltool process
+POLL_INTERVAL = 0.5
+
+# stands in for the output directory of a request in the shared config.yml
+OUTPUT_DIR = '@@output_dir@@'
+
+# functions running a recipe in the child process of a run, see [runner] backend
+BACKENDS = dict(
+    esmvaltool='copernicus.runner:run_recipe',
+    fake='copernicus.fake:run_recipe',
+)
+
+
+def backend():
+    """Function called with (recipe_file, config_file, result_file) in the child process of a run.
+
+    ``[runner] backend`` is the name of a backend in :data:`BACKENDS` or a
+    ``module:function`` path. The function writes the result of the run to
+    result_file as :func:`run_recipe` does.
+    """
+    name = configuration.get_config_value("runner", "backend") or 'esmvaltool'
+    module, function = BACKENDS.get(name, name).split(':')
+    return getattr(importlib.import_module(module), function)
+
+
+def run(recipe_file, config_file, process=None, response=None):
+    """Run esmvaltool in its own process group.
+
+    The run waits until its predicted memory is free and is killed with all
+    its children when it exceeds the timeout of the process or when it is
+    cancelled with :func:`copernicus.jobs.cancel`.
+    """
+    workdir = os.path.dirname(os.path.abspath(recipe_file))
+    job_id = str(getattr(response, 'uuid', None) or uuid.uuid4().hex)
+    identifier = getattr(process, 'identifier', None)
+    timeout = jobs.timeout_for(process)
+    input_size = _input_size(recipe_file)
+    http_request = getattr(getattr(response, 'wps_request', None), 'http_request', None)
+    jobs.update(job_id, process=identifier, status=jobs.WAITING, workdir=workdir,
+                timeout=timeout, input_size=input_size, trace_id=tracing.current_trace_id(),
+                owner=jobs.requester(getattr(http_request, 'environ', None)))
+
+    cfg_file = os.path.join(workdir, 'runner.cfg')
+    with open(cfg_file, 'w') as fp:
+        configuration.CONFIG.write(fp)
+    result_file = os.path.join(workdir, 'runner_result.json')
+    stdout_file = os.path.join(workdir, 'runner.log')
+    started = time.time()
+    child, sampler, cgroup, status, span = None, None, None, None, None
+    try:
+        preexec_fn = None
+        if admission.enabled():
+            predicted = admission.predict_memory(identifier, input_size)
+            report = None
+            if response is not None:
+                report = lambda message: response.update_status(message, 20)  # noqa: E731
+            with tracing.span('admission', predicted_memory=predicted):
+                admitted = admission.admit(job_id, predicted, timeout=timeout, report=report)
+            if not admitted:
+                status = jobs.CANCELLED if jobs.cancel_requested(job_id) else jobs.TIMEOUT
+            elif admission.memory_cap(predicted):
+                cap = admission.memory_cap(predicted)
+                cgroup = admission.create_cgroup(job_id, cap)
+                preexec_fn = admission.limit_memory(cap, cgroup)
+                if preexec_fn is not None:
+                    jobs.update(job_id, memory_cap=cap)
+        else:
+            jobs.update(job_id, status=jobs.RUNNING)
+        with open(stdout_file, 'w') as stdout:
+            if status is None:
+                # stage the inputs of the next queued job while this one computes
+                try:
+                    staging.prefetch_next_queued(workdir)
+                except Exception:
+                    LOGGER.warning("could not start prefetch of the next queued job", exc_info=True)
+                parent = tracing.current()
+                span = parent.child('esmvaltool', backend=configuration.get_config_value("runner", "backend"),
+                                    job_id=job_id) if parent else None
+                child = subprocess.Popen(
+                    [sys.executable, '-m', 'copernicus.runner', cfg_file, recipe_file, config_file, result_file],
+                    stdout=stdout,
+                    stderr=subprocess.STDOUT,
+                    preexec_fn=preexec_fn,
+                    start_new_session=True,
+                    env=tracing.environ(span))
+            else:
+                stdout.write("esmvaltool was not started: no memory available\n")
+        if child is not None:
+            jobs.update(job_id, pgid=child.pid, started=time.time())
+            sampler = resources.ResourceSampler(child.pid)
+            reporter = progress.Reporter(job_id, result_file, response,
+                                         progress.predicted_duration(process), started)
+            status = _wait(job_id, child, sampler, timeout, started, reporter)
+    finally:
+        staging.release_recipe(recipe_file)
+        jobs.cleanup(job_id)
+        admission.remove_cgroup(cgroup)
+
+    result = _read_result(result_file, workdir, stdout_file)
+    if status:
+        result['success'] = False
+        result['exception'] = 'esmvaltool run {} after {:.0f}s'.format(
+            'cancelled' if status == jobs.CANCELLED else 'timed out', time.time() - started)
+        _remove_partial_output(result)
+    elif result['exception'] is None and not result['success']:
+        result['exception'] = 'esmvaltool exited with code {}'.format(child.returncode)
+    finished = time.time()
+    if span is not None:
+        tracing.task_spans(span, result['logfile'], finished)
+        span.finish(finished, error=result['exception'])
+    job = jobs.update(
+        job_id,
+        status=status or (jobs.FINISHED if result['success'] else jobs.FAILED),
+        exception=result['exception'],
+        finished=finished,
+        duration=finished - started,
+        resources=sampler.summary() if sampler else {})
+    if sampler:
+        LOGGER.info("esmvaltool run %s: %s (predicted memory %s)",
+                    job_id, job['resources'], job.get('predicted_memory'))
+        resources.record(job)
+    return result
+
+
+def _wait(job_id, child, sampler, timeout, started, reporter=None):
+    """Wait for a run, returns the status if it had to be killed."""
+    interval = resources.sample_interval()
+    status = None
+    while child.poll() is None:
+        if time.time() - sampler.last >= interval:
+            sampler.sample()
+            # the current memory of running jobs is used for admission
+            jobs.update(job_id, rss=sampler.rss)
+        if reporter is not None:
+            try:
+                reporter.poll()
+            except Exception:
+                LOGGER.debug("could not report the progress of %s", job_id, exc_info=True)
+        if jobs.cancel_requested(job_id):
+            status = jobs.CANCELLED
+        elif timeout and time.time() - started > timeout:
+            LOGGER.warning("esmvaltool run %s timed out after %ds", job_id, timeout)
+            status = jobs.TIMEOUT
+        if status:
+            jobs.kill_tree(child.pid, grace=float(configuration.get_config_value("runner", "kill_grace") or 10))
+            child.wait()
+            return status
+        time.sleep(POLL_INTERVAL)
+    if jobs.cancel_requested(job_id):
+        # killed by the cancel request
+        return jobs.CANCELLED
+    return None
+
+
+def _input_size(recipe_file):
+    try:
+        return resources.input_size(recipe_file)
+    except Exception:
+        LOGGER.debug("could not determine the input size", exc_info=True)
+        return None
+
 
-def run(recipe_file, config_file):
-    """Run esmvaltool"""
+def _read_result(result_file, workdir, stdout_file):
+    result = dict(
+        success=False,
+        exception=None,
+        logfile=stdout_file,
+        debug_logfile=stdout_file,
+        plot_dir=os.path.join(workdir, 'output'),
+        work_dir=os.path.join(workdir, 'output'),
+        run_dir=os.path.join(workdir, 'output'))
+    try:
+        with open(result_file) as fp:
+            result.update(json.load(fp))
+    except (IOError, OSError, ValueError):
+        LOGGER.warning("esmvaltool run did not report a result")
+    for name in ('logfile', 'debug_logfile'):
+        if not os.path.exists(result[name]):
+            result[name] = stdout_file
+    return result
+
+
+def _remove_partial_output(result):
+    """Remove the output of an interrupted run, keeping its logs."""
+    for name in ('plot_dir', 'work_dir', 'preproc_dir'):
+        path = result.get(name)
+        if path and path != result['run_dir'] and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def run_recipe(recipe_file, config_file, result_file):
+    """Run esmvaltool in this process and write the result to result_file."""
     from esmvaltool._main import configure_logging, read_config_user_file, process_recipe
     recipe_name = os.path.splitext(os.path.basename(recipe_file))[0]
     cfg = read_config_user_file(config_file, recipe_name)
@@ -37,81 +244,134 @@ def run(recipe_file, config_file):
     # log header
     # LOGGER.info(__doc__)
     LOGGER.debug("Using config file %s", config_file)
+    if tracing.current_trace_id():
+        LOGGER.info("trace_id=%s", tracing.current_trace_id())
 
     # check NCL version
     # ncl_version_check()
 
     cfg['synda_download'] = False
 
-    exception = None
+    # reuse regridding weights of earlier runs
+    regrid.install()
+
+    # find the log
+    logfile = os.path.join(cfg['run_dir'], 'main_log.txt')
+    debug_logfile = os.path.join(cfg['run_dir'], 'main_log_debug.txt')
+    result = {
+        'success': False,
+        'exception': None,
+        'logfile': logfile,
+        'debug_logfile': debug_logfile,
+        'plot_dir': cfg['plot_dir'],
+        'work_dir': cfg['work_dir'],
+        'preproc_dir': cfg.get('preproc_dir'),
+        'run_dir': cfg['run_dir']
+    }
+    # the paths are needed to clean up if the run gets killed
+    _write_result(result_file, result)
+
     try:
         LOGGER.info("run esmvaltool ...")
         process_recipe(recipe_file=recipe_file, config_user=cfg)
         LOGGER.info("esmvaltool ... done.")
-        success = True
+        result['success'] = True
     except Exception as err:
         LOGGER.exception('esmvaltool failed!')
         #For debugging purposes, exit here to keep the temp folder
         #Should ideally be an option in PyWPS
         #sys.exit(1)
         #raise Exception('esmvaltool failed: {0}'.format(err))
-        success = False
-        exception = str(err)
-    # find the log
-    logfile = os.path.join(cfg['run_dir'], 'main_log.txt')
-    debug_logfile = os.path.join(cfg['run_dir'], 'main_log_debug.txt')
-    return {
-        'success': success,
-        'exception': exception,
-        'logfile': logfile,
-        'debug_logfile': debug_logfile,
-        'plot_dir': cfg['plot_dir'],
-        'work_dir': cfg['work_dir'],
-        'run_dir': cfg['run_dir']
-    }
+        result['exception'] = str(err)
+    _write_result(result_file, result)
+    return result
 
 
-def generate_recipe(diag, constraints=None, options=None, start_year=2000, end_year=2005, output_format='pdf', workdir=None):
+def _write_result(result_file, result):
+    with open(result_file + '.tmp', 'w') as fp:
+        json.dump(result, fp)
+    os.rename(result_file + '.tmp', result_file)
+
+
+def literal_inputs(inputs):
+    """The literal values of WPS request inputs as identifier -> value."""
+    values = {}
+    for identifier, items in inputs.items():
+        data = getattr(items[0], 'data', None) if items else None
+        if data is not None and not hasattr(data, 'read'):
+            values[identifier] = data
+    return values
+
+
+def render_recipe(diag, constraints=None, options=None, start_year=2000, end_year=2005, workdir=None):
+    """Write the recipe of diag to workdir/recipe.yml and return its path."""
     constraints = constraints or {}
-    workdir = workdir or os.curdir
-    workdir = os.path.abspath(workdir)
-    output_dir = os.path.join(workdir, 'output')
-    # write config.yml
-    config_templ = template_env.get_template('config.yml')
-    rendered_config = config_templ.render(
-        archive_root=configuration.get_config_value("data", "archive_root"),
-        obs_root=configuration.get_config_value("data", "obs_root"),
-        output_dir=output_dir,
-        output_format=output_format,
-    )
-    config_file = os.path.abspath(os.path.join(workdir, "config.yml"))
-    with open(config_file, 'w') as fp:
-        fp.write(rendered_config)
+    workdir = os.path.abspath(workdir or os.curdir)
 
     # write recipe.xml
     recipe = 'recipe_{0}.yml.j2'.format(diag)
-    recipe_templ = template_env.get_template(recipe)
-    rendered_recipe = recipe_templ.render(
-        diag=diag,
-        workdir=workdir,
-        constraints=constraints,
-        start_year=start_year,
-        end_year=end_year,
-	options=options,
-    )
+    with tracing.span('render recipe', recipe=recipe):
+        recipe_templ = template_env.get_template(recipe)
+        rendered_recipe = recipe_templ.render(
+            diag=diag,
+            workdir=workdir,
+            constraints=constraints,
+            start_year=start_year,
+            end_year=end_year,
+            options=options,
+        )
     recipe_file = os.path.abspath(os.path.join(workdir, "recipe.yml"))
     with open(recipe_file, 'w') as fp:
         fp.write(rendered_recipe)
+    return recipe_file
+
+
+def generate_recipe(diag, constraints=None, options=None, start_year=2000, end_year=2005, output_format='pdf', workdir=None):
+    workdir = os.path.abspath(workdir or os.curdir)
+    output_dir = os.path.join(workdir, 'output')
+    recipe_file = render_recipe(diag, constraints, options, start_year, end_year, workdir)
+
+    # fail early if the requested data is not available
+    with tracing.span('preflight'):
+        catalog.preflight(recipe_file)
+
+    # use prepared observations if available and copy the rest to node-local scratch
+    reference_root = reference.reference_root_for(recipe_file)
+    skip = ('OBS',) if reference_root else ()
+    with tracing.span('stage inputs'):
+        roots = staging.stage_recipe(recipe_file, skip=skip) or catalog.data_roots()
+    if reference_root:
+        roots['OBS'] = reference_root
+
+    # write config.yml
+    rendered_config = _render_config(
+        template_env.get_template('config.yml'), roots['CMIP5'], roots['OBS'], output_format)
+    rendered_config = rendered_config.replace(OUTPUT_DIR, output_dir)
+    config_file = os.path.abspath(os.path.join(workdir, "config.yml"))
+    with open(config_file, 'w') as fp:
+        fp.write(rendered_config)
     return recipe_file, config_file
 
 
+@functools.lru_cache(maxsize=32)
+def _render_config(config_templ, archive_root, obs_root, output_format):
+    """Render config.yml once per template, data roots and output format."""
+    return config_templ.render(
+        archive_root=archive_root,
+        obs_root=obs_root,
+        output_dir=OUTPUT_DIR,
+        output_format=output_format,
+    )
+
+
 def get_output(output_dir, path_filter, name_filter=None, output_format='pdf'):
     name_filter = name_filter or '*'
     # output/recipe_20180130_111116/plots/diagnostic1/script1/MultiModelMean_T3M_ta_2001-2002_mean.pdf
     output_filter = os.path.join(
         output_dir, path_filter, '{0}.{1}'.format(name_filter, output_format))
     LOGGER.debug("output_filter %s", output_filter)
-    matches = glob.glob(output_filter)
+    with tracing.span('get output', filter=os.path.join(path_filter, name_filter)):
+        matches = glob.glob(output_filter)
     if len(matches) == 0:
         LOGGER.info("output_dir=%s", output_dir)
         raise Exception("no output found in output dir")
@@ -121,7 +381,7 @@ def get_output(output_dir, path_filter, name_filter=None, output_format='pdf'):
     return matches[0]
 
 def compress_output(output_dir, archive_file):
-    with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as ziph:
+    with tracing.span('compress output'), zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as ziph:
         for root, dirs, files in os.walk(output_dir):
             for file in files:
                 path = os.path.join(root, file)
@@ -130,3 +390,9 @@ def compress_output(output_dir, archive_file):
 
     return archive_file
 
+
+if __name__ == '__main__':
+    configuration.load_configuration([sys.argv[1]])
+    if tracing.attach():
+        print("trace_id={}".format(tracing.current_trace_id()), flush=True)
+    backend()(*sys.argv[2:5])
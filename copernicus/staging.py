@@ -0,0 +1,320 @@
+"""
+Staging of input data from the (slow, shared) data roots to node-local scratch.
+
+If ``[data] scratch_root`` is set, the files a recipe needs are copied with
+parallel readers to ``<scratch_root>/<project>/`` before ESMValTool is
+launched and the ESMValTool config points its ``rootpath`` there. The
+scratch space is used as a cache: files stay until they are evicted in
+least-recently-used order to keep the scratch below ``scratch_max_size``.
+
+When a job starts computing, the inputs of the first queued job are staged
+in a detached process, so its copies overlap with the compute of the running
+job. The files are found by rendering the recipe template of its process
+with the stored inputs of the request; its handler is not run.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import fcntl
+import tempfile
+import threading
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from pywps import configuration
+
+from copernicus import catalog
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+_INSTALLED = False
+
+
+def scratch_root():
+    return configuration.get_config_value("data", "scratch_root")
+
+
+def enabled():
+    return bool(scratch_root())
+
+
+def max_size():
+    size = configuration.get_config_value("data", "scratch_max_size") or '100gb'
+    return int(configuration.get_size_mb(size) * 1024 * 1024)
+
+
+def required_files(recipe, skip=()):
+    """Return a sorted list of (project, relative path) of the input files of a recipe."""
+    current = catalog.get_catalog()
+    files = set()
+    for requirement in catalog.recipe_requirements(recipe):
+        project = requirement.get('project')
+        if project in skip or not current.covers(project):
+            continue
+        files.update((project, path) for path in current.files(requirement))
+    return sorted(files)
+
+
+class Stager(object):
+    """Copy files into a size limited scratch cache with LRU eviction."""
+
+    def __init__(self, root, max_size, workers=4):
+        self.root = root
+        self.max_size = max_size
+        self.workers = workers
+        self.pin_dir = os.path.join(root, '.pins')
+
+    def target(self, project, path):
+        return os.path.join(self.root, project, path)
+
+    def stage(self, files, roots, pin=None):
+        """Copy (project, path) files from their roots. Returns the number of bytes copied.
+
+        The files are pinned before anything is evicted, so a concurrent
+        stager cannot evict them while they are copied. Without a pin name
+        they are only pinned until they are staged.
+        """
+        os.makedirs(self.pin_dir, exist_ok=True)
+        own_pin = pin or 'stage_{}_{}'.format(os.getpid(), threading.get_ident())
+        missing = []
+        needed = 0
+        with self._locked():
+            self._pin(own_pin, files)
+            for project, path in files:
+                source = os.path.join(roots[project], path)
+                size = os.path.getsize(source)
+                if not self._is_staged(source, self.target(project, path)):
+                    missing.append((source, self.target(project, path)))
+                    needed += size
+            if needed:
+                self._evict(needed)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(lambda item: self._copy(*item), missing))
+            now = time.time()
+            for project, path in files:
+                target = self.target(project, path)
+                # the access time keeps the LRU order, independent of noatime mounts
+                os.utime(target, (now, os.stat(target).st_mtime))
+        finally:
+            if not pin:
+                self.release(own_pin)
+        return needed
+
+    def _is_staged(self, source, target):
+        try:
+            source_stat, target_stat = os.stat(source), os.stat(target)
+        except OSError:
+            return False
+        return source_stat.st_size == target_stat.st_size and int(source_stat.st_mtime) == int(target_stat.st_mtime)
+
+    def _copy(self, source, target):
+        dirname = os.path.dirname(target)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                pass
+        partial = '{}.part{}-{}'.format(target, os.getpid(), threading.get_ident())
+        shutil.copy2(source, partial)
+        os.rename(partial, target)
+
+    def _pin(self, pin, files):
+        with open(os.path.join(self.pin_dir, pin), 'w') as fp:
+            json.dump(dict(pid=os.getpid(), files=[self.target(*item) for item in files]), fp)
+
+    def release(self, pin):
+        try:
+            os.remove(os.path.join(self.pin_dir, pin))
+        except OSError:
+            pass
+
+    def _pinned(self):
+        pinned = set()
+        for name in os.listdir(self.pin_dir):
+            try:
+                with open(os.path.join(self.pin_dir, name)) as fp:
+                    info = json.load(fp)
+                os.kill(info['pid'], 0)
+            except (OSError, ValueError, KeyError):
+                # pin of a dead process
+                self.release(name)
+                continue
+            pinned.update(info['files'])
+        return pinned
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Serialise pinning and eviction between stagers."""
+        with open(os.path.join(self.root, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def evict(self, needed):
+        """Remove least recently used, unpinned files until needed bytes fit."""
+        with self._locked():
+            self._evict(needed)
+
+    def _evict(self, needed):
+        staged = []
+        used = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            for filename in filenames:
+                if dirpath == self.root:
+                    continue
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                used += stat.st_size
+                # partial files are being copied by other stagers
+                if '.part' not in filename:
+                    staged.append((stat.st_atime, stat.st_size, path))
+        pinned = self._pinned()
+        for _, size, path in sorted(staged):
+            if used + needed <= self.max_size:
+                break
+            if path in pinned:
+                continue
+            LOGGER.debug("evicting %s from scratch", path)
+            os.remove(path)
+            used -= size
+        if used + needed > self.max_size:
+            LOGGER.warning("scratch %s is too small for %d more bytes", self.root, needed)
+
+
+def get_stager():
+    workers = int(configuration.get_config_value("data", "staging_workers") or 4)
+    return Stager(scratch_root(), max_size(), workers=workers)
+
+
+def stage_recipe(recipe_file, skip=()):
+    """Stage the input files of a recipe, except for the projects in skip.
+
+    Returns the data roots to use for the ESMValTool config, or ``None`` if
+    staging is disabled or failed (ESMValTool then reads from the data roots).
+    """
+    import yaml
+
+    if not enabled():
+        return None
+    started = time.time()
+    try:
+        with open(recipe_file) as fp:
+            recipe = yaml.safe_load(fp)
+        roots = catalog.data_roots()
+        files = required_files(recipe, skip)
+        stager = get_stager()
+        copied = stager.stage(files, roots, pin=_pin_name(recipe_file))
+    except Exception:
+        LOGGER.exception("staging failed, reading input data from the data roots")
+        return None
+    LOGGER.info("staged %d files (%d bytes copied) in %.1fs", len(files), copied, time.time() - started)
+    staged = dict((project, os.path.join(scratch_root(), project)) for project in roots if project not in skip)
+    return dict(roots, **staged)
+
+
+def release_recipe(recipe_file):
+    """Allow eviction of the files staged for a recipe."""
+    if enabled():
+        get_stager().release(_pin_name(recipe_file))
+
+
+def _pin_name(recipe_file):
+    return os.path.abspath(recipe_file).strip(os.sep).replace(os.sep, '_')
+
+
+def prefetch_next_queued(workdir):
+    """Stage the inputs of the first queued job in a detached process logging to workdir/prefetch.log."""
+    if not enabled():
+        return None
+    cfgfile = os.path.join(workdir, 'prefetch.cfg')
+    with open(cfgfile, 'w') as fp:
+        configuration.CONFIG.write(fp)
+    with open(os.path.join(workdir, 'prefetch.log'), 'w') as log:
+        return subprocess.Popen(
+            [sys.executable, '-m', 'copernicus.staging', cfgfile],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True)
+
+
+def install():
+    """Release the staged files of a job when its handler returns, also on early returns and errors."""
+    global _INSTALLED
+    from pywps import Process
+
+    if _INSTALLED:
+        return _INSTALLED
+    original = Process._run_process
+
+    def _run_process(self, wps_request, wps_response):
+        try:
+            return original(self, wps_request, wps_response)
+        finally:
+            release_recipe(os.path.join(self.workdir, 'recipe.yml'))
+
+    Process._run_process = _run_process
+    _INSTALLED = True
+    return _INSTALLED
+
+
+def _stored_inputs(stored):
+    """The identifier and the literal inputs (identifier -> value) of a stored request."""
+    from pywps.app.WPSRequest import WPSRequest
+    from copernicus import runner
+
+    request = WPSRequest()
+    request_json = json.loads(stored.request.decode('utf-8'))
+    if hasattr(request, 'restore_json'):
+        request.restore_json(request_json)
+    else:
+        request.json = request_json
+    return request.identifier, runner.literal_inputs(request.inputs)
+
+
+def _first_stored():
+    """The stored request pywps starts next."""
+    from pywps import dblog
+
+    session = dblog.get_session()
+    try:
+        # the query of dblog.pop_first_stored, so both see the same request first
+        return session.query(dblog.RequestInstance).first()
+    finally:
+        session.close()
+
+
+def _prefetch(cfgfile):
+    from copernicus import reference
+    from copernicus import runner
+    from copernicus.processes import processes
+
+    configuration.load_configuration([cfgfile])
+    stored = _first_stored()
+    if stored is None:
+        return
+    workdir = tempfile.mkdtemp(prefix='prefetch_')
+    try:
+        identifier, inputs = _stored_inputs(stored)
+        found = [process for process in processes if process.identifier == identifier]
+        if not found or not hasattr(found[0], 'recipe_parameters'):
+            LOGGER.info("not prefetching stored job %s: process %s has no recipe", stored.uuid, identifier)
+            return
+        recipe_file = runner.render_recipe(workdir=workdir, **found[0].recipe_parameters(inputs))
+        skip = ('OBS',) if reference.reference_root_for(recipe_file) else ()
+        stage_recipe(recipe_file, skip=skip)
+        release_recipe(recipe_file)
+    except Exception:
+        LOGGER.warning("prefetch of stored job %s failed", stored.uuid, exc_info=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s')
+    _prefetch(sys.argv[1])
@@ -0,0 +1,137 @@
+"""
+Profile of the cold start of the service.
+
+:func:`profile` runs the start-up path in a fresh interpreter with
+``python -X importtime`` and times its phases: importing the command line
+and the runner, loading the pywps configuration, creating the Jinja environments of
+:mod:`copernicus.cli` and :mod:`copernicus.runner`, ``create_app()`` and
+the construction of every process. Imports are attributed to the phase
+they happen in. The result can be written as folded stacks, the input
+format of ``flamegraph.pl`` and speedscope.
+"""
+import sys
+import json
+import subprocess
+
+PHASE_MARKER = 'copernicus-phase: '
+
+SCRIPT = r'''
+import sys, json, time
+
+timings = []
+
+
+def timed(name, func):
+    sys.stderr.write('{marker}' + name + '\n')
+    sys.stderr.flush()
+    started = time.perf_counter()
+    result = func()
+    timings.append((name, time.perf_counter() - started))
+    return result
+
+
+def jinja():
+    from copernicus import cli, runner, templating
+    for module, template in ((cli, 'pywps.cfg'), (runner, 'config.yml')):
+        templating.environment(module.template_env.loader.package_path).get_template(template)
+
+
+cfgfiles = json.loads(sys.argv[1])
+timed('import copernicus.cli', lambda: __import__('copernicus.cli'))
+from pywps import configuration
+from copernicus import wsgi
+timed('pywps configuration', lambda: configuration.load_configuration(wsgi.config_files(cfgfiles)))
+timed('import copernicus.runner', lambda: __import__('copernicus.runner'))
+timed('jinja environments', jinja)
+timed('create_app', lambda: wsgi.create_app(cfgfiles))
+from copernicus.processes import processes
+for process in processes:
+    timed('process ' + process.identifier, process.load)
+sys.stderr.write('{marker}\n')
+sys.stdout.write(json.dumps(timings) + '\n')
+'''.replace('{marker}', PHASE_MARKER)
+
+
+class Node(object):
+
+    def __init__(self, name, self_us, cumulative_us):
+        self.name = name
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.children = []
+
+
+def parse_importtime(lines):
+    """Return phase -> list of top-level import trees from ``-X importtime`` output with phase markers."""
+    phases = {}
+    phase = None
+    # children waiting for their parent, by depth
+    pending = {}
+    for line in lines:
+        if line.startswith(PHASE_MARKER):
+            phase = line[len(PHASE_MARKER):].strip() or None
+            pending = {}
+            continue
+        if not line.startswith('import time:') or phase is None:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            node = Node(name.strip(), int(self_us), int(cumulative_us))
+        except ValueError:
+            # header line
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        # imports are reported after the imports they triggered
+        node.children = pending.pop(depth + 1, [])
+        if depth == 0:
+            phases.setdefault(phase, []).append(node)
+        else:
+            pending.setdefault(depth, []).append(node)
+    return phases
+
+
+def profile(cfgfiles=None):
+    """Profile the start-up in a fresh interpreter, returns (phase timings, phase imports)."""
+    child = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SCRIPT, json.dumps(cfgfiles or [])],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if child.returncode != 0:
+        raise RuntimeError("start-up failed:\n" + child.stderr[-2000:])
+    timings = json.loads(child.stdout.strip().splitlines()[-1])
+    return timings, parse_importtime(child.stderr.splitlines())
+
+
+def _walk(nodes, path=()):
+    for node in nodes:
+        yield path + (node.name,), node
+        for item in _walk(node.children, path + (node.name,)):
+            yield item
+
+
+def format_report(timings, imports, top=20):
+    lines = ["{:<40} {:>9} {:>9}".format('phase', 'seconds', 'imports')]
+    for name, seconds in sorted(timings, key=lambda item: -item[1]):
+        imported = sum(node.cumulative_us for node in imports.get(name, [])) / 1e6
+        lines.append("{:<40} {:>9.3f} {:>9.3f}".format(name, seconds, imported))
+    lines.append("")
+    lines.append("slowest imports (self time):")
+    modules = [(node, phase) for phase, nodes in imports.items() for _, node in _walk(nodes)]
+    for node, phase in sorted(modules, key=lambda item: -item[0].self_us)[:top]:
+        lines.append("{:>9.1f} ms  {:<45} cumulative {:.1f} ms, {}".format(
+            node.self_us / 1e3, node.name, node.cumulative_us / 1e3, phase))
+    return '\n'.join(lines)
+
+
+def folded_stacks(timings, imports):
+    """Lines of ``phase;module;...;module microseconds``."""
+    lines = []
+    for name, seconds in timings:
+        nodes = imports.get(name, [])
+        # time of the phase spent outside of imports
+        other = int(seconds * 1e6) - sum(node.cumulative_us for node in nodes)
+        if other > 0:
+            lines.append('{} {}'.format(name, other))
+        for path, node in _walk(nodes):
+            if node.self_us:
+                lines.append('{};{} {}'.format(name, ';'.join(path), node.self_us))
+    return lines
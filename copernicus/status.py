@@ -0,0 +1,197 @@
+"""
+Coalescing of WPS status updates.
+
+pywps writes the status document and updates the request database on
+every ``update_status``. With fine-grained progress reports of many
+concurrent jobs this becomes a storm of small writes. After :func:`install`
+only the latest status of a job is kept in memory and written at most once
+per ``[runner] status_flush_interval`` seconds. Changes of the WPS status,
+in particular to succeeded or failed, are always written immediately.
+
+SQLite connections of the request database wait up to ``BUSY_TIMEOUT``
+seconds for the lock of another writer, and a write that still finds the
+database locked is retried a few times before the update fails.
+"""
+import os
+import time
+import atexit
+import random
+import sqlite3
+import threading
+
+from pywps import configuration
+from pywps.response.status import WPS_STATUS
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+FINAL = (WPS_STATUS.SUCCEEDED, WPS_STATUS.FAILED)
+
+# seconds a SQLite connection waits for the lock of the request database
+BUSY_TIMEOUT = 30
+# retries of a status write which found the database locked anyway
+RETRIES = 5
+_BUSY_TIMEOUT_SET = False
+
+
+def flush_interval():
+    return float(configuration.get_config_value("runner", "status_flush_interval") or 0.)
+
+
+def _set_busy_timeout(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA busy_timeout = {:d}'.format(BUSY_TIMEOUT * 1000))
+
+
+def set_busy_timeout():
+    """Let new SQLite connections wait BUSY_TIMEOUT seconds for locks instead of 5."""
+    global _BUSY_TIMEOUT_SET
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if not _BUSY_TIMEOUT_SET:
+        event.listen(Engine, 'connect', _set_busy_timeout)
+        _BUSY_TIMEOUT_SET = True
+
+
+def is_locked(error):
+    """Whether error is SQLite reporting a locked database."""
+    return 'database is locked' in str(error)
+
+
+def write_retrying(write, *args):
+    """Call write, retrying with a random backoff while the database is locked."""
+    for attempt in range(RETRIES + 1):
+        try:
+            return write(*args)
+        except Exception as err:
+            if attempt == RETRIES or not is_locked(err):
+                raise
+            LOGGER.debug("request database locked, retrying status write (%d)", attempt + 1)
+            time.sleep(random.uniform(0.5, 1.) * min(0.1 * 2 ** attempt, 2.))
+
+
+class StatusCoalescer(object):
+    """Write the status of a response through write at a bounded rate."""
+
+    def __init__(self, write, interval=1.):
+        self.write = write
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.sequence = 0
+        # job -> (sequence, response, status, message, percentage, clean) not written yet
+        self.pending = {}
+        # job -> (time, status) of the last write
+        self.written = {}
+        # job -> (lock, sequence of the last write), writes of a job are ordered
+        self.jobs = {}
+        # job -> time it reached a final status
+        self.finished = {}
+        self.timer = None
+        self.writes = 0
+
+    def update(self, response, status, message, status_percentage, clean=True):
+        key = response.uuid
+        with self.lock:
+            self.sequence += 1
+            entry = (self.sequence, response, status, message, status_percentage, clean)
+            last, last_status = self.written.get(key, (0., None))
+            if status not in FINAL and status == last_status and time.time() - last < self.interval:
+                # readers in this process see the latest status right away
+                response.message = message
+                response.status = status
+                response.status_percentage = status_percentage
+                self.pending[key] = entry
+                self._schedule(last + self.interval)
+                return
+            self.pending.pop(key, None)
+            self.written[key] = (time.time(), status)
+        self._write(key, entry)
+        if status in FINAL:
+            self._finish(key)
+
+    def _write(self, key, entry):
+        # the database and status file are written outside of the lock shared by all jobs
+        with self.lock:
+            lock = self.jobs.setdefault(key, [threading.Lock(), 0])
+        with lock[0]:
+            if entry[0] < lock[1]:
+                # a newer status of the job was written meanwhile
+                return
+            lock[1] = entry[0]
+            self.writes += 1
+            write_retrying(self.write, *entry[1:])
+
+    def _finish(self, key):
+        with self.lock:
+            now = time.time()
+            self.finished[key] = now
+            self.written.pop(key, None)
+            # keep the order of finished jobs for late flushes, then forget them
+            for done, finished in list(self.finished.items()):
+                if now - finished > 10 * self.interval:
+                    del self.finished[done]
+                    self.jobs.pop(done, None)
+
+    def _schedule(self, due):
+        if self.timer is None:
+            self.timer = threading.Timer(max(due - time.time(), 0.), self.flush_due)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush_due(self):
+        with self.lock:
+            self.timer = None
+            now = time.time()
+            due = [key for key in self.pending
+                   if now - self.written.get(key, (0., None))[0] >= self.interval]
+            entries = [(key, self.pending.pop(key)) for key in due]
+            for key, entry in entries:
+                self.written[key] = (now, entry[2])
+            if self.pending:
+                self._schedule(min(self.written[key][0] for key in self.pending) + self.interval)
+        self._flush(entries)
+
+    def flush(self):
+        """Write all pending updates."""
+        with self.lock:
+            entries = list(self.pending.items())
+            self.pending.clear()
+        self._flush(entries)
+
+    def _flush(self, entries):
+        for key, entry in entries:
+            try:
+                self._write(key, entry)
+            except Exception:
+                LOGGER.warning("could not write the status of job %s", key, exc_info=True)
+
+
+_COALESCER = None
+
+
+def install(interval=None):
+    """Coalesce the status updates of all ``ExecuteResponse`` objects."""
+    global _COALESCER
+    from pywps.response.execute import ExecuteResponse
+
+    interval = flush_interval() if interval is None else interval
+    if not interval or _COALESCER is not None:
+        return _COALESCER
+    original = ExecuteResponse._update_status
+
+    def _update_status(self, status, message, status_percentage, clean=True):
+        _COALESCER.update(self, status, message, status_percentage, clean)
+
+    def reset():
+        # timers and locks do not survive fork, jobs run in forked processes
+        global _COALESCER
+        _COALESCER = StatusCoalescer(original, interval)
+
+    reset()
+    set_busy_timeout()
+    ExecuteResponse._update_status = _update_status
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=reset)
+    atexit.register(lambda: _COALESCER.flush())
+    return _COALESCER
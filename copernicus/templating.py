@@ -0,0 +1,63 @@
+"""
+Jinja environments of the package with a bytecode cache.
+
+Compiled templates are stored below ``[cache] cache_root``, so a new worker
+loads them instead of compiling them again. :func:`precompile` compiles
+all templates of an environment once, ``copernicus start`` does it before
+the workers are forked so they inherit the compiled templates. Set
+``[cache] template_auto_reload = false`` to skip checking the template
+files for changes on every use.
+"""
+import os
+
+from jinja2 import Environment, PackageLoader, FileSystemBytecodeCache
+
+from pywps import configuration
+
+from copernicus.cache import cache_root
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def auto_reload():
+    return str(configuration.get_config_value("cache", "template_auto_reload")).lower() != 'false'
+
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """Bytecode cache below the cache root configured when it is used."""
+
+    def __init__(self, pattern='__jinja2_%s.cache'):
+        self.pattern = pattern
+
+    @property
+    def directory(self):
+        path = os.path.join(cache_root(), 'jinja')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def load_bytecode(self, bucket):
+        try:
+            FileSystemBytecodeCache.load_bytecode(self, bucket)
+        except (IOError, OSError):
+            LOGGER.debug("could not load template bytecode", exc_info=True)
+
+    def dump_bytecode(self, bucket):
+        try:
+            FileSystemBytecodeCache.dump_bytecode(self, bucket)
+        except (IOError, OSError):
+            LOGGER.debug("could not store template bytecode", exc_info=True)
+
+
+def environment(path, **options):
+    """Environment for the templates in the package directory path."""
+    return Environment(loader=PackageLoader('copernicus', path), bytecode_cache=BytecodeCache(), **options)
+
+
+def precompile(*environments):
+    """Compile all templates of the environments and keep them in memory."""
+    for env in environments:
+        env.auto_reload = auto_reload()
+        for name in env.list_templates():
+            env.get_template(name)
@@ -0,0 +1,263 @@
+"""
+Synthetic CMIP5 and OBS archive for benchmarks and load tests.
+
+The recipe templates of the processes are rendered with the default inputs
+of the processes and the data they ask for is written as small NetCDF files
+with smooth, reproducible fields: CMIP5 data in the ``CP4CDS`` directory
+layout used by ``templates/esmvaltool/config.yml`` and observations in the
+``Tier<tier>/<dataset>`` layout of ESMValTool. Point ``[data] archive_root``
+and ``obs_root`` at the generated directories to run the processes without
+a real archive.
+"""
+import os
+import zlib
+import collections
+
+from copernicus import catalog
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# short_name -> (standard_name, units, mean, amplitude)
+VARIABLES = collections.OrderedDict([
+    ('zg', ('geopotential_height', 'm', 0., 100.)),
+    ('pr', ('precipitation_flux', 'kg m-2 s-1', 3e-5, 3e-5)),
+    ('tas', ('air_temperature', 'K', 288., 15.)),
+    ('tasmax', ('air_temperature', 'K', 293., 15.)),
+    ('tasmin', ('air_temperature', 'K', 283., 15.)),
+    ('ts', ('surface_temperature', 'K', 289., 16.)),
+    ('psl', ('air_pressure_at_sea_level', 'Pa', 101325., 1500.)),
+])
+
+# pressure levels of the daily and monthly CMIP5 tables
+PLEVS = dict(
+    day=[100000., 85000., 70000., 50000., 25000., 10000., 5000., 1000.],
+    mon=[100000., 92500., 85000., 70000., 60000., 50000., 40000., 30000., 25000.,
+         20000., 15000., 10000., 7000., 5000., 3000., 2000., 1000.])
+
+MONTH_DAYS = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+INSTITUTES = {
+    'ACCESS1-0': 'CSIRO-BOM', 'ACCESS1-3': 'CSIRO-BOM', 'bcc-csm1-1': 'BCC', 'bcc-csm1-1-m': 'BCC',
+    'CanESM2': 'CCCma', 'CCSM4': 'NCAR', 'CESM1-BGC': 'NSF-DOE-NCAR', 'CESM1-CAM5': 'NSF-DOE-NCAR',
+    'CESM1-FASTCHEM': 'NSF-DOE-NCAR', 'CESM1-WACCM': 'NSF-DOE-NCAR', 'CMCC-CESM': 'CMCC',
+    'CMCC-CMS': 'CMCC', 'CNRM-CM5': 'CNRM-CERFACS', 'CSIRO-Mk3-6-0': 'CSIRO-QCCCE', 'EC-EARTH': 'ICHEC',
+    'FGOALS-g2': 'LASG-CESS', 'FIO-ESM': 'FIO', 'GFDL-CM2p1': 'NOAA-GFDL', 'GFDL-CM3': 'NOAA-GFDL',
+    'GFDL-ESM2G': 'NOAA-GFDL', 'GFDL-ESM2M': 'NOAA-GFDL', 'HadCM3': 'MOHC', 'HadGEM2-CC': 'MOHC',
+    'HadGEM2-ES': 'MOHC', 'inmcm4': 'INM', 'IPSL-CM5A-LR': 'IPSL', 'IPSL-CM5A-MR': 'IPSL',
+    'IPSL-CM5B-LR': 'IPSL', 'MPI-ESM-LR': 'MPI-M', 'MPI-ESM-MR': 'MPI-M', 'MPI-ESM-P': 'MPI-M',
+    'NorESM1-M': 'NCC', 'NorESM1-ME': 'NCC',
+}
+
+def frequency(requirement):
+    """Return ``day`` or ``mon`` for a data requirement."""
+    mip = requirement.get('mip') or ''
+    if mip == 'day' or (not mip and str(requirement.get('field', ''))[2:3] == 'D'):
+        return 'day'
+    return 'mon'
+
+
+def has_recipe(process):
+    """Whether a process runs an ESMValTool recipe."""
+    return hasattr(process, 'recipe_parameters')
+
+
+def render_recipe(process, years=None, inputs=None):
+    """The recipe of a process run with its default inputs, updated with inputs if given."""
+    from copernicus import runner
+
+    values = dict((inpt.identifier, inpt.data) for inpt in process.inputs
+                  if getattr(inpt, 'data', None) is not None)
+    values.update(inputs or {})
+    if years is not None:
+        values.update(start_year=years[0], end_year=years[1])
+    parameters = process.recipe_parameters(values)
+    return runner.template_env.get_template('recipe_{}.yml.j2'.format(parameters['diag'])).render(
+        workdir='', **parameters)
+
+
+def process_requirements(process, years=None):
+    """Data requirements of the recipe of a process run with its default inputs."""
+    import yaml
+
+    rendered = render_recipe(process, years)
+    return [requirement for requirement in catalog.recipe_requirements(yaml.safe_load(rendered))
+            if requirement.get('project') in ('CMIP5', 'OBS')]
+
+
+def _year_ranges(years, years_per_file):
+    years = sorted(years)
+    ranges = []
+    for year in years:
+        if ranges and year == ranges[-1][1] + 1 and (year - ranges[-1][0]) < years_per_file:
+            ranges[-1][1] = year
+        else:
+            ranges.append([year, year])
+    return [tuple(item) for item in ranges]
+
+
+def _filename(spec, start, end):
+    if spec['frequency'] == 'day':
+        period = '{}0101-{}1231'.format(start, end)
+    else:
+        period = '{}01-{}12'.format(start, end)
+    if spec['project'] == 'OBS':
+        return os.path.join(
+            'Tier{}'.format(spec['tier']), spec['dataset'], 'OBS_{}_{}_{}_{}_{}_{}.nc'.format(
+                spec['dataset'], spec['type'], spec['version'], spec['mip'], spec['short_name'], period))
+    return os.path.join(
+        INSTITUTES.get(spec['dataset'], spec['dataset']), spec['dataset'], spec['exp'], spec['frequency'],
+        'atmos', spec['mip'], spec['ensemble'], spec['short_name'], 'latest',
+        '{}_{}_{}_{}_{}_{}.nc'.format(
+            spec['short_name'], spec['mip'], spec['dataset'], spec['exp'], spec['ensemble'], period))
+
+
+def plan(identifiers=None, variables=None, frequencies=None, years=None, years_per_file=10):
+    """Return the files to generate as a list of (project, relative path, spec, start year, end year).
+
+    The processes, variables and frequencies (``day``, ``mon``) default to
+    all; ``years`` replaces the default period of the processes which take
+    the period as input.
+    """
+    from copernicus.processes import processes
+
+    specs = collections.OrderedDict()
+    for process in processes:
+        if not has_recipe(process) or (identifiers and process.identifier not in identifiers):
+            continue
+        for requirement in process_requirements(process, years=years):
+            if requirement['short_name'] not in VARIABLES:
+                continue
+            if variables and requirement['short_name'] not in variables:
+                continue
+            if frequencies and frequency(requirement) not in frequencies:
+                continue
+            spec = dict(
+                project=requirement['project'],
+                dataset=str(requirement['dataset']),
+                short_name=requirement['short_name'],
+                frequency=frequency(requirement))
+            if spec['project'] == 'OBS':
+                # early ESMValTool 2 observations carry the field in place of the mip
+                spec.update(type=requirement.get('type'), version=requirement.get('version'),
+                            tier=requirement.get('tier'), mip=requirement.get('field') or requirement.get('mip'))
+            else:
+                spec.update(exp=requirement['exp'], ensemble=requirement['ensemble'], mip=requirement['mip'])
+            key = tuple(sorted(spec.items()))
+            specs.setdefault(key, (spec, set()))[1].update(
+                range(requirement['start_year'], requirement['end_year'] + 1))
+    files = []
+    for spec, spec_years in specs.values():
+        for start, end in _year_ranges(spec_years, years_per_file):
+            files.append((spec['project'], _filename(spec, start, end), spec, start, end))
+    return files
+
+
+def grid(resolution):
+    """Cell centres and bounds of a regular global grid."""
+    import numpy as np
+
+    nlat, nlon = int(round(180. / resolution)), int(round(360. / resolution))
+    lat_bnds = np.linspace(-90., 90., nlat + 1)
+    lon_bnds = np.linspace(0., 360., nlon + 1)
+    return dict(
+        lat=(lat_bnds[:-1] + lat_bnds[1:]) / 2., lat_bnds=np.stack([lat_bnds[:-1], lat_bnds[1:]], axis=1),
+        lon=(lon_bnds[:-1] + lon_bnds[1:]) / 2., lon_bnds=np.stack([lon_bnds[:-1], lon_bnds[1:]], axis=1))
+
+
+def time_steps(start, end, freq):
+    """Bounds of the time steps in days since 1850-01-01 of a 365 day calendar."""
+    import numpy as np
+
+    if freq == 'day':
+        lower = np.arange((start - 1850) * 365, (end - 1849) * 365, dtype='f8')
+        return np.stack([lower, lower + 1], axis=1)
+    month_starts = np.cumsum([0] + MONTH_DAYS[:-1])
+    lower = np.concatenate([(year - 1850) * 365 + month_starts for year in range(start, end + 1)]).astype('f8')
+    lengths = np.tile(MONTH_DAYS, end - start + 1)
+    return np.stack([lower, lower + lengths], axis=1)
+
+
+def field(spec, times, plevs, target, seed):
+    """Smooth field with a seasonal cycle, a meridional gradient and some noise."""
+    import numpy as np
+
+    _, _, mean, amplitude = VARIABLES[spec['short_name']]
+    random = np.random.RandomState(seed)
+    season = np.cos(2 * np.pi * (times - 15.) / 365.)[:, None, None]
+    lat = np.radians(target['lat'])[None, :, None]
+    lon = np.radians(target['lon'])[None, None, :]
+    data = mean + amplitude * (np.cos(lat) - 0.5 + 0.2 * season * np.sin(lat) + 0.05 * np.sin(2 * lon))
+    data = data + 0.05 * amplitude * random.standard_normal((len(times), len(target['lat']), len(target['lon'])))
+    if spec['short_name'] == 'pr':
+        data = np.maximum(data, 0.)
+    if plevs is None:
+        return data.astype('f4')
+    # geopotential height of an isothermal atmosphere with a scale height of 7 km
+    heights = 7000. * np.log(101325. / np.array(plevs))
+    return (heights[None, :, None, None] + data[:, None, :, :]).astype('f4')
+
+
+def write(path, spec, start, end, resolution=5.):
+    """Write one data file, year by year."""
+    from netCDF4 import Dataset
+
+    target = grid(resolution)
+    plevs = PLEVS[spec['frequency']] if spec['short_name'] == 'zg' else None
+    standard_name, units, _, _ = VARIABLES[spec['short_name']]
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp_file = path + '.tmp'
+    with Dataset(tmp_file, 'w', format='NETCDF4') as out:
+        out.setncatts(dict(
+            project_id=spec['project'], model_id=spec['dataset'], experiment_id=spec.get('exp') or '',
+            frequency=spec['frequency'], title='synthetic data of copernicus make-testdata'))
+        dims = ['time', 'lat', 'lon']
+        out.createDimension('time', None)
+        out.createDimension('bnds', 2)
+        if plevs is not None:
+            out.createDimension('plev', len(plevs))
+            dims.insert(1, 'plev')
+            plev = out.createVariable('plev', 'f8', ('plev',))
+            plev.setncatts(dict(units='Pa', standard_name='air_pressure', positive='down', axis='Z'))
+            plev[:] = plevs
+        for name, attrs in (
+                ('lat', dict(units='degrees_north', standard_name='latitude', axis='Y')),
+                ('lon', dict(units='degrees_east', standard_name='longitude', axis='X'))):
+            out.createDimension(name, len(target[name]))
+            coord = out.createVariable(name, 'f8', (name,))
+            coord.setncatts(dict(attrs, bounds=name + '_bnds'))
+            coord[:] = target[name]
+            out.createVariable(name + '_bnds', 'f8', (name, 'bnds'))[:] = target[name + '_bnds']
+        times = out.createVariable('time', 'f8', ('time',))
+        times.setncatts(dict(units='days since 1850-01-01', calendar='365_day', standard_name='time',
+                             axis='T', bounds='time_bnds'))
+        time_bnds = out.createVariable('time_bnds', 'f8', ('time', 'bnds'))
+        chunks = tuple(1 if dim in ('time', 'plev') else len(target[dim]) for dim in dims)
+        data = out.createVariable(spec['short_name'], 'f4', tuple(dims), zlib=True, chunksizes=chunks,
+                                  fill_value=1e20)
+        data.setncatts(dict(standard_name=standard_name, units=units))
+        offset = 0
+        seed = zlib.crc32(path.encode('utf-8')) & 0xffffffff
+        for year in range(start, end + 1):
+            bounds = time_steps(year, year, spec['frequency'])
+            centres = bounds.mean(axis=1)
+            count = len(centres)
+            times[offset:offset + count] = centres
+            time_bnds[offset:offset + count] = bounds
+            data[offset:offset + count] = field(spec, centres - (year - 1850) * 365, plevs, target, seed + year)
+            offset += count
+    os.rename(tmp_file, path)
+    return path
+
+
+def generate(root, resolution=5., force=False, **options):
+    """Write the planned files below ``root/CMIP5`` and ``root/OBS``, yields (path, written)."""
+    for project, relpath, spec, start, end in plan(**options):
+        path = os.path.join(root, project, relpath)
+        if os.path.exists(path) and not force:
+            yield path, False
+            continue
+        LOGGER.info("writing %s", path)
+        yield write(path, spec, start, end, resolution=resolution), True
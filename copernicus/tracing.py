@@ -0,0 +1,272 @@
+"""
+Tracing of Execute requests in OpenTelemetry's OTLP/JSON format.
+
+With ``[tracing] enabled = true`` every Execute gets a trace with a root span
+``execute <identifier>`` and child spans for the handler, recipe rendering,
+data preflight and staging, the admission wait, the ESMValTool run and
+every ESMValTool preprocessor and diagnostic task (taken from the
+timestamps in ``main_log.txt``), output lookup and the archive. Finished
+spans are appended as OTLP/JSON lines to ``[tracing] file``, as read by the
+``otlpjsonfile`` receiver of the OpenTelemetry Collector, or printed to
+stdout with ``[tracing] exporter = stdout``. No collector is needed.
+
+The trace context is passed to the runner in the W3C ``TRACEPARENT``
+environment variable and the trace ID is logged in ``runner.log``,
+``main_log.txt`` and the job record, so the logs of a slow job can be matched
+with its trace.
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import calendar
+import threading
+
+from pywps import configuration
+from pywps.response.status import WPS_STATUS
+
+import copernicus
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+ENVIRON = 'TRACEPARENT'
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+# timestamp of an ESMValTool log line
+LOG_TIME = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?:,(\d{3}))?')
+
+_local = threading.local()
+_lock = threading.Lock()
+_INSTALLED = False
+
+
+def enabled():
+    return str(configuration.get_config_value("tracing", "enabled")).lower() == 'true'
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+class Span(object):
+    """A timed operation of a trace."""
+
+    def __init__(self, name, trace_id, parent_id=None, start=None, **attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    @property
+    def traceparent(self):
+        return '00-{}-{}-01'.format(self.trace_id, self.span_id)
+
+    def child(self, name, start=None, **attributes):
+        return Span(name, self.trace_id, self.span_id, start, **attributes)
+
+    def finish(self, end=None, error=None):
+        self.end = time.time() if end is None else end
+        if error is not None:
+            self.error = str(error)
+        export(self)
+        return self
+
+    def otlp(self):
+        """The span as OTLP/JSON."""
+        span = dict(
+            traceId=self.trace_id,
+            spanId=self.span_id,
+            name=self.name,
+            kind=1,
+            startTimeUnixNano=str(int(self.start * 1e9)),
+            endTimeUnixNano=str(int(self.end * 1e9)),
+            attributes=_attributes(self.attributes),
+            status=dict(code=2, message=self.error) if self.error else dict(code=1))
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _attributes(values):
+    attributes = []
+    for key, value in sorted(values.items()):
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = dict(boolValue=value)
+        elif isinstance(value, int):
+            value = dict(intValue=str(value))
+        elif isinstance(value, float):
+            value = dict(doubleValue=value)
+        else:
+            value = dict(stringValue=str(value))
+        attributes.append(dict(key=key, value=value))
+    return attributes
+
+
+def export(span):
+    line = json.dumps(dict(resourceSpans=[dict(
+        resource=dict(attributes=_attributes({
+            'service.name': 'copernicus',
+            'service.version': copernicus.__version__,
+            'host.name': socket.gethostname(),
+            'process.pid': os.getpid()})),
+        scopeSpans=[dict(scope=dict(name='copernicus.tracing'), spans=[span.otlp()])])]))
+    exporter = configuration.get_config_value("tracing", "exporter") or 'file'
+    with _lock:
+        if exporter == 'stdout':
+            sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+        else:
+            with open(configuration.get_config_value("tracing", "file") or 'traces.jsonl', 'a') as fp:
+                fp.write(line + '\n')
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current():
+    """The innermost span of this thread or ``None``."""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def current_trace_id():
+    span = current()
+    return span.trace_id if span is not None else None
+
+
+def environ(span=None):
+    """Environment of a child process continuing the trace of span or the current span."""
+    span = span or current()
+    if span is None:
+        return None
+    return dict(os.environ, **{ENVIRON: span.traceparent})
+
+
+class _Scope(object):
+
+    def __init__(self, span):
+        self.span = span
+
+    def __enter__(self):
+        _stack().append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _stack().pop()
+        self.span.finish(error=exc)
+        return False
+
+
+class _NoScope(object):
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOSCOPE = _NoScope()
+
+
+def span(name, **attributes):
+    """Context manager timing a child span of the current span, if there is one."""
+    parent = current()
+    if parent is None:
+        return _NOSCOPE
+    return _Scope(parent.child(name, **attributes))
+
+
+def trace(name, **attributes):
+    """Context manager starting a new trace, if tracing is enabled."""
+    if not enabled():
+        return _NOSCOPE
+    return _Scope(Span(name, _new_id(16), **attributes))
+
+
+def attach(traceparent=None):
+    """Continue the trace of the parent process given in ``TRACEPARENT``."""
+    match = TRACEPARENT.match(traceparent or os.environ.get(ENVIRON, ''))
+    if not match:
+        return None
+    span = Span('remote', match.group(1))
+    span.span_id = match.group(2)
+    _stack().append(span)
+    return span
+
+
+def log_time(line):
+    """Time of an ESMValTool log line, logged in UTC."""
+    match = LOG_TIME.match(line)
+    if not match:
+        return None
+    seconds = calendar.timegm(time.strptime(match.group(1), '%Y-%m-%d %H:%M:%S'))
+    return seconds + int(match.group(2) or 0) / 1000.
+
+
+def task_spans(parent, logfile, end=None):
+    """Record the ESMValTool tasks in logfile as children of parent."""
+    from copernicus.progress import STARTED, COMPLETED
+
+    end = end or time.time()
+    started = {}
+    try:
+        with open(logfile) as fp:
+            for line in fp:
+                match = STARTED.search(line) or COMPLETED.search(line)
+                when = log_time(line)
+                if not match or when is None:
+                    continue
+                name = match.group(1)
+                if match.re is STARTED:
+                    started[name] = when
+                elif name in started:
+                    parent.child('task ' + name, started.pop(name), task=name).finish(when)
+    except (IOError, OSError):
+        return
+    for name, when in started.items():
+        parent.child('task ' + name, when, task=name).finish(end, error='not completed')
+
+
+def install():
+    """Trace every Execute if tracing is enabled."""
+    global _INSTALLED
+    from pywps import Process
+
+    if not enabled() or _INSTALLED:
+        return _INSTALLED
+    original = Process._run_process
+
+    def _run_process(self, wps_request, wps_response):
+        handler = self.handler
+
+        def traced(request, response):
+            with span('handler'):
+                return handler(request, response)
+
+        with trace('execute ' + self.identifier, **{'wps.process': self.identifier,
+                                                    'wps.job_id': str(self.uuid)}) as root:
+            if root is not None:
+                LOGGER.info("job %s of %s has trace_id %s", self.uuid, self.identifier, root.trace_id)
+            self.handler = traced
+            try:
+                return original(self, wps_request, wps_response)
+            finally:
+                self.handler = handler
+                if root is not None and wps_response.status == WPS_STATUS.FAILED:
+                    root.error = wps_response.message
+
+    Process._run_process = _run_process
+    _INSTALLED = True
+    return _INSTALLED
@@ -0,0 +1,189 @@
+"""
+Supervisor recycling the worker process serving the WPS.
+
+The supervisor owns the listening socket and runs the WSGI server in a
+forked worker. Every ``check_interval`` seconds it looks at the RSS, open
+file descriptors and number of Execute requests of the worker. When one of
+the ``[watchdog]`` limits is exceeded a new worker is started on the same
+socket and the old one is drained: it stops accepting connections, finishes
+its in-flight requests and running jobs and exits.
+"""
+import os
+import time
+import signal
+import socket
+import threading
+import multiprocessing
+from six.moves.urllib.parse import parse_qs
+
+from pywps import configuration
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def enabled():
+    return str(configuration.get_config_value("watchdog", "enabled")).lower() == 'true'
+
+
+def read_limits():
+    def value(option, default):
+        text = configuration.get_config_value("watchdog", option)
+        return text if text not in (None, '') else default
+
+    return dict(
+        max_requests=int(value('max_requests', 0)),
+        max_rss=int(configuration.get_size_mb(value('max_rss', '0mb')) * 1024 * 1024),
+        max_fds=int(value('max_fds', 0)),
+        check_interval=float(value('check_interval', 5)))
+
+
+def is_execute(environ):
+    """Whether a request is a WPS Execute request, sent as GET with KVP or POST with XML."""
+    # e.g. POST /jobs/<id>/cancel
+    if environ.get('PATH_INFO', '').startswith('/jobs'):
+        return False
+    if environ.get('REQUEST_METHOD') == 'POST':
+        return True
+    query = dict((key.lower(), values) for key, values in parse_qs(environ.get('QUERY_STRING', '')).items())
+    return any(value.lower() == 'execute' for value in query.get('request', []))
+
+
+class CountingMiddleware(object):
+    """Count the Execute requests handled by a worker."""
+
+    def __init__(self, application, counter):
+        self.application = application
+        self.counter = counter
+
+    def __call__(self, environ, start_response):
+        if is_execute(environ):
+            with self.counter.get_lock():
+                self.counter.value += 1
+        return self.application(environ, start_response)
+
+
+def recycle_reason(usage, limits):
+    """Return why a worker with the given usage must be recycled or ``None``."""
+    for name, limit in (('requests', limits['max_requests']),
+                        ('rss', limits['max_rss']),
+                        ('fds', limits['max_fds'])):
+        if limit and usage.get(name, 0) >= limit:
+            return "{}={} reached limit {}".format(name, usage[name], limit)
+    return None
+
+
+def _worker(app_factory, fd, host, port, static_files, counter, ready):
+    from werkzeug.serving import make_server
+    try:
+        from werkzeug.middleware.shared_data import SharedDataMiddleware
+    except ImportError:
+        from werkzeug.wsgi import SharedDataMiddleware
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    application = CountingMiddleware(app_factory(), counter)
+    if static_files:
+        application = SharedDataMiddleware(application, static_files)
+    server = make_server(host, port, application, threaded=True, fd=fd)
+    # wait for in-flight requests when the server is closed
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def drain(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, drain)
+    ready.set()
+    server.serve_forever()
+    server.server_close()
+    LOGGER.info("worker %s drained", os.getpid())
+
+
+class Supervisor(object):
+    """Run and recycle the worker serving the WSGI application of app_factory."""
+
+    def __init__(self, app_factory, host, port, static_files=None, limits=None):
+        self.app_factory = app_factory
+        self.host = host
+        self.port = port
+        self.static_files = static_files
+        self.limits = limits or read_limits()
+        self.context = multiprocessing.get_context('fork')
+        self.worker = None
+        self.counter = None
+        self.draining = []
+        self.stopped = False
+        self.recycled = 0
+
+    def bind(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, int(self.port)))
+        self.socket.listen(128)
+        self.socket.set_inheritable(True)
+
+    def start_worker(self):
+        counter = self.context.Value('i', 0)
+        ready = self.context.Event()
+        worker = self.context.Process(
+            target=_worker,
+            args=(self.app_factory, self.socket.fileno(), self.host, self.port,
+                  self.static_files, counter, ready))
+        worker.start()
+        if not ready.wait(120):
+            LOGGER.warning("worker %s did not get ready", worker.pid)
+        LOGGER.info("started worker %s", worker.pid)
+        return worker, counter
+
+    def usage(self):
+        import psutil
+
+        process = psutil.Process(self.worker.pid)
+        return dict(
+            requests=self.counter.value,
+            rss=process.memory_info().rss,
+            fds=process.num_fds())
+
+    def recycle(self, reason):
+        old = self.worker
+        LOGGER.warning("recycling worker %s: %s", old.pid, reason)
+        # the new worker accepts connections before the old one stops
+        self.worker, self.counter = self.start_worker()
+        os.kill(old.pid, signal.SIGTERM)
+        self.draining.append(old)
+        self.recycled += 1
+
+    def check(self):
+        self.draining = [worker for worker in self.draining if worker.is_alive()]
+        if not self.worker.is_alive():
+            LOGGER.error("worker %s exited with code %s, restarting", self.worker.pid, self.worker.exitcode)
+            self.worker, self.counter = self.start_worker()
+            return
+        try:
+            reason = recycle_reason(self.usage(), self.limits)
+        except Exception:
+            LOGGER.debug("could not check worker %s", self.worker.pid, exc_info=True)
+            return
+        if reason:
+            self.recycle(reason)
+
+    def stop(self, signum=None, frame=None):
+        self.stopped = True
+
+    def serve_forever(self):
+        self.bind()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.worker, self.counter = self.start_worker()
+        while not self.stopped:
+            time.sleep(self.limits['check_interval'])
+            if not self.stopped:
+                self.check()
+        LOGGER.info("stopping workers")
+        for worker in [self.worker] + self.draining:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+        for worker in [self.worker] + self.draining:
+            worker.join()
+        self.socket.close()
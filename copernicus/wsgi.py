@@ -1,18 +1,53 @@
 import os
 from pywps.app.Service import Service
 
-from .processes import processes
+from .processes import processes, registry
+from .processes.utils import update_allowed_values
+from . import catalog
+from . import status
+from .jobs import JobsMiddleware
+from . import capabilities
+from . import profiling
+from . import tracing
+from . import staging
 
 
-def create_app(cfgfiles=None):
-    config_files = [os.path.join(os.path.dirname(__file__), 'default.cfg')]
+def config_files(cfgfiles=None):
+    files = [os.path.join(os.path.dirname(__file__), 'default.cfg')]
     if cfgfiles:
-        config_files.extend(cfgfiles)
+        files.extend(cfgfiles)
     if 'PYWPS_CFG' in os.environ:
-        config_files.append(os.environ['PYWPS_CFG'])
-    print(config_files)
-    service = Service(processes=processes, cfgfiles=config_files)
-    return service
+        files.append(os.environ['PYWPS_CFG'])
+    return files
+
+
+def _update_loaded(process):
+    update_allowed_values([process])
+
+
+def create_app(cfgfiles=None):
+    cfgfiles = config_files(cfgfiles)
+    print(cfgfiles)
+    service = Service(processes=processes, cfgfiles=cfgfiles)
+    # write progress reports of jobs at a bounded rate
+    status.install()
+    # profile requests asking for it
+    profiling.install()
+    # trace Execute requests
+    tracing.install()
+    # release the staged inputs of jobs whose handler returns early
+    staging.install()
+    # advertise only datasets available in the archive
+    update_allowed_values(processes)
+    if _update_loaded not in registry.on_load:
+        registry.on_load.append(_update_loaded)
+    catalog.start_background_refresh(
+        callback=lambda new_catalog: update_allowed_values(processes, new_catalog))
+    if capabilities.enabled():
+        # serve GetCapabilities and DescribeProcess from memory
+        service = capabilities.CapabilitiesCache(service)
+    # status and cancellation of running jobs
+    return JobsMiddleware(service)
 
 
 #application = create_app()
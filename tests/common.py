@@ -1,6 +1,12 @@
+import os
+
 from pywps.tests import WpsClient, WpsTestResponse
 
 
+# directory containing the copernicus package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
 class WpsTestClient(WpsClient):
 
     def get(self, *args, **kwargs):
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from copernicus import admission
+from copernicus import jobs
+from copernicus import resources
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def registry(tmpdir, monkeypatch):
+    monkeypatch.setattr(jobs, 'cache_root', lambda: str(tmpdir))
+
+
+def test_predict_memory(registry):
+    assert admission.predict_memory('cvdp') == 2048 * MB
+    for size, rss in ((100, 1000 * MB), (200, 1500 * MB), (300, 2000 * MB)):
+        resources.record(dict(job_id=str(size), process='cvdp', status=jobs.FINISHED,
+                              input_size=size, resources=dict(peak_rss=rss)))
+    assert admission.predict_memory('cvdp', 400) == int(1.2 * 2500 * MB)
+    # never below what a smaller input needed
+    assert admission.predict_memory('cvdp', 250) >= int(1.2 * 1500 * MB)
+    assert admission.predict_memory('cvdp') == int(1.2 * 2000 * MB)
+
+
+def test_admit_waits_for_memory(registry, monkeypatch):
+    monkeypatch.setattr(admission, 'available_memory', lambda: 3000 * MB)
+    jobs.update('big', status=jobs.RUNNING, pgid=os.getpid(), predicted_memory=2000 * MB, rss=500 * MB)
+    assert not admission.admit('next', 1500 * MB, timeout=0.1, poll=0.05)
+    assert jobs.get('next')['status'] == jobs.WAITING
+    assert admission.admit('small', 500 * MB, timeout=0.1, poll=0.05)
+    assert jobs.get('small')['predicted_memory'] == 500 * MB
+    # an idle node admits a run even if it does not fit
+    jobs.update('big', status=jobs.FINISHED)
+    jobs.update('small', status=jobs.FINISHED)
+    assert admission.admit('next', 5000 * MB, timeout=0.1, poll=0.05)
+
+
+def test_failed_cgroup_removal_retried(registry, tmpdir, monkeypatch):
+    parent = tmpdir.mkdir('cgroup')
+    get_config_value = admission.configuration.get_config_value
+    monkeypatch.setattr(admission.configuration, 'get_config_value', lambda section, name: (
+        str(parent) if (section, name) == ('runner', 'cgroup') else get_config_value(section, name)))
+    jobs.update('a', status=jobs.RUNNING)
+    jobs.update('c', status=jobs.RUNNING)
+    path = admission.create_cgroup('a', 100 * MB)
+    running = admission.create_cgroup('c', 100 * MB)
+    os.remove(os.path.join(running, 'memory.max'))
+    warnings = []
+    monkeypatch.setattr(admission.LOGGER, 'warning', lambda message, *args, **kwargs: warnings.append(message))
+    # the directory is not empty like a cgroup with processes left
+    assert not admission.remove_cgroup(path)
+    assert warnings and 'could not remove cgroup' in warnings[0]
+    jobs.update('a', status=jobs.FINISHED)
+    os.remove(os.path.join(path, 'memory.max'))
+    admission.create_cgroup('b', 100 * MB)
+    assert sorted(parent.listdir()) == [parent.join('copernicus-b'), parent.join('copernicus-c')]
+
+
+def test_runs_capped_without_cgroup_only_on_request(monkeypatch):
+    options = {}
+    get_config_value = admission.configuration.get_config_value
+    monkeypatch.setattr(admission.configuration, 'get_config_value', lambda section, name: (
+        options[name] if section == 'runner' and name in options else get_config_value(section, name)))
+    assert admission.limit_memory(100 * MB) is None
+    assert admission.limit_memory(100 * MB, '/sys/fs/cgroup/copernicus-a') is not None
+    options['rlimit_fallback'] = 'true'
+    assert admission.limit_memory(100 * MB) is not None
@@ -0,0 +1,65 @@
+import threading
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+import pytest
+
+from copernicus import bench
+
+WPS = 'xmlns:wps="http://www.opengis.net/wps/1.0.0"'
+BUSY = ('<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/1.1">'
+        '<ows:Exception exceptionCode="ServerBusy"><ows:ExceptionText>busy</ows:ExceptionText>'
+        '</ows:Exception></ows:ExceptionReport>')
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def wps_stub(port, polls):
+    def app(environ, start_response):
+        query = environ.get('QUERY_STRING', '')
+        status = '200 OK'
+        if environ['PATH_INFO'].startswith('/status/'):
+            polls.append(query)
+            state = '<wps:ProcessSucceeded/>' if len(polls) % 2 == 0 else '<wps:ProcessStarted/>'
+            body = '<wps:ExecuteResponse {}><wps:Status>{}</wps:Status></wps:ExecuteResponse>'.format(WPS, state)
+        elif 'GetCapabilities' in query:
+            body = '<wps:Capabilities {}/>'.format(WPS)
+        elif 'DescribeProcess' in query:
+            body = '<wps:ProcessDescriptions {}/>'.format(WPS)
+        elif 'storeExecuteResponse=true' in query:
+            body = ('<wps:ExecuteResponse {} statusLocation="http://127.0.0.1:{}/status/1">'
+                    '<wps:Status><wps:ProcessAccepted/></wps:Status></wps:ExecuteResponse>').format(WPS, port)
+        else:
+            status, body = '400 Bad Request', BUSY
+        start_response(status, [('Content-Type', 'text/xml')])
+        return [body.encode('utf-8')]
+    return app
+
+
+def test_bench_mix():
+    polls = []
+    server = make_server('127.0.0.1', 0, None, handler_class=QuietHandler)
+    server.set_app(wps_stub(server.server_port, polls))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        results = bench.Bench(
+            'http://127.0.0.1:{}/wps'.format(server.server_port), bench.parse_mix('caps=1,describe=1,sync=1,async=2'),
+            concurrency=4, requests=40, poll_interval=0.01, timeout=10, seed=1).run()
+    finally:
+        server.shutdown()
+    requests = results['requests']
+    assert results['total']['count'] == 40
+    assert requests['caps']['errors'] == requests['describe']['errors'] == requests['async']['errors'] == 0
+    # sync Execute is rejected by the stub
+    assert requests['sync']['errors'] == requests['sync']['count'] > 0
+    assert results['errors'] == {'sync: HTTP 400, ServerBusy busy': requests['sync']['count']}
+    assert results['jobs']['succeeded'] == results['jobs']['turnaround']['count'] == requests['async']['count']
+    assert 'turnaround' in bench.format_report(results)
+    assert 'caps' in bench.compare(results, results)
+    with pytest.raises(ValueError):
+        bench.parse_mix('caps=1,getfeature=1')
@@ -0,0 +1,61 @@
+import gzip
+
+from pywps import Service, configuration
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from copernicus.capabilities import CapabilitiesCache
+from copernicus.processes.wps_sleep import Sleep
+
+CAPS = '/wps?service=WPS&request=GetCapabilities&version=1.0.0'
+
+
+def test_capabilities_cached_with_etag_and_gzip():
+    cache = CapabilitiesCache(Service(processes=[Sleep()]))
+    client = Client(cache, Response)
+    resp = client.get(CAPS)
+    assert resp.status_code == 200
+    assert b'sleep' in resp.data
+    etag = resp.headers['ETag']
+    # parameter order and case do not matter
+    assert client.get('/wps?request=getcapabilities&version=1.0.0&service=wps').headers['ETag'] == etag
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert client.get(CAPS, headers={'If-None-Match': etag}).status_code == 304
+    resp = client.get(CAPS, headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert b'sleep' in gzip.decompress(resp.data)
+    assert resp.headers['ETag'] != etag
+    # errors are passed through
+    assert client.get('/wps?service=WPS&request=DescribeProcess&version=1.0.0&identifier=nope').status_code == 400
+    assert client.get('/wps?service=WPS&request=DescribeProcess&version=1.0.0&identifier=sleep').status_code == 200
+
+
+def test_capabilities_invalidated_on_change():
+    cache = CapabilitiesCache(Service(processes=[Sleep()]))
+    client = Client(cache, Response)
+    etag = client.get(CAPS).headers['ETag']
+    title = configuration.get_config_value('metadata:main', 'identification_title')
+    configuration.CONFIG.set('metadata:main', 'identification_title', 'Changed title')
+    try:
+        resp = client.get(CAPS, headers={'If-None-Match': etag})
+    finally:
+        configuration.CONFIG.set('metadata:main', 'identification_title', title)
+    assert resp.status_code == 200
+    assert b'Changed title' in resp.data
+    assert cache.misses == 2
+
+
+def test_config_fingerprint_computed_once_per_load(monkeypatch):
+    from copernicus import capabilities
+    fingerprint = capabilities.config_fingerprint()
+    monkeypatch.setattr(configuration.CONFIG, 'write', None)
+    assert capabilities.config_fingerprint() == fingerprint
+    monkeypatch.undo()
+    configuration.CONFIG.set('server', 'url', configuration.get_config_value('server', 'url'))
+    assert capabilities.config_fingerprint() != fingerprint
+    config = configuration.CONFIG
+    configuration.load_configuration()
+    try:
+        assert capabilities.config_fingerprint()[0] == id(configuration.CONFIG)
+    finally:
+        configuration.CONFIG = config
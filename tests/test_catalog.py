@@ -0,0 +1,127 @@
+import pytest
+
+from copernicus import catalog
+
+
+@pytest.fixture
+def archive(tmpdir):
+    cmip5 = tmpdir.mkdir('archive').mkdir('EC-EARTH').mkdir('historical')
+    for years in ('19500101-19741231', '19750101-19991231'):
+        cmip5.join('zg_day_EC-EARTH_historical_r2i1p1_{}.nc'.format(years)).write('')
+    obs = tmpdir.mkdir('obs').mkdir('Tier3').mkdir('ERA-Interim')
+    obs.join('OBS_ERA-Interim_reanaly_1_T3D_zg_19790101-20141231.nc').write('')
+    return catalog.Catalog.scan(dict(CMIP5=str(tmpdir.join('archive')), OBS=str(tmpdir.join('obs'))))
+
+
+def requirement(**kwargs):
+    req = dict(project='CMIP5', dataset='EC-EARTH', exp='historical', ensemble='r2i1p1',
+               mip='day', short_name='zg', start_year=1980, end_year=1989)
+    req.update(kwargs)
+    return req
+
+
+def test_parse_filename():
+    facets, start, end = catalog.parse_filename('pr_Amon_ACCESS1-0_historical_r1i1p1_185001-200512.nc')
+    assert facets['dataset'] == 'ACCESS1-0'
+    assert (start, end) == (1850, 2005)
+    facets, start, end = catalog.parse_filename('OBS_ERA-Interim_reanaly_1_T3D_zg_19790101-20141231.nc')
+    assert facets['project'] == 'OBS'
+    assert facets['dataset'] == 'ERA-Interim'
+    assert catalog.parse_filename('README.txt') is None
+
+
+def test_check(archive):
+    assert archive.coverage(archive.select(dataset='EC-EARTH')) == [(1950, 1999)]
+    assert archive.check(requirement()) is None
+    assert 'requested 1940-1960' in archive.check(requirement(start_year=1940, end_year=1960))
+    assert 'ensemble=r1i1p1' in archive.check(requirement(ensemble='r1i1p1'))
+    obs = dict(project='OBS', dataset='ERA-Interim', field='T3D', mip='day', short_name='zg',
+               start_year=1980, end_year=1989)
+    assert archive.check(obs) is None
+    assert len(archive.files(requirement(start_year=1970, end_year=1980))) == 2
+
+
+def test_recipe_requirements():
+    recipe = {
+        'datasets': [{'dataset': 'EC-EARTH', 'project': 'CMIP5', 'exp': 'historical',
+                      'ensemble': 'r2i1p1', 'start_year': 1980, 'end_year': 1989}],
+        'diagnostics': {'diag': {'variables': {'zg': {'mip': 'day', 'field': 'T3D'}}}},
+    }
+    requirements = catalog.recipe_requirements(recipe)
+    assert len(requirements) == 1
+    assert requirements[0]['short_name'] == 'zg'
+    assert requirements[0]['mip'] == 'day'
+
+
+def test_dataset_selection(archive):
+    from copernicus.processes.utils.esmvaltool_utils import DatasetSelection
+
+    selection = DatasetSelection(
+        models=['MPI-ESM-LR'], model_name='Model',
+        experiments=['historical', 'rcp85'], experiment_name='Experiment',
+        ensembles=['r1i1p1'], ensemble_name='Ensemble',
+        start_end_year=(1850, 2005), start_end_defaults=(1940, 1960),
+        variables=[('zg', 'day')])
+    choices = selection.choices(archive)
+    assert choices['models'] == ['EC-EARTH']
+    assert choices['experiments'] == ['historical']
+    assert choices['ensembles'] == ['r2i1p1']
+    assert choices['start_end_year'] == (1950, 1999)
+    assert choices['start_end_defaults'] == (1950, 1960)
+    inputs = selection.inputs(archive)
+    assert [inpt.identifier for inpt in inputs] == ['model', 'experiment', 'ensemble', 'start_year', 'end_year']
+    assert inputs[0].dataset_selection is selection
+
+
+def test_stale_catalog_rescanned_in_background(archive, tmpdir, monkeypatch):
+    import time
+    import threading
+
+    archive.created = 0.
+    scanned = threading.Event()
+    release = threading.Event()
+
+    def rescan(roots, previous):
+        scanned.set()
+        release.wait(5)
+        fresh = catalog.Catalog(roots)
+        fresh.created = time.time()
+        return fresh
+
+    monkeypatch.setattr(catalog, 'data_roots', lambda: archive.roots)
+    monkeypatch.setattr(catalog, '_catalog', archive)
+    monkeypatch.setattr(catalog, '_rescan', rescan)
+    # the stale catalogue is served while the rescan runs
+    assert catalog.get_catalog() is archive
+    assert scanned.wait(5)
+    assert catalog.get_catalog() is archive
+    release.set()
+    catalog._rescan_thread.join(5)
+    assert catalog.get_catalog() is not archive
+
+
+def test_preflight_counts_served_as_metrics(archive, tmpdir, monkeypatch):
+    monkeypatch.setattr(catalog, 'cache_root', lambda: str(tmpdir.join('cache')))
+    monkeypatch.setattr(catalog, 'get_catalog', lambda: archive)
+    recipe = tmpdir.join('recipe.yml')
+    recipe.write('datasets:\n- {project: CMIP5, dataset: EC-EARTH, exp: historical, ensemble: r2i1p1,\n'
+                 '   mip: day, start_year: 1980, end_year: 1989}\n'
+                 'diagnostics:\n  d:\n    variables:\n      zg: {}\n')
+    catalog.preflight(str(recipe))
+    recipe.write(recipe.read().replace('1980', '1900'))
+    with pytest.raises(catalog.PreflightError):
+        catalog.preflight(str(recipe))
+    assert catalog.preflight_stats() == dict(checked=2, rejected=1)
+    text = catalog.prometheus()
+    assert 'copernicus_preflight_checked 2' in text
+    assert 'copernicus_preflight_rejected 1' in text
+
+
+def test_preflight_error_message_fits_process_error():
+    errors = ['no CMIP5 data with dataset=MODEL{} for exp=historical (available: none)'.format(i)
+              for i in range(20)]
+    error = catalog.PreflightError(errors)
+    assert error.errors == errors
+    assert len(str(error)) <= catalog.MAX_MESSAGE_LENGTH
+    assert str(error).endswith(' more')
+    assert '(' not in str(error)
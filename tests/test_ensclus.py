@@ -0,0 +1,132 @@
+import numpy as np
+
+from copernicus import ensclus
+from copernicus.cache import Cache, make_key
+
+
+def test_select_numpcs():
+    variance_fraction = np.array([0.5, 0.25, 0.15, 0.1])
+    assert ensclus.select_numpcs(variance_fraction, 70) == 2
+    assert ensclus.select_numpcs(variance_fraction, 75) == 2
+    assert ensclus.select_numpcs(variance_fraction, 90) == 3
+
+
+def test_kmeans_warm_start():
+    rng = np.random.RandomState(1)
+    points = np.concatenate([rng.normal(0, 0.1, (10, 2)), rng.normal(5, 0.1, (10, 2))])
+    labels, centroids = ensclus.kmeans(points, 2)
+    assert len(set(labels[:10])) == 1
+    assert len(set(labels[10:])) == 1
+    warm_labels, _ = ensclus.kmeans(points, 2, init=centroids)
+    assert np.array_equal(labels, warm_labels)
+
+
+def test_principal_components():
+    rng = np.random.RandomState(2)
+    anomalies = rng.normal(size=(6, 4, 8))
+    pcs, variance_fraction = ensclus.principal_components(anomalies, np.linspace(-60, 60, 4))
+    assert pcs.shape == (6, 6)
+    assert np.isclose(variance_fraction.sum(), 1.)
+
+
+def test_cache_roundtrip(tmpdir):
+    data_file = tmpdir.join('data.txt')
+    data_file.write('data')
+    cache = Cache('test', root=str(tmpdir.join('cache')))
+    key = make_key('test', year=2000)
+    assert cache.get(key) is None
+    files = cache.put(key, dict(data=str(data_file)), meta=dict(year=2000))
+    assert open(files['data']).read() == 'data'
+    assert cache.meta(key) == dict(year=2000)
+
+
+class _Input(object):
+    def __init__(self, data):
+        self.data = data
+
+
+def archive(root, years='199001-200512'):
+    from copernicus import catalog
+
+    for dataset in ('ACCESS1-0', 'CanESM2'):
+        root.ensure_dir(dataset).join('tas_Amon_{}_historical_r1i1p1_{}.nc'.format(dataset, years)).write('')
+    return catalog.Catalog.scan(dict(CMIP5=str(root)))
+
+
+def handler_call(process):
+    inputs = dict(season='JJA', area='EU', extreme='75th_percentile', numclus=3, perc=80,
+                  start_year=1990, end_year=2000)
+
+    class Request(object):
+        pass
+
+    class Response(object):
+        outputs = dict((output.identifier, output) for output in process.outputs)
+
+        def update_status(self, message, status_percentage=None):
+            pass
+
+    request = Request()
+    request.inputs = dict((name, [_Input(value)]) for name, value in inputs.items())
+    response = Response()
+    return process._handler(request, response), response
+
+
+def test_cache_key_covers_input_data(tmpdir, monkeypatch):
+    from copernicus import catalog
+
+    recipe = tmpdir.join('recipe.yml')
+    recipe.write('datasets:\n- {dataset: ACCESS1-0, project: CMIP5, mip: Amon, exp: historical,\n'
+                 '   ensemble: r1i1p1, start_year: 1990, end_year: 2000}\n'
+                 'diagnostics:\n  d:\n    variables:\n      tas: {}\n')
+    data = archive(tmpdir.mkdir('archive'))
+    monkeypatch.setattr(catalog, 'get_catalog', lambda: data)
+    monkeypatch.setattr(catalog, 'data_roots', lambda: dict(CMIP5=str(tmpdir.join('archive')), OBS=None))
+    key = ensclus.cache_key(str(recipe), 'JJA', 'EU', '75th_percentile')
+    assert ensclus.cache_key(str(recipe), 'JJA', 'EU', '75th_percentile') == key
+    # replaced input file
+    tmpdir.join('archive', 'ACCESS1-0', 'tas_Amon_ACCESS1-0_historical_r1i1p1_199001-200512.nc').write('new')
+    replaced = ensclus.cache_key(str(recipe), 'JJA', 'EU', '75th_percentile')
+    assert replaced != key
+    # other dataset
+    recipe.write(recipe.read().replace('ACCESS1-0', 'CanESM2'))
+    assert ensclus.cache_key(str(recipe), 'JJA', 'EU', '75th_percentile') not in (key, replaced)
+
+
+def test_cache_hit_skips_recipe_generation(tmpdir, monkeypatch):
+    from copernicus import catalog, runner
+    from copernicus.processes.wps_ensclus import EnsClus
+
+    def generate_recipe(*args, **kwargs):
+        raise AssertionError('preflight and staging must not run on a cache hit')
+
+    process = EnsClus()
+    process.workdir = str(tmpdir)
+    data = archive(tmpdir.mkdir('archive'))
+    monkeypatch.setattr(catalog, 'get_catalog', lambda: data)
+    monkeypatch.setattr(runner, 'generate_recipe', generate_recipe)
+    monkeypatch.setattr(ensclus, 'load_state', lambda key: dict(state='state.npz'))
+    monkeypatch.setattr(EnsClus, '_recluster', lambda self, key, cached, options, response: cached)
+    result, response = handler_call(process)
+    assert result == dict(state='state.npz')
+    assert response.outputs['recipe'].file == str(tmpdir.join('recipe.yml'))
+
+
+def test_recluster_sets_logs(tmpdir, monkeypatch):
+    from copernicus import catalog
+    from copernicus.processes.wps_ensclus import EnsClus
+
+    process = EnsClus()
+    process.workdir = str(tmpdir)
+    data = archive(tmpdir.mkdir('archive'))
+    monkeypatch.setattr(catalog, 'get_catalog', lambda: data)
+    monkeypatch.setattr(ensclus, 'load_state', lambda key: dict(state='state.npz'))
+
+    def recluster(key, files, numclus, perc, workdir):
+        raise Exception('numclus=3 exceeds the number of ensemble members (2)')
+    monkeypatch.setattr(ensclus, 'recluster', recluster)
+    _, response = handler_call(process)
+    assert str(response.outputs['success'].data) == 'False'
+    log_file = str(tmpdir.join('recluster.log'))
+    assert response.outputs['log'].file == response.outputs['debug_log'].file == log_file
+    assert 'exceeds the number of ensemble members' in open(log_file).read()
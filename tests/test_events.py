@@ -0,0 +1,48 @@
+import json
+import asyncio
+
+from copernicus import events
+
+
+def test_events_pushed_until_final_status():
+    states = dict(job1=dict(job_id='job1', status='started', percent_done=20))
+
+    async def run():
+        server = events.EventServer(interval=0.05, keepalive=0.1, read=lambda job_ids: dict(
+            (job_id, dict(states[job_id])) for job_id in job_ids if job_id in states))
+        server.wakeup = asyncio.Event()
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        poller = asyncio.ensure_future(server.poll())
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /events/job1 HTTP/1.1\r\nAccept: text/event-stream\r\n\r\n')
+        assert b'200 OK' in await reader.readline()
+        await asyncio.sleep(0.3)
+        states['job1'].update(percent_done=60)
+        await asyncio.sleep(0.3)
+        states['job1'].update(status='succeeded', percent_done=100)
+        body = (await asyncio.wait_for(reader.read(), 2)).decode('utf-8')
+
+        missing_reader, missing_writer = await asyncio.open_connection('127.0.0.1', port)
+        missing_writer.write(b'GET /other HTTP/1.1\r\n\r\n')
+        not_found = await missing_reader.readline()
+        unknown_reader, unknown_writer = await asyncio.open_connection('127.0.0.1', port)
+        unknown_writer.write(b'GET /events/unknown HTTP/1.1\r\n\r\n')
+        unknown = await asyncio.wait_for(unknown_reader.read(), 2)
+
+        poller.cancel()
+        listener.close()
+        return server, body, not_found, unknown
+
+    server, body, not_found, unknown = asyncio.run(run())
+    data = [json.loads(line[len('data: '):]) for line in body.splitlines() if line.startswith('data: ')]
+    assert [state['percent_done'] for state in data] == [20, 60, 100]
+    assert data[-1]['status'] == 'succeeded'
+    assert ': keepalive' in body
+    # the stream ended, nobody is subscribed anymore
+    assert server.subscribers == {}
+    assert b'404' in not_found
+    # unknown jobs are not streamed forever
+    assert unknown.startswith(b'HTTP/1.1 404')
+    assert server.states == {}
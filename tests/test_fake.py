@@ -0,0 +1,47 @@
+import os
+import fnmatch
+
+from pywps import Service
+from pywps.tests import assert_response_success
+
+from . common import client_for, ROOT
+from copernicus import fake
+from copernicus.processes.wps_blocking import Blocking
+
+RECIPE = dict(
+    datasets=[dict(dataset='EC-EARTH', project='CMIP5', exp='historical', ensemble='r2i1p1',
+                   start_year=1980, end_year=1989)],
+    diagnostics=dict(miles_diagnostics=dict(
+        variables=dict(zg=dict(mip='day')),
+        scripts=dict(miles_block=dict(script='miles/miles_block.R', seasons='DJF')))))
+
+
+def test_outputs_match_globs():
+    assert fake.output_name('CMPI5*spi*.nc', 'x') == 'CMPI5_x_spi_x.nc'
+    assert fake.output_name('*_5000Pa_mo_reg.png', 'x') == 'x_5000Pa_mo_reg.png'
+    assert [name for name, _, _ in fake.tasks(RECIPE)] == ['miles_diagnostics/zg', 'miles_diagnostics/miles_block']
+    outputs = fake.outputs(RECIPE, 'miles_diagnostics', 'miles_block')
+    subdir = os.path.join('EC-EARTH', 'historical', 'r2i1p1', '1980-1989', 'DJF', 'Block')
+    assert ('work', os.path.join(subdir, 'BlockFull_EC-EARTH_historical_r2i1p1_1980-1989.nc')) in outputs
+    plots = [path for kind, path in outputs if kind == 'plots']
+    assert len(fnmatch.filter(plots, os.path.join(subdir, 'BlockEvents*.png'))) == 1
+
+
+def test_wps_blocking_fake_backend(tmpdir, monkeypatch):
+    # the log file of the default configuration is written to the working directory
+    monkeypatch.chdir(tmpdir)
+    # the runner is started with python -m copernicus.runner
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+    cfgfile = tmpdir.join('fake.cfg')
+    cfgfile.write('\n'.join([
+        '[server]', 'outputpath = {}'.format(tmpdir.mkdir('outputs')), 'workdir = {}'.format(tmpdir.mkdir('work')),
+        '[data]', 'preflight = false',
+        '[cache]', 'cache_root = {}'.format(tmpdir.mkdir('cache')),
+        '[runner]', 'backend = fake', 'admission = false',
+        '[fake]', 'startup_time = 0', 'task_duration = 0.01', 'plot_size = 0.001mb', 'data_size = 0.001mb']))
+    client = client_for(Service(processes=[Blocking()], cfgfiles=[
+        os.path.join(os.path.dirname(fake.__file__), 'default.cfg'), str(cfgfile)]))
+    resp = client.get(service='WPS', request='Execute', version='1.0.0', identifier='blocking')
+    assert_response_success(resp)
+    assert b'BlockClim_EC-EARTH_historical_r2i1p1_1980-1989.nc' in resp.data
+    assert b'TM90_EC-EARTH_historical_r2i1p1_1980-1989.png' in resp.data
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import uuid
+import threading
+import subprocess
+
+import psutil
+import pytest
+from pywps.app.Common import Metadata
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from pywps import configuration
+
+from copernicus import jobs
+from copernicus import runner
+
+
+class DummyProcess(object):
+    metadata = [Metadata('Estimated Calculation Time', '2 minutes')]
+
+
+@pytest.fixture
+def registry(tmpdir, monkeypatch):
+    monkeypatch.setattr(jobs, 'cache_root', lambda: str(tmpdir))
+
+
+def test_timeout_for():
+    assert jobs.parse_duration('2 Minutes') == 120
+    assert jobs.parse_duration('soon') is None
+    assert jobs.timeout_for(DummyProcess()) == 1200
+    assert jobs.timeout_for(None) == 7200
+
+
+def test_cancel_kills_process_group(registry):
+    child = subprocess.Popen(['sh', '-c', 'sleep 60 & sleep 60'], start_new_session=True)
+    time.sleep(0.2)
+    tree = psutil.Process(child.pid).children(recursive=True)
+    jobs.update('job1', status=jobs.RUNNING, pgid=child.pid)
+    started = time.time()
+    jobs.cancel('job1')
+    assert child.wait(timeout=5) is not None
+    assert time.time() - started < 5
+    assert jobs.cancel_requested('job1')
+    assert not jobs._alive(tree)
+
+
+def test_jobs_middleware(registry, monkeypatch):
+    jobs.update('job2', status=jobs.FINISHED, duration=1.5)
+    app = jobs.JobsMiddleware(lambda environ, start_response: [])
+    client = Client(app, Response)
+    resp = client.get('/jobs/job2')
+    assert json.loads(resp.data.decode('utf-8'))['duration'] == 1.5
+    assert client.get('/jobs/unknown').status_code == 404
+    jobs.update('job2', owner='alice')
+    assert client.post('/jobs/job2/cancel').status_code == 403
+    assert client.post('/jobs/job2/cancel', environ_base={'REMOTE_USER': 'bob'}).status_code == 403
+    assert client.post('/jobs/job2/cancel', environ_base={'REMOTE_USER': 'alice'}).status_code == 200
+    monkeypatch.setattr(jobs, '_option', lambda name, default=None: 'secret' if name == 'admin_token' else default)
+    assert client.post('/jobs/job2/cancel', headers={'Authorization': 'Bearer secret'}).status_code == 200
+    assert len(json.loads(client.get('/jobs').data.decode('utf-8'))) == 1
+
+
+def test_concurrent_updates_and_expiry(registry):
+    def work(name):
+        for i in range(5):
+            jobs.update('job3', **{name: i})
+    threads = [threading.Thread(target=work, args=('key{}'.format(n),)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert jobs.get('job3') == dict(job_id='job3', key0=4, key1=4, key2=4, key3=4)
+    jobs.update('job4', status=jobs.FINISHED, finished=time.time() - 100)
+    jobs.update('job5', status=jobs.RUNNING, started=time.time() - 100)
+    assert jobs.expire(max_age=50) == 1
+    assert [record['job_id'] for record in jobs.list_jobs()] == ['job3', 'job5']
+
+
+class Response(object):
+    """pywps passes the job id as a uuid.UUID."""
+
+    uuid = uuid.uuid4()
+
+    def update_status(self, message, percentage):
+        pass
+
+
+def test_run_with_uuid_job_id(registry, tmpdir):
+    cfgfile = tmpdir.join('runner.cfg')
+    cfgfile.write('\n'.join([
+        '[cache]', 'cache_root = {}'.format(tmpdir),
+        '[runner]', 'backend = fake', 'admission = false',
+        '[fake]', 'startup_time = 0', 'task_duration = 0']))
+    configuration.load_configuration([
+        os.path.join(os.path.dirname(jobs.__file__), 'default.cfg'), str(cfgfile)])
+    recipe_file, config_file = tmpdir.join('recipe.yml'), tmpdir.join('config.yml')
+    recipe_file.write('diagnostics: {}\n')
+    config_file.write('output_dir: {}\n'.format(tmpdir.join('output')))
+    result = runner.run(str(recipe_file), str(config_file), response=Response())
+    assert result['success']
+    assert jobs.get(str(Response.uuid))['status'] == jobs.FINISHED
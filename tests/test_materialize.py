@@ -0,0 +1,63 @@
+import os
+
+from pywps import LiteralInput, Process
+from pywps.inout.literaltypes import AllowedValue
+from pywps.validator.allowed_value import ALLOWEDVALUETYPE
+
+from copernicus import materialize
+
+
+def make_process():
+    inputs = [
+        LiteralInput('season', 'Season', data_type='string',
+                     allowed_values=['DJF', 'JJA'], default='JJA'),
+        LiteralInput('window', 'Window', data_type='integer',
+                     allowed_values=AllowedValue(allowed_type=ALLOWEDVALUETYPE.RANGE, minval=1, maxval=3),
+                     default=2),
+    ]
+    return Process(lambda request, response: response, identifier='dummy', title='Dummy', inputs=inputs)
+
+
+def test_combinations_defaults_first():
+    combinations = list(materialize.combinations(make_process()))
+    assert combinations[0] == dict(season='JJA', window='2')
+    # only single input variations without a limit
+    assert len(combinations) == 4
+    assert dict(season='DJF', window='1') not in combinations
+    combinations = list(materialize.combinations(make_process(), limit=10))
+    assert len(combinations) == 6
+    assert len(set(tuple(sorted(c.items())) for c in combinations)) == 6
+    assert len(list(materialize.combinations(make_process(), limit=5))) == 5
+
+
+def test_combinations_fixed():
+    combinations = list(materialize.combinations(make_process(), fixed=dict(window=['1'])))
+    assert combinations == [dict(season='JJA', window='1'), dict(season='DJF', window='1')]
+
+
+def test_succeeded_parses_success_output():
+    template = ('<wps:ExecuteResponse xmlns:wps="http://www.opengis.net/wps/1.0.0" '
+                'xmlns:ows="http://www.opengis.net/ows/1.1"><wps:Status><wps:{}/></wps:Status>'
+                '<wps:ProcessOutputs><wps:Output><ows:Identifier>success</ows:Identifier>'
+                '<wps:Data><wps:LiteralData dataType="boolean">{}</wps:LiteralData></wps:Data>'
+                '</wps:Output></wps:ProcessOutputs></wps:ExecuteResponse>')
+    assert materialize.succeeded(template.format('ProcessSucceeded', 'True').encode())
+    assert not materialize.succeeded(template.format('ProcessSucceeded', 'False').encode())
+    assert not materialize.succeeded(template.format('ProcessFailed', 'True').encode())
+
+
+def test_fingerprint_cached_until_templates_change(monkeypatch, tmpdir):
+    for name in ('a.j2', 'b.j2'):
+        tmpdir.join(name).write(name)
+    monkeypatch.setattr(materialize, 'TEMPLATE_DIR', str(tmpdir))
+    monkeypatch.setattr(materialize, '_FINGERPRINTS', {})
+    process = make_process()
+    first = materialize.fingerprint(process)
+    reads = []
+    with monkeypatch.context() as patch:
+        patch.setattr('builtins.open', lambda *args, **kwargs: reads.append(args))
+        assert materialize.fingerprint(process) == first
+    assert reads == []
+    tmpdir.join('a.j2').write('changed')
+    os.utime(str(tmpdir.join('a.j2')), (1, 1))
+    assert materialize.fingerprint(process) != first
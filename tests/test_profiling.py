@@ -0,0 +1,40 @@
+import os
+
+from pywps import Service
+from pywps.tests import assert_response_success
+
+from . common import client_for
+from copernicus import profiling
+from copernicus.processes.wps_sleep import Sleep
+
+
+def test_sampler_collapsed_stacks(tmpdir):
+    sampler = profiling.Sampler()
+    sampler.sample()
+    path = sampler.write(str(tmpdir.join('profile.collapsed')))
+    lines = open(path).read().splitlines()
+    assert sampler.samples == 1
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+
+def test_wps_sleep_profiled(tmpdir, monkeypatch):
+    # the log file of the default configuration is written to the working directory
+    monkeypatch.chdir(tmpdir)
+    cfgfile = tmpdir.join('profiling.cfg')
+    cfgfile.write('\n'.join([
+        '[server]', 'outputpath = {}'.format(tmpdir.mkdir('outputs')), 'workdir = {}'.format(tmpdir.mkdir('work')),
+        '[profiling]', 'enabled = true', 'interval = 0.005']))
+    client = client_for(Service(processes=[Sleep()], cfgfiles=[
+        os.path.join(os.path.dirname(profiling.__file__), 'default.cfg'), str(cfgfile)]))
+    assert profiling.install()
+    datainputs = 'delay=0;updates=1;cpu=0.2'
+    resp = client.get(service='WPS', request='Execute', version='1.0.0', identifier='sleep',
+                      datainputs=datainputs)
+    assert_response_success(resp)
+    assert b'profile.collapsed' not in resp.data
+    resp = client.get(service='WPS', request='Execute', version='1.0.0', identifier='sleep',
+                      datainputs=datainputs, profile='true')
+    assert_response_success(resp)
+    assert b'profile.collapsed' in resp.data
+    profiles = tmpdir.join('outputs').visit('profile.collapsed')
+    assert 'burn (' in next(profiles).read()
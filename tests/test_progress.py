@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from copernicus import jobs
+from copernicus import progress
+
+LOG = """\
+2018-06-01 10:00:00,000 UTC [1] INFO    These tasks will be executed: diag/tas, diag/pr, diag/script1
+2018-06-01 10:00:01,000 UTC [1] INFO    Starting task diag/tas in process [1]
+2018-06-01 10:00:09,000 UTC [1] INFO    Successfully completed task diag/tas (priority 0) in 0:00:08
+2018-06-01 10:00:09,000 UTC [1] INFO    Starting task diag/pr in process [1]
+"""
+
+
+class DummyResponse(object):
+    def __init__(self):
+        self.updates = []
+
+    def update_status(self, message, status_percentage):
+        self.updates.append((message, status_percentage))
+
+
+@pytest.fixture
+def registry(tmpdir, monkeypatch):
+    monkeypatch.setattr(jobs, 'cache_root', lambda: str(tmpdir))
+
+
+def test_progress_from_log():
+    tracker = progress.Progress(predicted=60)
+    assert tracker.percentage() == 20
+    assert tracker.remaining(10) == 50
+    for line in LOG.splitlines():
+        tracker.feed(line)
+    assert tracker.total == 3
+    # one task done and one started of three
+    assert tracker.percentage() == 20 + int(60 * 1.3 / 3)
+    assert 0 < tracker.remaining(20) < 60
+    assert "1 of 3 tasks done" in tracker.message(20)
+
+
+def test_reporter_tails_log(tmpdir, registry, monkeypatch):
+    monkeypatch.setattr(progress.configuration, 'get_config_value', lambda section, option: '0')
+    logfile = tmpdir.join('main_log.txt')
+    result_file = tmpdir.join('runner_result.json')
+    result_file.write(json.dumps(dict(logfile=str(logfile))))
+    response = DummyResponse()
+    reporter = progress.Reporter('job1', str(result_file), response)
+    reporter.poll()
+    lines = LOG.splitlines(True)
+    # the last line is incomplete at first
+    logfile.write(''.join(lines[:3]) + lines[3][:20])
+    reporter.poll()
+    assert reporter.progress.completed == set(['diag/tas'])
+    assert reporter.progress.started == set(['diag/tas'])
+    logfile.write(lines[3][20:], mode='a')
+    reporter.poll()
+    assert reporter.progress.started == set(['diag/tas', 'diag/pr'])
+    assert [percentage for _, percentage in response.updates] == [20, 40, 46]
+    assert jobs.get('job1')['progress'] == 46
@@ -0,0 +1,53 @@
+import os
+import json
+
+import numpy as np
+
+from copernicus import reference
+
+PREPROCESSOR = dict(
+    extract_levels=dict(levels=50000, scheme='linear'),
+    regrid=dict(target_grid='2.5x2.5', lat_offset=False, scheme='linear_extrapolate'),
+    extract_region=dict(start_latitude=1.25, end_latitude=90.))
+
+
+def recipe():
+    return dict(
+        datasets=[
+            dict(dataset='EC-EARTH', project='CMIP5', exp='historical', ensemble='r2i1p1',
+                 start_year=1980, end_year=1989),
+            dict(dataset='ERA-Interim', project='OBS', type='reanaly', version=1, tier=3,
+                 start_year=1980, end_year=1989)],
+        preprocessors=dict(preproc1=PREPROCESSOR),
+        diagnostics=dict(miles=dict(variables=dict(
+            zg=dict(preprocessor='preproc1', mip='day', field='T3D')))))
+
+
+def test_recipe_specs():
+    specs = reference.recipe_specs(recipe())
+    assert len(specs) == 1
+    requirement, spec = specs[0]
+    assert spec['dataset'] == 'ERA-Interim'
+    assert spec['level'] == 50000.
+    assert spec['lat_offset'] is False
+    assert reference.reference_spec(requirement, dict(PREPROCESSOR, mask_landsea={})) is None
+
+
+def test_stock_grid():
+    grid = reference.stock_grid('2.5x2.5', lat_offset=False)
+    assert len(grid['lat']) == 73 and grid['lat'][-1] == 90.
+    assert len(grid['lon']) == 144 and grid['lon'][0] == 1.25
+    assert reference._level_weights(np.array([85000., 50000.]), 50000.) == ([1], [1.])
+    indices, weights = reference._level_weights(np.array([100000., 60000., 40000.]), 50000.)
+    assert sorted(indices) == [1, 2] and np.allclose(sorted(weights), [0.5, 0.5])
+
+
+def test_reference_root_for(tmpdir, monkeypatch):
+    monkeypatch.setattr(reference, 'store_root', lambda: str(tmpdir.join('store')))
+    recipe_file = tmpdir.join('recipe.yml')
+    recipe_file.write(json.dumps(recipe()))
+    assert reference.reference_root_for(str(recipe_file)) is None
+    _, spec = reference.recipe_specs(recipe())[0]
+    os.makedirs(reference.spec_dir(spec))
+    reference._update_manifest(spec, list(range(1979, 1990)))
+    assert reference.reference_root_for(str(recipe_file)) == reference.spec_dir(spec)
@@ -0,0 +1,33 @@
+import copy
+import sys
+
+from pywps import Service
+
+from copernicus.processes import registry
+from .common import client_for
+
+
+def test_process_constructed_on_first_use(monkeypatch):
+    monkeypatch.delitem(sys.modules, 'copernicus.processes.wps_sleep', raising=False)
+    loaded = []
+    monkeypatch.setattr(registry, 'on_load', [loaded.append])
+    process = registry.LazyProcess('sleep', 'Sleep Process', 'copernicus.processes.wps_sleep:Sleep')
+    service = Service(processes=[process])
+    assert not process.loaded
+    assert 'copernicus.processes.wps_sleep' not in sys.modules
+    resp = client_for(service).get(service='wps', request='describeprocess', version='1.0.0', identifier='sleep')
+    assert resp.status_code == 200
+    assert process.loaded
+    assert [p.identifier for p in loaded] == ['sleep']
+    # pywps executes a copy of the constructed process
+    assert type(copy.deepcopy(process)).__name__ == 'Sleep'
+
+
+def test_registry_matches_processes():
+    import importlib
+    from copernicus.processes import PROCESSES, processes
+    assert [process.identifier for process in processes] == [identifier for identifier, _, _ in PROCESSES]
+    for identifier, title, path in PROCESSES:
+        module, classname = path.split(':')
+        process = getattr(importlib.import_module('copernicus.processes.' + module), classname)()
+        assert (process.identifier, process.title) == (identifier, title), path
@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+
+from copernicus import regrid  # noqa: E402
+from copernicus.cache import Cache  # noqa: E402
+
+
+def grid(dlat, dlon):
+    return dict(lat=np.arange(-90 + dlat / 2., 90, dlat), lon=np.arange(dlon / 2., 360, dlon))
+
+
+def test_linear_weights_reproduce_linear_field():
+    source, target = grid(10, 10), grid(5, 5)
+    weights = regrid.compute_weights(source, target, 'linear')
+    field = np.add.outer(source['lat'], np.zeros(len(source['lon'])))
+    result = regrid.apply_weights(weights, field[np.newaxis], 'linear', (36, 72))
+    inside = (target['lat'] > -85) & (target['lat'] < 85)
+    assert np.allclose(result[0][inside], np.add.outer(target['lat'][inside], np.zeros(72)))
+    # outside the source latitudes nothing is extrapolated
+    assert result.mask[0][~inside].all()
+
+
+def test_area_weighted_conserves_mean():
+    source, target = grid(2, 2), grid(6, 6)
+    weights = regrid.compute_weights(source, target, 'area_weighted')
+    data = np.random.RandomState(0).rand(3, 90, 180)
+    result = regrid.apply_weights(weights, data, 'area_weighted', (30, 60))
+
+    def mean(values, lat):
+        return np.average(values.mean(axis=-1), weights=np.cos(np.deg2rad(lat)), axis=-1)
+    assert np.allclose(mean(result, target['lat']), mean(data, source['lat']), atol=1e-3)
+
+
+def test_weights_are_cached(tmpdir, monkeypatch):
+    monkeypatch.setattr(regrid, 'Cache', lambda namespace: Cache(namespace, root=str(tmpdir)))
+    source, target = grid(10, 10), grid(5, 5)
+    first = regrid.get_weights(source, target, 'nearest')
+    regrid._WEIGHTS.clear()
+    second = regrid.get_weights(source, target, 'nearest')
+    assert (first != second).nnz == 0
+    assert len(tmpdir.join('regrid').listdir()) == 1
+
+
+def test_regridded_points_of_coord_spanning_one_grid_dim():
+    source, target = grid(10, 10), grid(5, 5)
+    weights = regrid.compute_weights(source, target, 'linear')
+    # a (time, lat) coordinate of a (time, lat, lon) cube
+    points = np.add.outer([0., 1.], source['lat'])
+    result, dims = regrid._regridded_points(
+        weights, points, (0, 1), (1, 2), 'linear', (18, 36), (36, 72))
+    assert dims == (0, 1)
+    assert result.shape == (2, 36)
+    inside = (target['lat'] > -85) & (target['lat'] < 85)
+    assert np.allclose(result[:, inside], np.add.outer([0., 1.], target['lat'][inside]))
+    assert np.isnan(result[:, ~inside]).all()
+
+
+def test_regridded_cube_keeps_metadata_and_dtype():
+    iris = pytest.importorskip('iris')
+    from iris.coords import AuxCoord, CellMeasure, DimCoord
+
+    def make_cube(lat, lon, dtype):
+        cube = iris.cube.Cube(np.zeros((2, len(lat), len(lon)), dtype=dtype), var_name='tas')
+        cube.add_dim_coord(DimCoord([0., 1.], standard_name='time', units='days since 2000-01-01'), 0)
+        cube.add_dim_coord(DimCoord(lat, standard_name='latitude', units='degrees'), 1)
+        cube.add_dim_coord(DimCoord(lon, standard_name='longitude', units='degrees'), 2)
+        return cube
+
+    source, target = grid(10, 10), grid(5, 5)
+    cube = make_cube(source['lat'], source['lon'], 'f4')
+    cube.add_aux_coord(AuxCoord(np.ones((18, 36), dtype='f4'), long_name='land_fraction'), (1, 2))
+    cube.add_cell_measure(CellMeasure(np.ones((18, 36)), measure='area', var_name='areacella', units='m2'),
+                          (1, 2))
+    target_cube = make_cube(target['lat'], target['lon'], 'f8')
+    weights = regrid.compute_weights(source, target, 'area_weighted')
+    data = regrid.apply_weights(weights, cube.data, 'area_weighted', (36, 72))
+    result = regrid._regridded_cube(cube, target_cube, data, weights, 'area_weighted')
+    assert result.dtype == np.float32
+    assert result.coord('land_fraction').shape == (36, 72)
+    assert result.coord('land_fraction').dtype == np.float32
+    areas = result.cell_measure('areacella').data
+    assert np.isclose(areas.sum(), 4 * np.pi * 6371000. ** 2)
+
+
+def test_cached_regrid_matches_original_with_offsets(tmpdir, monkeypatch):
+    iris = pytest.importorskip('iris')
+    _regrid = pytest.importorskip('esmvaltool.preprocessor._regrid')
+    from iris.coords import DimCoord
+    monkeypatch.setattr(regrid, 'Cache', lambda namespace: Cache(namespace, root=str(tmpdir)))
+    monkeypatch.setattr(regrid, '_TARGETS', {})
+
+    source = grid(10, 10)
+    cube = iris.cube.Cube(np.add.outer(source['lat'], np.zeros(36)), var_name='tas')
+    cube.add_dim_coord(DimCoord(source['lat'], standard_name='latitude', units='degrees'), 0)
+    cube.add_dim_coord(DimCoord(source['lon'], standard_name='longitude', units='degrees'), 1)
+    original = getattr(_regrid.regrid, 'original', _regrid.regrid)
+    cached = regrid.cached_regrid(original)
+
+    for lat_offset in (True, False):
+        expected = original(cube, '5x5', 'linear', lat_offset=lat_offset)
+        result = cached(cube, '5x5', 'linear', lat_offset=lat_offset)
+        assert np.allclose(result.coord('latitude').points, expected.coord('latitude').points)
+        assert np.allclose(result.coord('longitude').points, expected.coord('longitude').points)
+        assert np.ma.allclose(result.data, expected.data)
+    assert set(regrid._TARGETS) == {('5x5', True, True), ('5x5', False, True)}
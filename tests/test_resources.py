@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+import subprocess
+
+from copernicus import jobs
+from copernicus import resources
+
+BUSY = "x = bytearray(50 * 1024 * 1024)\nimport time\nt = time.time()\nwhile time.time() - t < 1: pass\n"
+
+
+def test_sampler_records_peak_rss_and_cpu():
+    child = subprocess.Popen([sys.executable, '-c', BUSY])
+    sampler = resources.ResourceSampler(child.pid)
+    while child.poll() is None:
+        sampler.sample()
+        time.sleep(0.05)
+    summary = sampler.summary()
+    assert summary['peak_rss'] > 50 * 1024 * 1024
+    assert summary['cpu_seconds'] > 0.5
+    assert summary['peak_processes'] == 1
+
+
+def test_history_and_prometheus(tmpdir, monkeypatch):
+    monkeypatch.setattr(jobs, 'cache_root', lambda: str(tmpdir))
+    for rss in (100, 300):
+        resources.record(dict(job_id='a', process='blocking', status='finished', duration=1.,
+                              resources=dict(peak_rss=rss, cpu_seconds=2.)))
+    assert [entry['peak_rss'] for entry in resources.history('blocking')] == [100, 300]
+    assert resources.history('cvdp') == []
+    text = resources.prometheus()
+    assert 'copernicus_job_runs{process="blocking"} 2' in text
+    assert 'copernicus_job_peak_rss{process="blocking"} 300' in text
+
+
+def test_history_is_compacted_without_losing_totals(tmpdir, monkeypatch):
+    monkeypatch.setattr(jobs, 'cache_root', lambda: str(tmpdir))
+    monkeypatch.setattr(resources, 'history_size', lambda: 3)
+    monkeypatch.setattr(resources, 'history_max_size', lambda: 2000)
+    for index in range(40):
+        resources.record(dict(job_id='job{}'.format(index), process='blocking' if index % 2 else 'cvdp',
+                              status='finished', resources=dict(peak_rss=index, cpu_seconds=1.)))
+        assert 'copernicus_job_runs{{process="cvdp"}} {}'.format(index // 2 + 1) in resources.prometheus()
+    assert os.path.getsize(resources.history_file()) <= 2000
+    assert [entry['job_id'] for entry in resources.history('blocking')] == ['job35', 'job37', 'job39']
+    text = resources.prometheus()
+    assert 'copernicus_job_runs{process="cvdp"} 20' in text
+    assert 'copernicus_job_cpu_seconds{process="cvdp"} 20.0' in text
+    assert 'copernicus_job_peak_rss{process="blocking"} 39' in text
@@ -0,0 +1,85 @@
+import os
+
+from copernicus import staging
+from copernicus.staging import Stager
+
+
+def make_files(root, count, size=100):
+    files = []
+    for i in range(count):
+        path = os.path.join('tas', 'file{}.nc'.format(i))
+        if not os.path.isdir(os.path.join(root, 'tas')):
+            os.makedirs(os.path.join(root, 'tas'))
+        with open(os.path.join(root, path), 'wb') as fp:
+            fp.write(b'x' * size)
+        files.append(('CMIP5', path))
+    return files
+
+
+def test_stage_copies_once(tmpdir):
+    source = str(tmpdir.mkdir('archive'))
+    files = make_files(source, 3)
+    stager = Stager(str(tmpdir.mkdir('scratch')), max_size=1000)
+    assert stager.stage(files, dict(CMIP5=source)) == 300
+    assert os.path.exists(stager.target('CMIP5', files[0][1]))
+    assert stager.stage(files, dict(CMIP5=source)) == 0
+
+
+def test_evict_least_recently_used(tmpdir):
+    source = str(tmpdir.mkdir('archive'))
+    files = make_files(source, 3)
+    stager = Stager(str(tmpdir.mkdir('scratch')), max_size=200)
+    stager.stage(files[:1], dict(CMIP5=source))
+    os.utime(stager.target(*files[0]), (1, 1))
+    stager.stage(files[1:2], dict(CMIP5=source), pin='job')
+    os.utime(stager.target(*files[1]), (0, 0))
+    # file1 is older but pinned by this (live) process
+    stager.stage(files[2:], dict(CMIP5=source))
+    assert not os.path.exists(stager.target(*files[0]))
+    assert os.path.exists(stager.target(*files[1]))
+    assert os.path.exists(stager.target(*files[2]))
+    stager.release('job')
+    assert os.listdir(stager.pin_dir) == []
+
+
+def test_staged_files_are_not_evicted_while_copying(tmpdir):
+    source = str(tmpdir.mkdir('archive'))
+    files = make_files(source, 2)
+    scratch = str(tmpdir.mkdir('scratch'))
+    stager = Stager(scratch, max_size=200)
+    stager.stage(files[:1], dict(CMIP5=source))
+    other = Stager(scratch, max_size=200)
+    copy = stager._copy
+
+    def copy_and_evict(source, target):
+        # a concurrent stager needs the whole scratch
+        other.evict(200)
+        copy(source, target)
+
+    stager._copy = copy_and_evict
+    stager.stage(files, dict(CMIP5=source))
+    assert os.path.exists(stager.target(*files[0]))
+    assert os.path.exists(stager.target(*files[1]))
+    assert os.listdir(stager.pin_dir) == []
+
+
+def test_prefetch_renders_recipe_of_handler(tmpdir, monkeypatch):
+    import yaml
+
+    cfgfile = tmpdir.join('prefetch.cfg')
+    with cfgfile.open('w') as fp:
+        staging.configuration.CONFIG.write(fp)
+    staged, messages = [], []
+    monkeypatch.setattr(staging, '_first_stored', lambda: type('Stored', (), dict(uuid='a'))())
+    monkeypatch.setattr(staging, 'stage_recipe', lambda recipe_file, skip=(): staged.append(
+        yaml.safe_load(open(recipe_file))))
+    monkeypatch.setattr(staging.LOGGER, 'info', lambda message, *args: messages.append(message % args))
+    monkeypatch.setattr(staging, '_stored_inputs', lambda stored: ('blocking', dict(
+        model='MPI-ESM-LR', experiment='historical', ensemble='r1i1p1', season='DJF',
+        start_year=1990, end_year=1995)))
+    staging._prefetch(str(cfgfile))
+    assert [dataset['dataset'] for dataset in staged[0]['datasets']] == ['MPI-ESM-LR', 'ERA-Interim']
+    monkeypatch.setattr(staging, '_stored_inputs', lambda stored: ('sleep', {}))
+    staging._prefetch(str(cfgfile))
+    assert len(staged) == 1
+    assert messages[-1] == 'not prefetching stored job a: process sleep has no recipe'
@@ -0,0 +1,32 @@
+from copernicus import startup
+
+STDERR = """\
+copernicus-phase: import copernicus.cli
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 |     jinja2.utils
+import time:       200 |        300 |   jinja2
+import time:        50 |         50 |   click
+import time:        10 |        360 | copernicus.cli
+copernicus-phase: create_app
+import time:        40 |         40 | copernicus.processes.wps_sleep
+copernicus-phase: 
+"""
+
+
+def test_parse_importtime():
+    imports = startup.parse_importtime(STDERR.splitlines())
+    root, = imports['import copernicus.cli']
+    assert root.name == 'copernicus.cli'
+    assert [child.name for child in root.children] == ['jinja2', 'click']
+    assert root.children[0].children[0].name == 'jinja2.utils'
+    timings = [('import copernicus.cli', 0.0004), ('create_app', 0.0001)]
+    assert startup.folded_stacks(timings, imports) == [
+        'import copernicus.cli 40',
+        'import copernicus.cli;copernicus.cli 10',
+        'import copernicus.cli;copernicus.cli;jinja2 200',
+        'import copernicus.cli;copernicus.cli;jinja2;jinja2.utils 100',
+        'import copernicus.cli;copernicus.cli;click 50',
+        'create_app 60',
+        'create_app;copernicus.processes.wps_sleep 40',
+    ]
+    assert 'jinja2.utils' in startup.format_report(timings, imports)
@@ -0,0 +1,53 @@
+import time
+
+import pytest
+from pywps.response.status import WPS_STATUS
+
+from copernicus import status
+
+
+class DummyResponse(object):
+    uuid = 'job1'
+
+
+def test_coalescer_writes_latest_at_bounded_rate():
+    writes = []
+    coalescer = status.StatusCoalescer(
+        lambda response, state, message, percentage, clean: writes.append((state, percentage)), interval=0.5)
+    response = DummyResponse()
+    coalescer.update(response, WPS_STATUS.STARTED, 'started', 0)
+    for percentage in range(20, 80, 10):
+        coalescer.update(response, WPS_STATUS.STARTED, 'running', percentage)
+    assert writes == [(WPS_STATUS.STARTED, 0)]
+    assert response.status_percentage == 70
+    time.sleep(0.7)
+    # only the latest pending update is written
+    assert writes == [(WPS_STATUS.STARTED, 0), (WPS_STATUS.STARTED, 70)]
+    coalescer.update(response, WPS_STATUS.STARTED, 'running', 75)
+    coalescer.update(response, WPS_STATUS.SUCCEEDED, 'done', 100)
+    # the final status is written immediately and replaces the pending one
+    assert writes[-1] == (WPS_STATUS.SUCCEEDED, 100)
+    time.sleep(0.5)
+    assert writes[-1] == (WPS_STATUS.SUCCEEDED, 100)
+    assert coalescer.writes == 3
+
+
+def test_locked_database_writes_are_retried(monkeypatch):
+    import sqlite3
+    monkeypatch.setattr(status.time, 'sleep', lambda seconds: None)
+    calls = []
+
+    def write(value):
+        calls.append(value)
+        if len(calls) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        return value
+
+    assert status.write_retrying(write, 'a') == 'a'
+    assert len(calls) == 3
+
+    def fail(value):
+        raise sqlite3.OperationalError('no such table')
+
+    with pytest.raises(sqlite3.OperationalError):
+        status.write_retrying(fail, 'a')
@@ -0,0 +1,24 @@
+from copernicus import runner
+from copernicus import templating
+
+
+def test_precompile_uses_bytecode_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(templating, 'cache_root', lambda: str(tmpdir))
+    env = templating.environment('templates/esmvaltool')
+    templating.precompile(env)
+    assert len(tmpdir.join('jinja').listdir()) == len(env.list_templates())
+    # a new worker loads the compiled templates
+    fresh = templating.environment('templates/esmvaltool')
+    compiled = []
+    monkeypatch.setattr(fresh, 'compile', lambda *args, **kwargs: compiled.append(args))
+    fresh.get_template('config.yml')
+    assert compiled == []
+
+
+def test_config_rendered_once(tmpdir, monkeypatch):
+    monkeypatch.setattr(templating, 'cache_root', lambda: str(tmpdir))
+    template = runner.template_env.get_template('config.yml')
+    first = runner._render_config(template, '/archive', '/obs', 'png')
+    assert runner._render_config(template, '/archive', '/obs', 'png') is first
+    assert 'output_dir: {}'.format(runner.OUTPUT_DIR) in first
+    assert 'CMIP5: /archive' in first
@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+from copernicus import catalog, testdata
+
+
+def test_plan_matches_recipe():
+    files = dict((relpath, (project, start, end))
+                 for project, relpath, _, start, end in testdata.plan(identifiers=['blocking']))
+    assert files == {
+        'ICHEC/EC-EARTH/historical/day/atmos/day/r2i1p1/zg/latest/'
+        'zg_day_EC-EARTH_historical_r2i1p1_19800101-19891231.nc': ('CMIP5', 1980, 1989),
+        'Tier3/ERA-Interim/OBS_ERA-Interim_reanaly_1_T3D_zg_19800101-19891231.nc': ('OBS', 1980, 1989),
+    }
+    files = testdata.plan(identifiers=['blocking'], years=(1980, 1984), years_per_file=2)
+    assert [(start, end) for _, _, _, start, end in files] == [(1980, 1981), (1982, 1983), (1984, 1984)] * 2
+
+
+def test_generated_data_in_catalog(tmpdir):
+    pytest.importorskip('netCDF4')
+    root = str(tmpdir)
+    written = list(testdata.generate(root, resolution=30., identifiers=['cvdp'], years=(2000, 2000)))
+    assert written and all(flag for _, flag in written)
+    assert all(not flag for _, flag in testdata.generate(root, identifiers=['cvdp'], years=(2000, 2000)))
+    data = catalog.Catalog.scan(dict(CMIP5=os.path.join(root, 'CMIP5'), OBS=os.path.join(root, 'OBS')))
+    from copernicus.processes import processes
+    cvdp, = [process for process in processes if process.identifier == 'cvdp']
+    requirements = [dict(requirement, start_year=2000, end_year=2000)
+                    for requirement in testdata.process_requirements(cvdp)]
+    assert requirements and all(data.check(requirement) is None for requirement in requirements)
+
+
+def test_render_recipe_with_request_inputs():
+    import yaml
+    from copernicus.processes import processes
+    blocking, = [process for process in processes if process.identifier == 'blocking']
+    recipe = yaml.safe_load(testdata.render_recipe(blocking, inputs=dict(model='MPI-ESM-LR', start_year=1990)))
+    datasets = [dataset for dataset in catalog.recipe_requirements(recipe) if dataset['project'] == 'CMIP5']
+    assert [(dataset['dataset'], dataset['start_year']) for dataset in datasets] == [('MPI-ESM-LR', 1990)]
@@ -0,0 +1,56 @@
+import os
+import json
+
+from pywps import Service
+from pywps.tests import assert_response_success
+
+from . common import client_for, ROOT
+from copernicus import tracing
+from copernicus.processes.wps_blocking import Blocking
+
+
+def test_task_spans(tmpdir, monkeypatch):
+    exported = []
+    monkeypatch.setattr(tracing, 'export', exported.append)
+    logfile = tmpdir.join('main_log.txt')
+    logfile.write('\n'.join([
+        '2019-01-01 10:00:00,000 UTC [1] INFO    Starting task diag/zg in process [1]',
+        '2019-01-01 10:00:01,500 UTC [1] INFO    Successfully completed task diag/zg',
+        '2019-01-01 10:00:02,000 UTC [1] INFO    Starting task diag/script in process [1]']))
+    parent = tracing.Span('esmvaltool', '0' * 32)
+    tracing.task_spans(parent, str(logfile), end=1546336805.)
+    assert [(span.name, span.end - span.start, span.error) for span in exported] == [
+        ('task diag/zg', 1.5, None), ('task diag/script', 3., 'not completed')]
+    assert all(span.parent_id == parent.span_id for span in exported)
+
+
+def test_wps_blocking_traced(tmpdir, monkeypatch):
+    # the log file of the default configuration is written to the working directory
+    monkeypatch.chdir(tmpdir)
+    # the runner is started with python -m copernicus.runner
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+    traces = tmpdir.join('traces.jsonl')
+    cfgfile = tmpdir.join('tracing.cfg')
+    cfgfile.write('\n'.join([
+        '[server]', 'outputpath = {}'.format(tmpdir.mkdir('outputs')), 'workdir = {}'.format(tmpdir.mkdir('work')),
+        '[data]', 'preflight = false',
+        '[cache]', 'cache_root = {}'.format(tmpdir.mkdir('cache')),
+        '[runner]', 'backend = fake', 'admission = false',
+        '[fake]', 'startup_time = 0', 'task_duration = 0.01', 'plot_size = 0.001mb', 'data_size = 0.001mb',
+        '[tracing]', 'enabled = true', 'file = {}'.format(traces)]))
+    client = client_for(Service(processes=[Blocking()], cfgfiles=[
+        os.path.join(os.path.dirname(tracing.__file__), 'default.cfg'), str(cfgfile)]))
+    assert tracing.install()
+    resp = client.get(service='WPS', request='Execute', version='1.0.0', identifier='blocking')
+    assert_response_success(resp)
+    spans = [json.loads(line)['resourceSpans'][0]['scopeSpans'][0]['spans'][0] for line in traces.readlines()]
+    names = [span['name'] for span in spans]
+    for name in ('execute blocking', 'handler', 'render recipe', 'esmvaltool',
+                 'task miles_diagnostics/zg', 'task miles_diagnostics/miles_block', 'compress output'):
+        assert name in names
+    trace_id = spans[0]['traceId']
+    assert set(span['traceId'] for span in spans) == {trace_id}
+    assert 'parentSpanId' not in spans[names.index('execute blocking')]
+    # the published main_log.txt
+    logs = [path.read() for path in tmpdir.join('outputs').visit('*.txt')]
+    assert any('trace_id={}'.format(trace_id) in log for log in logs)
@@ -0,0 +1,61 @@
+import os
+import time
+import signal
+import socket
+import multiprocessing
+from six.moves.urllib.request import urlopen
+
+from copernicus import watchdog
+
+
+def app_factory():
+    def application(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [str(os.getpid()).encode('utf-8')]
+    return application
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_recycle_reason():
+    limits = dict(max_requests=10, max_rss=0, max_fds=100)
+    assert watchdog.recycle_reason(dict(requests=3, rss=10 ** 9, fds=10), limits) is None
+    assert 'requests' in watchdog.recycle_reason(dict(requests=10, rss=0, fds=10), limits)
+    assert 'fds' in watchdog.recycle_reason(dict(requests=0, rss=0, fds=200), limits)
+
+
+def test_only_execute_requests_are_counted():
+    assert watchdog.is_execute(dict(REQUEST_METHOD='GET', QUERY_STRING='service=WPS&Request=Execute'))
+    assert watchdog.is_execute(dict(REQUEST_METHOD='POST', PATH_INFO='/wps'))
+    assert not watchdog.is_execute(dict(REQUEST_METHOD='GET', QUERY_STRING='request=DescribeProcess&'
+                                                                         'identifier=execute'))
+    assert not watchdog.is_execute(dict(REQUEST_METHOD='POST', PATH_INFO='/jobs/abc/cancel'))
+
+
+def test_worker_is_recycled_without_dropping_requests():
+    port = free_port()
+    limits = dict(max_requests=3, max_rss=0, max_fds=0, check_interval=0.2)
+    supervisor = watchdog.Supervisor(app_factory, '127.0.0.1', port, limits=limits)
+    process = multiprocessing.get_context('fork').Process(target=supervisor.serve_forever)
+    process.start()
+    try:
+        pids = []
+        deadline = time.time() + 20
+        while len(set(pids)) < 2 and time.time() < deadline:
+            try:
+                pids.append(urlopen('http://127.0.0.1:{}/?request=Execute'.format(port), timeout=5).read())
+            except IOError:
+                # supervisor not listening yet
+                assert not pids
+            time.sleep(0.05)
+        assert len(set(pids)) >= 2
+    finally:
+        os.kill(process.pid, signal.SIGTERM)
+        process.join(10)
+    assert process.exitcode == 0
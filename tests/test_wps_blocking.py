@@ -13,3 +13,21 @@ def test_wps_blocking():
         service='WPS', request='Execute', version='1.0.0', identifier='blocking')
     print(resp.data)
     assert_response_success(resp)
+
+
+def test_wps_blocking_reports_missing_data(tmpdir, monkeypatch):
+    from lxml import etree
+    from copernicus import catalog
+
+    archive = tmpdir.mkdir('archive').mkdir('EC-EARTH').mkdir('historical')
+    archive.join('zg_day_EC-EARTH_historical_r2i1p1_19500101-19741231.nc').write('')
+    monkeypatch.setattr(catalog, 'get_catalog',
+                        lambda: catalog.Catalog.scan(dict(CMIP5=str(tmpdir.join('archive')))))
+    monkeypatch.setattr(catalog, 'cache_root', lambda: str(tmpdir.join('cache')))
+    client = client_for(Service(processes=[Blocking()], cfgfiles=[".custom.cfg"]))
+    resp = client.get(
+        service='WPS', request='Execute', version='1.0.0', identifier='blocking')
+    texts = etree.fromstring(resp.data).xpath('//*[local-name()="ExceptionText"]/text()')
+    assert len(texts) == 1
+    assert texts[0].startswith('Process error: requested data is not available: ')
+    assert len(texts[0]) <= len('Process error: ') + catalog.MAX_MESSAGE_LENGTH
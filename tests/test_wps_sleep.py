@@ -16,3 +16,16 @@ def test_wps_sleep():
         datainputs=datainputs)
     print(resp.data)
     assert_response_success(resp)
+
+
+@pytest.mark.slow
+def test_wps_sleep_load():
+    client = client_for(Service(processes=[Sleep()]))
+    datainputs = "delay=0;updates=2;cpu=0.3;workers=2;memory=8;files=3;file_size=0.1"
+    resp = client.get(
+        service='WPS', request='Execute', version='1.0.0', identifier='sleep',
+        datainputs=datainputs)
+    assert_response_success(resp)
+    assert b'sleep_result.zip' in resp.data
+    # 3 files of 0.1 MB written
+    assert b'314571' in resp.data